@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: batch risk scoring per row vs once per unique feature tuple.
+
+The roster is joined to one day of AQI values (one per ZIP), so repetition
+matches what predict_risk_batch sees inside an analysis.
+
+Usage (from backend_python/):
+    python benchmarks/bench_dedup_scoring.py --rows 1000000 --zips 30000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+
+def score_every_row(df: pd.DataFrame) -> np.ndarray:
+    """Previous implementation: int64 column stack, every row scored."""
+    features = np.column_stack([
+        df['Age'].astype(int),
+        df['AQI'].astype(int),
+        df['diabetes'].astype(int),
+        df['hypertension'].astype(int),
+        df['heart_disease'].astype(int)
+    ])
+    return utils._risk_percentages(features)
+
+
+def make_frame(rows: int, zips: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    zip_aqi = rng.integers(0, 300, zips)
+    zip_codes = rng.integers(0, zips, rows)
+    return pd.DataFrame({
+        'Age': rng.integers(18, 95, rows),
+        'AQI': zip_aqi[zip_codes],
+        'diabetes': rng.integers(0, 2, rows),
+        'hypertension': rng.integers(0, 2, rows),
+        'heart_disease': rng.integers(0, 2, rows),
+    })
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--zips', type=int, default=30_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    scorer = parser.add_mutually_exclusive_group()
+    scorer.add_argument('--risk-table', action='store_true', help='score through the precomputed risk table')
+    scorer.add_argument('--sklearn', action='store_true', help='score through sklearn instead of the fast scorer')
+    args = parser.parse_args()
+
+    utils.USE_RISK_TABLE = args.risk_table
+    utils.load_model()
+    if args.sklearn:
+        utils.model_data['fast_scorer'] = None
+    df = make_frame(args.rows, args.zips)
+
+    # Both implementations must agree before timing them
+    np.testing.assert_array_equal(utils.predict_risk_batch(df), score_every_row(df))
+
+    _, unique_rows = utils.unique_feature_rows(utils.feature_columns(df))
+    every_row_seconds = best_of(lambda: score_every_row(df), args.repeat)
+    dedup_seconds = best_of(lambda: utils.predict_risk_batch(df), args.repeat)
+
+    print(f"rows:          {args.rows}")
+    print(f"unique tuples: {len(unique_rows)}")
+    print(f"dedup ratio:   {args.rows / len(unique_rows):.1f} rows per tuple")
+    print(f"every row:     {every_row_seconds * 1000:.1f} ms")
+    print(f"deduplicated:  {dedup_seconds * 1000:.1f} ms")
+    print(f"speedup:       {every_row_seconds / dedup_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: AQI lift join via pandas merge vs cached categorical gather.
+
+Usage (from backend_python/):
+    python benchmarks/bench_lift_join.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import calc_inpatient_dollars_increase, load_lift_table  # noqa: E402
+
+LIFT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'aqi_lift_ip_pnpm.csv')
+
+
+def merge_lift(df: pd.DataFrame) -> pd.DataFrame:
+    """Previous implementation: re-read the lift CSV, copy and merge on every call."""
+    lift_df = pd.read_csv(LIFT_PATH)
+    working_df = df.copy()
+    working_df = working_df.merge(
+        lift_df[['LOB', 'aqi_category', 'lift_vs_baseline']],
+        on=['LOB', 'aqi_category'],
+        how='left'
+    )
+    working_df['inpatient_cost_increase'] = working_df['zip_base_pred_IP_PMPM'] * (working_df['lift_vs_baseline'].fillna(1) - 1)
+    return working_df
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    lift = load_lift_table()
+    lobs = list(lift['lobs']) + ['UNKNOWN']
+    categories = list(lift['categories'])
+    return pd.DataFrame({
+        'plan_zip': rng.integers(10000, 99999, rows),
+        'Age': rng.integers(18, 95, rows),
+        'LOB': rng.choice(lobs, rows),
+        'aqi_category': rng.choice(categories, rows),
+        'zip_base_pred_IP_PMPM': rng.random(rows) * 100,
+        'risk_percentage': rng.random(rows) * 100,
+    })
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+
+    # Both implementations must agree before timing them
+    expected = merge_lift(df)
+    actual = calc_inpatient_dollars_increase(df.copy())
+    np.testing.assert_allclose(actual['inpatient_cost_increase'].to_numpy(), expected['inpatient_cost_increase'].to_numpy())
+    np.testing.assert_allclose(actual['lift_vs_baseline'].to_numpy(), expected['lift_vs_baseline'].to_numpy())
+
+    merge_seconds = best_of(lambda: merge_lift(df), args.repeat)
+    gather_seconds = best_of(lambda: calc_inpatient_dollars_increase(df), args.repeat)
+
+    print(f"rows:   {args.rows}")
+    print(f"merge:  {merge_seconds * 1000:.1f} ms")
+    print(f"gather: {gather_seconds * 1000:.1f} ms")
+    print(f"speedup: {merge_seconds / gather_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
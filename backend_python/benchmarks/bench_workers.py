@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Worker-scaling benchmark: per-worker memory of serve.py (preloaded master,
+forked workers) vs `uvicorn --workers` (every worker loads its own copy).
+
+For each worker count, both launchers are started on a synthetic weather file
+with the risk lookup table on. Requests that load the weather store are sent
+until every worker has served some, then each process's memory is read from
+/proc/<pid>/smaps_rollup:
+- RSS: resident pages, shared ones included (overstates shared memory)
+- PSS: shared pages split between the processes sharing them (sums to the real total)
+- USS: pages private to the process (what one more worker costs)
+A short /api/compute_risk load reports throughput as well. Linux only.
+
+Usage (from backend_python/):
+    python benchmarks/bench_workers.py --workers 1 2 4 --zips 20000 --dates 60
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+
+STARTUP_TIMEOUT_SECONDS = 120
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def smaps_rollup(pid: int) -> dict:
+    """RSS, PSS and USS (private clean + dirty) of one process, in bytes."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {'rss': values.get('Rss', 0), 'pss': values.get('Pss', 0),
+            'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)}
+
+
+def children(pid: int) -> list:
+    pids = []
+    for tid in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{tid}/children', 'r') as f:
+            pids += [int(p) for p in f.read().split()]
+    return pids
+
+
+def worker_pids(master: int) -> list:
+    """
+    The processes serving HTTP: the master's children, leaving out
+    multiprocessing's resource tracker, or the master itself when it has none
+    (`uvicorn --workers 1` serves in-process).
+    """
+    pids = []
+    for pid in children(master):
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            cmdline = f.read()
+        if b'resource_tracker' not in cmdline:
+            pids.append(pid)
+    return pids or [master]
+
+
+def wait_until_ready(base_url: str, proc: subprocess.Popen):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            if httpx.get(f'{base_url}/health', timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start in time")
+
+
+def warm(base_url: str, date: str, workers: int):
+    """Send weather-loading requests over fresh connections until every worker has likely served a few."""
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: httpx.get(f'{base_url}/api/get_weather_data/{date}', timeout=60),
+                      range(10 * workers)))
+
+
+def load(base_url: str, requests: int, concurrency: int) -> float:
+    """Requests per second for single-patient /api/compute_risk calls."""
+    def worker(w):
+        with httpx.Client(base_url=base_url, timeout=30) as client:
+            for i in range(w, requests, concurrency):
+                client.get('/api/compute_risk', params={'age': 20 + i % 70, 'aqi': i % 400})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+def run(mode: str, workers: int, workdir: str, env: dict, date: str, args) -> dict:
+    port = free_port()
+    if mode == 'preload':
+        cmd = [sys.executable, os.path.join(BACKEND_DIR, 'serve.py'), '--workers', str(workers),
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', BACKEND_DIR, '--workers', str(workers),
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    base_url = f'http://127.0.0.1:{port}'
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(base_url, proc)
+        warm(base_url, date, workers)
+        pids = worker_pids(proc.pid)
+        memory = [smaps_rollup(pid) for pid in pids]
+        master = smaps_rollup(proc.pid) if proc.pid not in pids else {'pss': 0}
+        throughput = load(base_url, args.requests, args.concurrency)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    mb = 1024 * 1024
+    result = {
+        'mode': mode,
+        'workers': len(pids),
+        'worker_rss_mb': sum(m['rss'] for m in memory) / len(memory) / mb,
+        'worker_pss_mb': sum(m['pss'] for m in memory) / len(memory) / mb,
+        'worker_uss_mb': sum(m['uss'] for m in memory) / len(memory) / mb,
+        'total_pss_mb': (master['pss'] + sum(m['pss'] for m in memory)) / mb,
+        'req_per_sec': throughput,
+    }
+    print(f"{mode:<8} {result['workers']:>7} {result['worker_rss_mb']:>10.1f} {result['worker_pss_mb']:>10.1f} "
+          f"{result['worker_uss_mb']:>10.1f} {result['total_pss_mb']:>10.1f} {result['req_per_sec']:>9.0f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--zips', type=int, default=20_000)
+    parser.add_argument('--dates', type=int, default=60)
+    parser.add_argument('--requests', type=int, default=2_000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='worker_bench_')
+    try:
+        weather_path = synthetic.write_weather(os.path.join(workdir, 'weather_data.csv'), args.zips, args.dates)
+        env = dict(os.environ, WEATHER_DATA_PATH=weather_path, RISK_LOOKUP_TABLE='1', LOG_SAMPLE_RATE='0')
+        date = synthetic.weather_dates(args.dates)[0]
+        print(f"🧪 Weather: {args.zips} ZIPs x {args.dates} dates ({os.path.getsize(weather_path) / 1e6:.0f} MB CSV)")
+        print(f"{'mode':<8} {'workers':>7} {'RSS/wkr':>10} {'PSS/wkr':>10} {'USS/wkr':>10} {'total PSS':>10} {'req/s':>9}")
+        for workers in args.workers:
+            for mode in ('spawn', 'preload'):
+                run(mode, workers, workdir, env, date, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: patient/weather join via DataFrame.merge vs dense ZIP-index gather.
+
+Usage (from backend_python/):
+    python benchmarks/bench_zip_join.py --rows 1000000 --zips 40000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import join_weather, prepare_weather  # noqa: E402
+from weather_store import ZipIndex  # noqa: E402
+
+CATEGORIES = ['good', 'moderate', 'unhealthy_sg', 'unhealthy', 'very_unhealthy', 'hazardous']
+
+
+def make_frames(rows: int, zips: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    zip_codes = np.sort(rng.choice(np.arange(501, 99_951), zips, replace=False))
+    weather = pd.DataFrame({
+        'zipcode': zip_codes,
+        'AQI': rng.integers(0, 300, zips),
+        'aqi_category': rng.choice(CATEGORIES, zips),
+    })
+    # A few members live in ZIPs without weather rows
+    patient_zips = np.append(zip_codes, [99_990, 99_991])
+    patients = pd.DataFrame({
+        'member_id': np.arange(rows),
+        'plan_zip': rng.choice(patient_zips, rows),
+        'Age': rng.integers(18, 95, rows),
+        'gender': rng.choice(['F', 'M'], rows),
+        'diabetes': rng.integers(0, 2, rows),
+        'hypertension': rng.integers(0, 2, rows),
+        'heart_disease': rng.integers(0, 2, rows),
+        'LOB': rng.choice(['ADV', 'MCD', 'COM'], rows),
+        'zip_base_pred_IP_PMPM': rng.random(rows) * 100,
+    })
+    return patients, weather
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--zips', type=int, default=40_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    patients, weather = make_frames(args.rows, args.zips)
+    prepared = prepare_weather(weather)
+    zip_index = ZipIndex.build(weather)
+
+    # Both joins must agree before timing them (the gather returns aqi_category as a Categorical)
+    pd.testing.assert_frame_equal(join_weather(patients, prepared, zip_index), join_weather(patients, prepared),
+                                  check_categorical=False, check_dtype=False)
+
+    build_seconds = best_of(lambda: ZipIndex.build(weather), args.repeat)
+    merge_seconds = best_of(lambda: join_weather(patients, prepared), args.repeat)
+    gather_seconds = best_of(lambda: join_weather(patients, prepared, zip_index), args.repeat)
+
+    print(f"rows:        {args.rows}")
+    print(f"zips:        {args.zips}")
+    print(f"index build: {build_seconds * 1000:.1f} ms (once per date)")
+    print(f"merge:       {merge_seconds * 1000:.1f} ms")
+    print(f"gather:      {gather_seconds * 1000:.1f} ms")
+    print(f"speedup:     {merge_seconds / gather_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
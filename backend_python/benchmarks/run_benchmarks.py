@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: utility functions and FastAPI endpoints on synthetic data.
+
+A scratch workspace gets a synthetic roster (uploads/roster.csv) and weather
+file (see synthetic.py); the server modules are imported against it. Every
+benchmark is run --repeat times and reports best/median seconds and rows/sec.
+Function benchmarks also report the peak traced allocation (tracemalloc, one
+extra run). Endpoint benchmarks go through an in-process client and report
+the peak RSS of the server process tree, so analyses running in job workers
+are included.
+
+The load suite sends concurrent single-patient calls with the risk
+micro-batcher off and on and reports p50/p99 latency and throughput.
+
+Results are written as JSON. Pass --compare with an earlier results file to
+flag benchmarks whose median got slower than --threshold.
+
+Usage (from backend_python/):
+    python benchmarks/run_benchmarks.py --rows 100000 --out bench_before.json
+    python benchmarks/run_benchmarks.py --rows 100000 --out bench_after.json --compare bench_before.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+
+ROSTER_NAME = 'roster.csv'
+RSS_SAMPLE_SECONDS = 0.005
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _tree_rss_bytes(pid: int):
+    """RSS of pid and all its descendants from /proc (None where /proc is unavailable)."""
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+class PeakRSS:
+    """Samples the RSS of this process tree in a background thread while active."""
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = _tree_rss_bytes(os.getpid())
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self.peak = _tree_rss_bytes(os.getpid()) or 0
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            # No /proc: fall back to this process's lifetime high-water mark (KB on Linux, bytes on macOS)
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _summarize(kind: str, runs: list, rows: int | None, **extra) -> dict:
+    median = statistics.median(runs)
+    result = {
+        "kind": kind,
+        "rows": rows,
+        "runs_s": [round(r, 6) for r in runs],
+        "best_s": round(min(runs), 6),
+        "median_s": round(median, 6),
+        "rows_per_sec": round(rows / median, 1) if rows and median else None,
+    }
+    result.update(extra)
+    return result
+
+
+def bench_function(name: str, fn, repeat: int, rows: int | None = None, setup=None) -> dict:
+    """Time fn() repeat times (setup() runs untimed before each call), then trace one run's peak allocation."""
+    runs = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        runs.append(time.perf_counter() - start)
+
+    args = setup() if setup is not None else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = _summarize("function", runs, rows, peak_alloc_mb=round(peak / 1e6, 2))
+    print(f"  {name:<46} median {result['median_s'] * 1000:>10.1f} ms   peak alloc {result['peak_alloc_mb']:>8.1f} MB")
+    return result
+
+
+def bench_endpoint(name: str, request, repeat: int, rows: int | None = None) -> dict:
+    """Time request(i) (an in-process HTTP call for repeat i) and sample the process tree's peak RSS."""
+    runs = []
+    status_codes = set()
+    with PeakRSS() as rss:
+        for i in range(repeat):
+            start = time.perf_counter()
+            response = request(i)
+            if hasattr(response, 'read'):
+                response.read()
+            runs.append(time.perf_counter() - start)
+            status_codes.add(response.status_code)
+    result = _summarize("endpoint", runs, rows, peak_rss_mb=round(rss.peak / 1e6, 1),
+                        status_codes=sorted(status_codes))
+    print(f"  {name:<46} median {result['median_s'] * 1000:>10.1f} ms   peak RSS   {result['peak_rss_mb']:>8.1f} MB"
+          f"   {result['status_codes']}")
+    return result
+
+
+def run_function_benchmarks(args, dates: list) -> dict:
+    import pandas as pd
+
+    import pipeline
+    import utils
+    from weather_store import WeatherStore, get_weather_store
+
+    if utils.model_data is None:
+        utils.load_model()
+    weather_path = get_weather_store().path
+    roster_path = os.path.join('uploads', ROSTER_NAME)
+    roster = pd.read_csv(roster_path)
+    weather = pipeline.prepare_weather(utils.get_weather(dates[0]))
+    zip_index = utils.get_weather_zip_index(dates[0])
+    # join_weather expects numeric ZIPs (process_chunk coerces them first)
+    patients = roster.assign(plan_zip=pd.to_numeric(roster['plan_zip'], errors='coerce')).dropna(subset=['plan_zip'])
+    patients['plan_zip'] = patients['plan_zip'].astype('int64')
+    merged = pipeline.process_chunk(roster.copy(), weather, zip_index)
+    features = merged[pipeline.REQUIRED_COLUMNS + ['LOB', 'aqi_category', 'zip_base_pred_IP_PMPM']]
+    scored = features.assign(risk_percentage=utils.predict_risk_batch(features))
+    n_weather = len(utils.get_weather(dates[0]))
+
+    results = {}
+    print("functions:")
+    # Unpickle and pre-warm the active version (load_model() skips versions already loaded)
+    results["load_model"] = bench_function(
+        "load_model", lambda: utils.load_model_file(utils.model_data['path']), args.repeat)
+    results["weather_store.load"] = bench_function(
+        "weather_store.load", lambda: WeatherStore(weather_path).rows(dates[0]), args.repeat,
+        rows=args.zips * len(dates))
+    results["get_weather"] = bench_function("get_weather", lambda: utils.get_weather(dates[-1]), args.repeat,
+                                            rows=n_weather)
+    results["get_weather_range"] = bench_function(
+        "get_weather_range", lambda: utils.get_weather_range(dates[0], dates[-1]), args.repeat,
+        rows=args.zips * len(dates))
+    results["join_weather"] = bench_function(
+        "join_weather", lambda: pipeline.join_weather(patients, weather, zip_index), args.repeat, rows=len(patients))
+    results["predict_risk_batch"] = bench_function(
+        "predict_risk_batch", lambda: utils.predict_risk_batch(features), args.repeat, rows=len(features))
+    results["predict_risk_percentage"] = bench_function(
+        "predict_risk_percentage x1000",
+        lambda: [utils.predict_risk_percentage(65, 100 + i % 200, i % 2, 1, 0) for i in range(1000)],
+        args.repeat, rows=1000)
+    results["calc_inpatient_dollars_increase"] = bench_function(
+        "calc_inpatient_dollars_increase", utils.calc_inpatient_dollars_increase, args.repeat,
+        rows=len(scored), setup=lambda: (scored.copy(),))
+    results["process_chunk"] = bench_function(
+        "process_chunk", lambda chunk: pipeline.process_chunk(chunk, weather, zip_index), args.repeat,
+        rows=len(roster), setup=lambda: (roster.copy(),))
+    results["run_risk_analysis"] = bench_function(
+        "run_risk_analysis", lambda: pipeline.run_risk_analysis(dates[0], ROSTER_NAME), args.repeat,
+        rows=len(roster))
+    if len(dates) > 1:
+        results["run_risk_analysis.range"] = bench_function(
+            "run_risk_analysis (date range)",
+            lambda: pipeline.run_risk_analysis(dates[0], ROSTER_NAME, end_date=dates[-1]),
+            args.repeat, rows=len(roster) * len(dates))
+    return results
+
+
+def run_endpoint_benchmarks(args, dates: list) -> dict:
+    from fastapi.testclient import TestClient
+
+    import main
+
+    roster_path = os.path.join('uploads', ROSTER_NAME)
+    with open(roster_path, 'rb') as f:
+        roster_bytes = f.read()
+    rows = args.rows
+
+    results = {}
+    print("endpoints:")
+    with TestClient(main.app) as client:
+        results["POST /api/upload"] = bench_endpoint(
+            "POST /api/upload",
+            lambda i: client.post('/api/upload', files={'file': (ROSTER_NAME, roster_bytes, 'text/csv')}),
+            args.repeat, rows)
+        results["GET /api/data-summary"] = bench_endpoint(
+            "GET /api/data-summary", lambda i: client.get(f'/api/data-summary/{ROSTER_NAME}'), args.repeat, rows)
+        results["GET /api/view (page)"] = bench_endpoint(
+            "GET /api/view (page)",
+            lambda i: client.get(f'/api/view/{ROSTER_NAME}', params={'offset': rows // 2, 'limit': 100}),
+            args.repeat, 100)
+        results["GET /api/view (full stream)"] = bench_endpoint(
+            "GET /api/view (full stream)", lambda i: client.get(f'/api/view/{ROSTER_NAME}'), args.repeat, rows)
+        results["GET /api/compute_risk"] = bench_endpoint(
+            "GET /api/compute_risk",
+            lambda i: client.get('/api/compute_risk', params={'age': 65, 'aqi': 150, 'diabetes': 1}),
+            args.repeat)
+
+        # A different date per run so every run misses the analysis cache
+        cold_runs = min(args.repeat, len(dates))
+        results["POST /api/compute_risk_with_weather"] = bench_endpoint(
+            "POST /api/compute_risk_with_weather",
+            lambda i: client.post('/api/compute_risk_with_weather', params={'date': dates[i], 'filename': ROSTER_NAME}),
+            cold_runs, rows)
+        results["POST /api/compute_risk_with_weather (cached)"] = bench_endpoint(
+            "POST /api/compute_risk_with_weather (cached)",
+            lambda i: client.post('/api/compute_risk_with_weather', params={'date': dates[0], 'filename': ROSTER_NAME}),
+            args.repeat, rows)
+        if len(dates) > 1:
+            results["POST /api/compute_risk_with_weather (range)"] = bench_endpoint(
+                "POST /api/compute_risk_with_weather (range)",
+                lambda i: client.post('/api/compute_risk_with_weather',
+                                      params={'date': dates[0], 'end_date': dates[-1], 'filename': ROSTER_NAME}),
+                1, rows * len(dates))
+        results["POST /api/top_risk"] = bench_endpoint(
+            "POST /api/top_risk",
+            lambda i: client.post('/api/top_risk', params={'filename': f'ANALYSIS_{dates[0]}_{ROSTER_NAME}',
+                                                           'percentile': 0.9, 'rows': 200}),
+            args.repeat, rows)
+        results["GET /metrics"] = bench_endpoint("GET /metrics", lambda i: client.get('/metrics'), args.repeat)
+    results.update(run_load_benchmarks(args))
+    return results
+
+
+def bench_load(name: str, app, requests: int, concurrency: int, seed: int = 0) -> dict:
+    """
+    Send requests single-patient /api/compute_risk calls, concurrency at a time,
+    through an in-process ASGI client; reports latency percentiles and throughput.
+    """
+    import asyncio
+
+    import httpx
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    params = [{'age': int(a), 'aqi': int(q), 'diabetes': int(d)}
+              for a, q, d in zip(rng.integers(18, 95, requests), rng.integers(0, 400, requests),
+                                 rng.integers(0, 2, requests))]
+    latencies = []
+    status_codes = set()
+
+    async def drive():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            async def worker(w: int):
+                for i in range(w, requests, concurrency):
+                    start = time.perf_counter()
+                    response = await client.get('/api/compute_risk', params=params[i])
+                    latencies.append(time.perf_counter() - start)
+                    status_codes.add(response.status_code)
+
+            await asyncio.gather(*(worker(w) for w in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(drive())
+    wall = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    result = _summarize("load", [wall], requests, concurrency=concurrency, p50_ms=round(float(p50), 3),
+                        p99_ms=round(float(p99), 3), status_codes=sorted(status_codes))
+    print(f"  {name:<46} {result['rows_per_sec']:>10.0f} req/s   p50 {result['p50_ms']:>7.2f} ms"
+          f"   p99 {result['p99_ms']:>7.2f} ms   {result['status_codes']}")
+    return result
+
+
+def run_load_benchmarks(args) -> dict:
+    """Concurrent /api/compute_risk load with the micro-batcher off and on."""
+    import main
+    import risk_batcher
+
+    results = {}
+    print(f"load ({args.load_requests} requests, {args.concurrency} concurrent):")
+    enabled = risk_batcher.RISK_MICRO_BATCH
+    try:
+        for batching in (False, True):
+            risk_batcher.RISK_MICRO_BATCH = batching
+            name = f"GET /api/compute_risk x{args.concurrency} (batching {'on' if batching else 'off'})"
+            results[name] = bench_load(name, main.app, args.load_requests, args.concurrency, args.seed)
+    finally:
+        risk_batcher.RISK_MICRO_BATCH = enabled
+    return results
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                             text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _metadata(args) -> dict:
+    import numpy as np
+    import pandas as pd
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {"rows": args.rows, "zips": args.zips, "dates": args.dates, "repeat": args.repeat,
+                   "seed": args.seed, "dirty_fraction": args.dirty_fraction,
+                   "load_requests": args.load_requests, "concurrency": args.concurrency},
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Print median-time ratios against a baseline run; returns the names that regressed beyond threshold."""
+    if baseline.get("meta", {}).get("params") != current["meta"]["params"]:
+        print("⚠️ Baseline was run with different parameters; ratios may not be comparable")
+    regressions = []
+    print(f"\n{'benchmark':<46} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in current["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if before is None or not before.get("median_s"):
+            continue
+        ratio = result["median_s"] / before["median_s"]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  ⚠️ slower'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  ✅ faster'
+        print(f"{name:<46} {before['median_s'] * 1000:>8.1f}ms {result['median_s'] * 1000:>8.1f}ms {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000, help='synthetic roster rows')
+    parser.add_argument('--zips', type=int, default=5_000, help='distinct ZIP codes')
+    parser.add_argument('--dates', type=int, default=7, help='weather dates (cold analysis runs use one each)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dirty-fraction', type=float, default=0.001,
+                        help='share of roster rows with a bad ZIP or missing Age')
+    parser.add_argument('--load-requests', type=int, default=5_000, help='single-patient calls in the load benchmark')
+    parser.add_argument('--concurrency', type=int, default=64, help='concurrent callers in the load benchmark')
+    parser.add_argument('--suite', choices=['all', 'functions', 'endpoints', 'load'], default='all')
+    parser.add_argument('--workdir', help='workspace directory (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--out', help='write JSON results here')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit 1 if any benchmark regressed')
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='risk_bench_')
+    os.makedirs(os.path.join(workdir, 'uploads'), exist_ok=True)
+
+    start = time.perf_counter()
+    weather_path = os.path.join(workdir, 'weather_data.csv')
+    synthetic.write_weather(weather_path, args.zips, args.dates, seed=args.seed)
+    synthetic.write_roster(os.path.join(workdir, 'uploads', ROSTER_NAME), args.rows, args.zips, args.seed,
+                           args.dirty_fraction)
+    dates = synthetic.weather_dates(args.dates)
+    print(f"🧪 Synthetic data: {args.rows} roster rows, {args.zips} ZIPs x {args.dates} dates in {workdir} "
+          f"({time.perf_counter() - start:.1f}s)")
+
+    # The server modules read these at import time; job workers inherit them
+    os.environ['WEATHER_DATA_PATH'] = weather_path
+    os.environ.setdefault('LOG_SAMPLE_RATE', '0')
+    os.chdir(workdir)
+
+    try:
+        benchmarks = {}
+        if args.suite in ('all', 'functions'):
+            benchmarks.update(run_function_benchmarks(args, dates))
+        if args.suite in ('all', 'endpoints'):
+            benchmarks.update(run_endpoint_benchmarks(args, dates))
+        elif args.suite == 'load':
+            benchmarks.update(run_load_benchmarks(args))
+    finally:
+        os.chdir(BACKEND_DIR)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {"meta": _metadata(args), "benchmarks": benchmarks}
+    if out_path:
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📄 Results written to {out_path}")
+
+    if compare_path:
+        with open(compare_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n⚠️ {len(regressions)} benchmark(s) slower than {args.threshold:.0%}: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Synthetic patient rosters and weather_data.csv files for benchmarking.
+
+Both generators are seeded and draw ZIPs from the same zip_codes(zips, seed)
+set, so a roster and a weather file made with the same --zips/--seed join the
+way real data does (a small share of members live in ZIPs without weather
+rows). Rosters are written in chunks, so 10M-row files never sit in memory.
+
+Usage (from backend_python/):
+    python benchmarks/synthetic.py roster uploads/roster_1m.csv --rows 1000000
+    python benchmarks/synthetic.py weather data/weather_bench.csv --dates 30
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+LOBS = ['ADV', 'CLF', 'COM', 'MCD']
+PAYERS = ['MCD', 'MCR', 'COM']
+
+# EPA AQI breakpoints (upper bound inclusive) and the lift table's category labels
+AQI_BREAKPOINTS = [50, 100, 150, 200, 300]
+AQI_CATEGORIES = ['good', 'moderate', 'unhealthy_sg', 'unhealthy', 'very_unhealthy', 'hazardous']
+
+# Share of members in ZIPs with no weather rows
+UNMATCHED_ZIP_FRACTION = 0.002
+ROSTER_CHUNK_ROWS = 1_000_000
+
+
+def zip_codes(zips: int, seed: int = 0) -> np.ndarray:
+    """Sorted, distinct 5-digit ZIP codes shared by the roster and weather generators."""
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(np.arange(501, 99_951), zips, replace=False))
+
+
+def aqi_category(aqi: np.ndarray) -> np.ndarray:
+    """EPA category label for each AQI value."""
+    return np.asarray(AQI_CATEGORIES, dtype=object)[np.searchsorted(AQI_BREAKPOINTS, aqi)]
+
+
+def make_roster(rows: int, zips: np.ndarray, seed: int = 0, first_member_id: int = 0,
+                dirty_fraction: float = 0.0) -> pd.DataFrame:
+    """
+    One roster frame with the columns the upload and analysis endpoints expect.
+
+    Parameters:
+    - rows: number of members
+    - zips: ZIP codes to draw plan_zip from (see zip_codes)
+    - seed: random seed (vary it per chunk for distinct chunks)
+    - first_member_id: member_id of the first row
+    - dirty_fraction: share of rows with a non-numeric plan_zip or a missing Age
+      (exercises the analysis filters)
+    """
+    rng = np.random.default_rng(seed)
+    plan_zip = rng.choice(zips, rows)
+    unmatched = rng.random(rows) < UNMATCHED_ZIP_FRACTION
+    plan_zip[unmatched] = 99_990 + rng.integers(0, 9, int(unmatched.sum()))
+
+    age = rng.integers(18, 95, rows)
+    older = (age - 18) / 77
+    roster = pd.DataFrame({
+        'member_id': np.arange(first_member_id, first_member_id + rows),
+        'plan_zip': plan_zip,
+        'Age': age,
+        'gender': rng.choice(['F', 'M'], rows),
+        # Chronic conditions get more common with age
+        'diabetes': (rng.random(rows) < 0.10 + 0.20 * older).astype(np.int8),
+        'hypertension': (rng.random(rows) < 0.20 + 0.40 * older).astype(np.int8),
+        'heart_disease': (rng.random(rows) < 0.05 + 0.20 * older).astype(np.int8),
+        'copd': (rng.random(rows) < 0.03 + 0.10 * older).astype(np.int8),
+        'Payer': rng.choice(PAYERS, rows),
+        'LOB': rng.choice(LOBS, rows),
+        'zip_base_pred_IP_PMPM': rng.gamma(2.0, 25.0, rows),
+    })
+    if dirty_fraction > 0:
+        roster['plan_zip'] = roster['plan_zip'].astype(object)
+        dirty = np.flatnonzero(rng.random(rows) < dirty_fraction)
+        roster.loc[dirty[::2], 'plan_zip'] = 'abc'
+        roster['Age'] = roster['Age'].astype('Int64')
+        roster.loc[dirty[1::2], 'Age'] = pd.NA
+    return roster
+
+
+def write_roster(path: str, rows: int, zips: int = 5_000, seed: int = 0, dirty_fraction: float = 0.0,
+                 chunk_rows: int = ROSTER_CHUNK_ROWS) -> str:
+    """Write a rows-long synthetic roster CSV in chunks; returns path."""
+    codes = zip_codes(zips, seed)
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        for i, start in enumerate(range(0, rows, chunk_rows)):
+            chunk = make_roster(min(chunk_rows, rows - start), codes, seed=seed * 1_000 + i + 1,
+                                first_member_id=start, dirty_fraction=dirty_fraction)
+            chunk.to_csv(out, index=False, header=(i == 0))
+    return path
+
+
+def weather_dates(dates: int, start: str = '20170101') -> list:
+    """dates consecutive YYYYMMDD strings from start."""
+    return pd.date_range(pd.Timestamp(start), periods=dates, freq='D').strftime('%Y%m%d').tolist()
+
+
+def make_weather(zips: int = 5_000, dates: int = 7, start: str = '20170101', seed: int = 0) -> pd.DataFrame:
+    """
+    One weather row per (date, ZIP) with a seasonal AQI per ZIP plus daily noise.
+
+    Returns:
+    - DataFrame with date, zipcode, AQI, aqi_category and temp columns
+    """
+    rng = np.random.default_rng(seed + 1)
+    codes = zip_codes(zips, seed)
+    days = weather_dates(dates, start)
+    base = rng.gamma(4.0, 20.0, zips)
+    aqi = np.clip(base[None, :] + rng.normal(0, 25, (dates, zips)), 0, 500).round().astype(np.int64).ravel()
+    return pd.DataFrame({
+        'date': np.repeat(np.asarray(days, dtype=np.int64), zips),
+        'zipcode': np.tile(codes, dates),
+        'AQI': aqi,
+        'aqi_category': aqi_category(aqi),
+        'temp': rng.normal(15, 10, dates * zips).round(1),
+    })
+
+
+def write_weather(path: str, zips: int = 5_000, dates: int = 7, start: str = '20170101', seed: int = 0) -> str:
+    """Write a synthetic weather_data.csv; returns path."""
+    make_weather(zips, dates, start, seed).to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='kind', required=True)
+
+    roster = sub.add_parser('roster', help='synthetic patient roster CSV')
+    roster.add_argument('path')
+    roster.add_argument('--rows', type=int, default=100_000)
+    roster.add_argument('--dirty-fraction', type=float, default=0.0)
+
+    weather = sub.add_parser('weather', help='synthetic weather_data.csv')
+    weather.add_argument('path')
+    weather.add_argument('--dates', type=int, default=7)
+    weather.add_argument('--start', default='20170101')
+
+    for p in (roster, weather):
+        p.add_argument('--zips', type=int, default=5_000)
+        p.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.path)), exist_ok=True)
+    if args.kind == 'roster':
+        write_roster(args.path, args.rows, args.zips, args.seed, args.dirty_fraction)
+    else:
+        write_weather(args.path, args.zips, args.dates, args.start, args.seed)
+    print(f"✅ Wrote {args.path} ({os.path.getsize(args.path)} bytes)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
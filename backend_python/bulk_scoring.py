@@ -0,0 +1,446 @@
+"""
+Bulk risk scoring for integration clients.
+
+POST /api/compute_risk/bulk takes many (age, aqi, flags) records in one
+request instead of one /api/compute_risk call per patient. The body can be:
+- a JSON array of objects (application/json)
+- newline-delimited JSON objects (application/x-ndjson), scored as it arrives
+- an Arrow IPC stream (application/vnd.apache.arrow.stream, needs pyarrow)
+
+Records use the /api/compute_risk parameter names and defaults (age is
+required; aqi defaults to 150 and the flags to 0); an optional id is echoed
+back. Records are scored BULK_BATCH_ROWS at a time through predict_risk_batch
+and each batch of results is streamed back as NDJSON, a JSON array or Arrow.
+The next batch is scored only once the client has taken the previous one, so
+a slow reader holds the scorer back instead of piling up encoded output.
+Request bodies, records per request and concurrent bulk requests are capped;
+a request that cannot get a slot within BULK_QUEUE_SECONDS gets a 429. The
+slot is held by the response and freed however it ends (finished, failed,
+client gone, or never started).
+
+JSON and Arrow bodies are read in full first, so their size and record
+limits come back as a 413. NDJSON bodies are scored batch by batch while
+they upload, so only a body too large by its Content-Length gets a 413; a
+limit hit later ends the results early with a final record holding only
+the error.
+Every batch of a request is scored with the same model version (the active
+one when the request starts, or the one it pins), returned in the
+X-Model-Version response header.
+"""
+import asyncio
+import io
+import json
+import os
+
+import anyio
+import numpy as np
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+import utils
+from columnar import pa
+from model_registry import ModelVersionError, get_registry
+from telemetry import counter, log_event, stage
+
+BULK_MAX_BODY_BYTES = int(os.environ.get("BULK_MAX_BODY_MB", "256")) * 1024 * 1024
+BULK_MAX_RECORDS = int(os.environ.get("BULK_MAX_RECORDS", "10000000"))
+# Records scored and encoded per batch of streamed results
+BULK_BATCH_ROWS = int(os.environ.get("BULK_BATCH_ROWS", "20000"))
+# Concurrent bulk requests, and how long an extra one waits for a slot before a 429
+BULK_MAX_CONCURRENT = int(os.environ.get("BULK_MAX_CONCURRENT", "4"))
+BULK_QUEUE_SECONDS = float(os.environ.get("BULK_QUEUE_SECONDS", "5"))
+
+JSON_TYPE = "application/json"
+NDJSON_TYPE = "application/x-ndjson"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+FORMATS = {"json": JSON_TYPE, "ndjson": NDJSON_TYPE, "arrow": ARROW_TYPE}
+
+FIELDS = ['age', 'aqi', 'diabetes', 'hypertension', 'heart_disease']
+DEFAULTS = {'aqi': 150, 'diabetes': 0, 'hypertension': 0, 'heart_disease': 0}
+# Bulk field -> predict_risk_batch column
+MODEL_COLUMNS = {'age': 'Age', 'aqi': 'AQI', 'diabetes': 'diabetes', 'hypertension': 'hypertension',
+                 'heart_disease': 'heart_disease'}
+
+BULK_RECORDS = counter("bulk_records_total", "Records scored by the bulk endpoint, by outcome")
+
+_slots = None
+
+
+class BulkScoringError(Exception):
+    """Bulk request failure that maps onto an HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _media_type(value: str | None) -> str:
+    return (value or "").split(";")[0].strip().lower()
+
+
+def input_format(content_type: str | None) -> str:
+    """Request body format from its Content-Type (JSON when unspecified)."""
+    media_type = _media_type(content_type) or JSON_TYPE
+    for name, known in FORMATS.items():
+        if media_type == known:
+            return name
+    if media_type in ("application/jsonl", "application/json-seq", "text/plain"):
+        return "ndjson"
+    raise BulkScoringError(415, f"Unsupported Content-Type {media_type}; use one of {', '.join(FORMATS.values())}")
+
+
+def output_format(requested: str | None, accept: str | None, default: str) -> str:
+    """Response format: the format query parameter, else an exact Accept match, else the input format."""
+    if requested:
+        if requested not in FORMATS:
+            raise BulkScoringError(400, f"format must be one of {', '.join(FORMATS)}")
+        return requested
+    for media_type in (_media_type(part) for part in (accept or "").split(",")):
+        for name, known in FORMATS.items():
+            if media_type == known:
+                return name
+    return default
+
+
+def score_records(records: pd.DataFrame, first_index: int, model=None) -> pd.DataFrame:
+    """
+    Score one batch of bulk records.
+
+    Parameters:
+    - records: DataFrame with (some of) the FIELDS columns, plus an optional id
+    - first_index: position of the batch's first record in the request
+    - model: model registry version to score with (defaults to the active one)
+
+    Returns:
+    - DataFrame with index, id (when given), risk_percentage and error; records
+      with a missing age or a non-integral value get a null risk and an error
+    """
+    n = len(records)
+    with stage("bulk_scoring", rows=n):
+        features = {}
+        valid = np.ones(n, dtype=bool)
+        for field in FIELDS:
+            if field in records.columns:
+                values = pd.to_numeric(records[field], errors='coerce')
+                if field in DEFAULTS:
+                    values = values.fillna(DEFAULTS[field])
+                values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                values = np.full(n, DEFAULTS.get(field, np.nan), dtype=np.float64)
+            valid &= np.isfinite(values) & (values % 1 == 0)
+            features[MODEL_COLUMNS[field]] = values
+
+        risk = np.full(n, np.nan)
+        if valid.any():
+            frame = pd.DataFrame({column: values[valid].astype(np.int64) for column, values in features.items()})
+            risk[valid] = utils.predict_risk_batch(frame, model)
+
+        result = pd.DataFrame({'index': np.arange(first_index, first_index + n, dtype=np.int64)})
+        if 'id' in records.columns:
+            result['id'] = records['id'].to_numpy()
+        result['risk_percentage'] = risk
+        result['error'] = np.where(valid, None, "age is required and every field must be an integer")
+
+    invalid = int(n - valid.sum())
+    BULK_RECORDS.inc(n - invalid, outcome="scored")
+    if invalid:
+        BULK_RECORDS.inc(invalid, outcome="invalid")
+    return result
+
+
+def _check_record_count(count: int):
+    if count > BULK_MAX_RECORDS:
+        raise BulkScoringError(413, f"Too many records ({count} > {BULK_MAX_RECORDS})")
+
+
+def _records_frame(objects: list) -> pd.DataFrame:
+    """DataFrame from parsed JSON records; anything that is not an object becomes an all-missing row."""
+    return pd.DataFrame.from_records([o if isinstance(o, dict) else {} for o in objects],
+                                     columns=None if objects else FIELDS)
+
+
+def parse_json_body(body: bytes) -> list:
+    """Parse a JSON array body into a list of records."""
+    try:
+        records = json.loads(body)
+    except ValueError as e:
+        raise BulkScoringError(400, f"Invalid JSON body: {e}")
+    if not isinstance(records, list):
+        raise BulkScoringError(400, "JSON body must be an array of records")
+    _check_record_count(len(records))
+    return records
+
+
+def read_arrow_body(body: bytes):
+    """Read an Arrow IPC stream body into a pyarrow Table."""
+    if pa is None:
+        raise BulkScoringError(415, "Arrow bodies need pyarrow, which is not installed")
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BulkScoringError(400, f"Invalid Arrow IPC stream: {e}")
+    _check_record_count(table.num_rows)
+    return table
+
+
+async def read_body(request, limit: int = BULK_MAX_BODY_BYTES) -> bytes:
+    """Read a whole (bounded) request body; 413 once it exceeds limit."""
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise BulkScoringError(413, f"Request body exceeds {limit // (1024 * 1024)} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _json_batches(records: list, batch_rows: int):
+    for start in range(0, len(records), batch_rows):
+        yield _records_frame(records[start:start + batch_rows])
+
+
+def _arrow_batches(table, batch_rows: int):
+    for start in range(0, table.num_rows, batch_rows):
+        yield table.slice(start, batch_rows).to_pandas()
+
+
+async def iter_ndjson(request, body_read: asyncio.Event, batch_rows: int = BULK_BATCH_ROWS,
+                     limit: int = BULK_MAX_BODY_BYTES):
+    """
+    Parse an NDJSON body as it arrives, yielding a DataFrame every batch_rows records.
+
+    Each batch is yielded (and scored) before more of the body is read, so
+    neither the raw body nor the parsed records are held for the whole
+    request. body_read is set once the body has been read to the end. Lines
+    that are not valid JSON become all-missing records (reported as errors
+    in the results).
+    """
+    objects = []
+    size = 0
+    count = 0
+    buffer = b""
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise BulkScoringError(413, f"Request body exceeds {limit // (1024 * 1024)} MB")
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                objects.append(_parse_line(line))
+                if len(objects) == batch_rows:
+                    count += len(objects)
+                    _check_record_count(count)
+                    yield _records_frame(objects)
+                    objects = []
+    body_read.set()
+    if buffer.strip():
+        objects.append(_parse_line(buffer))
+    if objects:
+        _check_record_count(count + len(objects))
+        yield _records_frame(objects)
+
+
+async def _iter_batches(batches):
+    for records in batches:
+        yield records
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class _ArrowEncoder:
+    """Encodes result frames as one Arrow IPC stream, a chunk of bytes per batch."""
+
+    def __init__(self, with_id: bool):
+        fields = [pa.field('index', pa.int64())]
+        if with_id:
+            fields.append(pa.field('id', pa.string()))
+        fields += [pa.field('risk_percentage', pa.float64()), pa.field('error', pa.string())]
+        self.schema = pa.schema(fields)
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def _drain(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def encode(self, result: pd.DataFrame) -> bytes:
+        if 'id' in self.schema.names:
+            result = result.assign(id=result['id'].map(lambda v: None if v is None or v != v else str(v)))
+        self._writer.write_table(pa.Table.from_pandas(result, schema=self.schema, preserve_index=False))
+        return self._drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._drain()
+
+
+def _encode_records(result: pd.DataFrame) -> str:
+    if not result['error'].notna().any():
+        result = result.drop(columns=['error'])
+    return result.to_json(orient='records', lines=True)
+
+
+async def stream_scores(batches, fmt: str, release, model=None):
+    """
+    Score the parsed batches (an async iterator) one at a time in the
+    threadpool, yielding each batch's encoded results; the next batch is
+    only parsed and scored once the client has taken the previous one.
+    """
+    scored = 0
+    arrow = None
+    try:
+        if fmt == "json":
+            yield b"["
+        try:
+            async for records in batches:
+                result = await run_in_threadpool(score_records, records, scored, model)
+                if fmt == "arrow":
+                    if arrow is None:
+                        arrow = _ArrowEncoder('id' in result.columns)
+                    yield arrow.encode(result)
+                else:
+                    lines = _encode_records(result)
+                    if fmt == "json":
+                        yield (b"," if scored else b"") + lines.rstrip("\n").replace("\n", ",").encode()
+                    else:
+                        yield lines.encode()
+                scored += len(records)
+        except BulkScoringError as e:
+            # The status line is already sent: report the limit in-band and stop
+            log_event("bulk_scoring_aborted", level="warning", records=scored, format=fmt, error=e.detail)
+            if fmt == "arrow":
+                if arrow is None:
+                    arrow = _ArrowEncoder(False)
+                yield arrow.encode(pd.DataFrame({name: [e.detail if name == 'error' else None]
+                                                 for name in arrow.schema.names}))
+            else:
+                error = json.dumps({"error": e.detail}).encode()
+                yield (b"," + error if scored else error) if fmt == "json" else error + b"\n"
+        except ClientDisconnect:
+            # Gone mid-upload: there is nobody left to send the rest to
+            log_event("bulk_scoring_disconnected", level="warning", records=scored, format=fmt)
+            return
+        if fmt == "json":
+            yield b"]"
+        elif fmt == "arrow":
+            yield (arrow or _ArrowEncoder(False)).close()
+    finally:
+        release()
+        log_event("bulk_scoring_completed", records=scored, format=fmt)
+
+
+class BulkStreamingResponse(StreamingResponse):
+    """
+    Streamed bulk results that free the request's slot however the response
+    ends, including when the body iterator never started.
+
+    Under ASGI spec < 2.4 Starlette listens for a client disconnect while it
+    streams, which would swallow request body messages; here the listener
+    only starts once the body has been read (body_read), since an NDJSON
+    body is read while results are already streaming.
+    """
+
+    def __init__(self, content, release, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+        self.body_read = body_read
+
+    async def __call__(self, scope, receive, send):
+        try:
+            spec_version = tuple(map(int, scope.get("asgi", {}).get("spec_version", "2.0").split(".")))
+            if spec_version >= (2, 4):
+                await super().__call__(scope, receive, send)
+                return
+            async with anyio.create_task_group() as task_group:
+
+                async def stream():
+                    await self.stream_response(send)
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream)
+                await self.body_read.wait()
+                await self.listen_for_disconnect(receive)
+                task_group.cancel_scope.cancel()
+            if self.background is not None:
+                await self.background()
+        finally:
+            self.release()
+
+
+def _release_once(slot: asyncio.Semaphore):
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            slot.release()
+    return release
+
+
+async def acquire_slot() -> asyncio.Semaphore:
+    """Take one of BULK_MAX_CONCURRENT request slots, waiting up to BULK_QUEUE_SECONDS (429 otherwise)."""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(BULK_MAX_CONCURRENT)
+    try:
+        await asyncio.wait_for(_slots.acquire(), timeout=BULK_QUEUE_SECONDS)
+    except asyncio.TimeoutError:
+        raise BulkScoringError(429, f"Too many concurrent bulk requests (limit {BULK_MAX_CONCURRENT}); retry later")
+    return _slots
+
+
+async def open_bulk_stream(request, requested_format: str | None = None,
+                           model_version: str | None = None) -> BulkStreamingResponse:
+    """
+    Validate a bulk request and set up its streamed results.
+
+    JSON and Arrow bodies are read (up to BULK_MAX_BODY_MB) before the
+    response starts, so oversized or malformed bodies get a 4xx status; NDJSON
+    bodies are read and scored while the results stream (see iter_ndjson).
+
+    Returns:
+    - a BulkStreamingResponse carrying the model version in X-Model-Version
+    """
+    try:
+        model = get_registry().get(model_version)
+    except ModelVersionError as e:
+        raise BulkScoringError(e.status_code, e.detail)
+    fmt_in = input_format(request.headers.get("content-type"))
+    fmt_out = output_format(requested_format, request.headers.get("accept"), fmt_in)
+    if fmt_out == "arrow" and pa is None:
+        raise BulkScoringError(406, "Arrow responses need pyarrow, which is not installed")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > BULK_MAX_BODY_BYTES:
+        raise BulkScoringError(413, f"Request body exceeds {BULK_MAX_BODY_BYTES // (1024 * 1024)} MB")
+
+    release = _release_once(await acquire_slot())
+    body_read = asyncio.Event()
+    try:
+        if fmt_in == "ndjson":
+            batches = iter_ndjson(request, body_read)
+        elif fmt_in == "arrow":
+            table = await run_in_threadpool(read_arrow_body, await read_body(request))
+            batches = _iter_batches(_arrow_batches(table, BULK_BATCH_ROWS))
+            body_read.set()
+        else:
+            records = await run_in_threadpool(parse_json_body, await read_body(request))
+            batches = _iter_batches(_json_batches(records, BULK_BATCH_ROWS))
+            body_read.set()
+    except BaseException:
+        release()
+        raise
+    return BulkStreamingResponse(stream_scores(batches, fmt_out, release, model), release, body_read,
+                                 media_type=FORMATS[fmt_out], headers={"X-Model-Version": model.get('version')})
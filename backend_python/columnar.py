@@ -0,0 +1,256 @@
+"""
+Columnar (Parquet) copies of uploaded CSVs.
+
+Uploads are converted once into uploads/.columnar/<filename>.parquet with
+typed columns (plan_zip as int32, 0/1 flag columns as uint8) and embedded
+row-count and per-column statistics. Readers ask for just the columns they
+need; when there is no fresh columnar copy (pyarrow missing, conversion
+skipped, or the CSV changed since) they fall back to parsing the CSV.
+"""
+import io
+import json
+import os
+
+import pandas as pd
+
+from row_index import get_row_index
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; everything falls back to CSV
+    pa = None
+    pq = None
+
+COLUMNAR_DIRNAME = ".columnar"
+CONVERT_CHUNK_ROWS = 250_000
+METADATA_KEY = b"climate.stats"
+
+FLAG_COLUMNS = ['diabetes', 'hypertension', 'heart_disease', 'chronic_kidney', 'liver_disease', 'copd']
+
+
+def columnar_path(csv_path: str) -> str:
+    directory, name = os.path.split(csv_path)
+    return os.path.join(directory, COLUMNAR_DIRNAME, f"{name}.parquet")
+
+
+def _source_signature(csv_path: str) -> list:
+    stat = os.stat(csv_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _coerce_types(chunk: pd.DataFrame, flag_columns: list) -> pd.DataFrame:
+    """Apply the upload typing rules to one chunk."""
+    if 'plan_zip' in chunk.columns:
+        chunk['plan_zip'] = pd.to_numeric(chunk['plan_zip'], errors='coerce').astype('Int32')
+    for col in flag_columns:
+        chunk[col] = chunk[col].astype('UInt8')
+    return chunk
+
+
+def _detect_flag_columns(chunk: pd.DataFrame) -> list:
+    """Known condition columns whose values are all 0/1 (or missing)."""
+    flags = []
+    for col in chunk.columns:
+        if col.lower().replace(' ', '_') in FLAG_COLUMNS and pd.api.types.is_numeric_dtype(chunk[col]):
+            if chunk[col].dropna().isin([0, 1]).all():
+                flags.append(col)
+    return flags
+
+
+def _update_stats(stats: dict, chunk: pd.DataFrame):
+    for col in chunk.columns:
+        series = chunk[col]
+        entry = stats.setdefault(col, {"dtype": str(series.dtype), "nulls": 0, "min": None, "max": None})
+        entry["nulls"] += int(series.isna().sum())
+        if pd.api.types.is_numeric_dtype(series) and series.notna().any():
+            lo, hi = series.min(), series.max()
+            entry["min"] = lo.item() if entry["min"] is None else min(entry["min"], lo.item())
+            entry["max"] = hi.item() if entry["max"] is None else max(entry["max"], hi.item())
+
+
+def convert_to_columnar(csv_path: str, chunk_rows: int = CONVERT_CHUNK_ROWS) -> dict | None:
+    """
+    Stream a CSV into its typed Parquet copy.
+
+    Column types are fixed from the first chunk; if a later chunk does not fit
+    them (e.g. a flag column with a value of 2) the conversion is abandoned and
+    readers keep using the CSV.
+
+    Returns:
+    - the embedded stats dict ({"rows", "source", "columns"}), or None if skipped
+    """
+    if pq is None:
+        return None
+
+    target = columnar_path(csv_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp"
+    source = _source_signature(csv_path)
+
+    writer = None
+    schema = None
+    flag_columns = None
+    stats = {}
+    rows = 0
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_rows):
+            if flag_columns is None:
+                flag_columns = _detect_flag_columns(chunk)
+            chunk = _coerce_types(chunk, flag_columns)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = table.schema.remove_metadata()
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(table.cast(schema))
+            _update_stats(stats, chunk)
+            rows += len(chunk)
+
+        if writer is None:
+            return None
+        metadata = {"rows": rows, "source": source, "columns": stats}
+        writer.add_key_value_metadata({METADATA_KEY: json.dumps(metadata).encode()})
+        writer.close()
+        writer = None
+        os.replace(tmp_path, target)
+        print(f"🗜️ Columnar copy written: {os.path.basename(target)} ({rows} rows, {os.path.getsize(target)} bytes)")
+        return metadata
+    except (TypeError, ValueError, pa.ArrowException) as e:
+        print(f"⚠️ Columnar conversion skipped for {os.path.basename(csv_path)}: {e}")
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _fresh_columnar(csv_path: str):
+    """Return (parquet_path, stats) if an up-to-date columnar copy exists, else (None, None)."""
+    if pq is None:
+        return None, None
+    target = columnar_path(csv_path)
+    if not os.path.exists(target):
+        return None, None
+    try:
+        raw = pq.read_metadata(target).metadata or {}
+        stats = json.loads(raw[METADATA_KEY])
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None, None
+    if stats.get("source") != _source_signature(csv_path):
+        return None, None
+    return target, stats
+
+
+def column_names(csv_path: str) -> list:
+    """Column names without reading any rows."""
+    target, stats = _fresh_columnar(csv_path)
+    if target is not None:
+        return list(stats["columns"].keys())
+    return list(pd.read_csv(csv_path, nrows=0).columns)
+
+
+def read_table(csv_path: str, columns: list | None = None) -> pd.DataFrame:
+    """Read the whole file (optionally only some columns), preferring the columnar copy."""
+    target, _ = _fresh_columnar(csv_path)
+    if target is not None:
+        return pq.read_table(target, columns=columns).to_pandas()
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def iter_chunks(csv_path: str, chunk_rows: int, columns: list | None = None, start: int = 0, stop: int | None = None):
+    """
+    Yield DataFrame chunks of about chunk_rows rows, preferring the columnar copy.
+
+    start/stop restrict the read to data rows [start, stop). The columnar copy
+    skips whole row groups outside the range; the CSV seeks through its row
+    offset index (see row_index) instead of parsing the skipped rows.
+    """
+    if stop is not None and stop <= start:
+        return
+    target, _ = _fresh_columnar(csv_path)
+    if target is None:
+        if start == 0 and stop is None:
+            yield from pd.read_csv(csv_path, chunksize=chunk_rows, usecols=columns)
+        else:
+            yield from _iter_csv_range(csv_path, chunk_rows, columns, start, stop)
+        return
+
+    parquet_file = pq.ParquetFile(target)
+    if start == 0 and stop is None:
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    groups = []
+    first_row = None
+    group_start = 0
+    for i in range(parquet_file.metadata.num_row_groups):
+        group_rows = parquet_file.metadata.row_group(i).num_rows
+        if group_start + group_rows > start and (stop is None or group_start < stop):
+            groups.append(i)
+            first_row = group_start if first_row is None else first_row
+        group_start += group_rows
+    if not groups:
+        return
+
+    position = first_row
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, row_groups=groups, columns=columns):
+        lo = max(start - position, 0)
+        hi = batch.num_rows if stop is None else min(stop - position, batch.num_rows)
+        if hi > lo:
+            yield batch.slice(lo, hi - lo).to_pandas()
+        position += batch.num_rows
+
+
+class _ByteRange(io.RawIOBase):
+    """The next size bytes of an open binary file, as a stream of their own."""
+
+    def __init__(self, f, size: int):
+        self._f = f
+        self._left = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._f.read(min(len(buffer), self._left))
+        buffer[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+
+def _iter_csv_range(csv_path: str, chunk_rows: int, columns: list | None, start: int, stop: int | None):
+    index = get_row_index(csv_path)
+    stop = index.total_rows if stop is None else min(stop, index.total_rows)
+    if stop <= start:
+        return
+    begin, end = index.row_offset(start), index.row_offset(stop)
+    with open(csv_path, 'rb') as f:
+        f.seek(begin)
+        # Parse up to where row stop starts rather than counting nrows, so a range
+        # never runs into the next one whatever blank lines or quoted newlines it holds
+        yield from pd.read_csv(io.BufferedReader(_ByteRange(f, end - begin)), header=None,
+                               names=column_names(csv_path), usecols=columns, chunksize=chunk_rows)
+
+
+def read_head(csv_path: str, nrows: int) -> pd.DataFrame:
+    """First nrows rows, preferring the columnar copy."""
+    target, _ = _fresh_columnar(csv_path)
+    if target is not None:
+        batches = pq.ParquetFile(target).iter_batches(batch_size=max(nrows, 1))
+        batch = next(batches, None)
+        return batch.to_pandas().head(nrows) if batch is not None else pd.DataFrame(columns=column_names(csv_path))
+    return pd.read_csv(csv_path, nrows=nrows)
+
+
+def row_count(csv_path: str) -> int | None:
+    """Row count from the embedded stats (None when there is no columnar copy)."""
+    _, stats = _fresh_columnar(csv_path)
+    return stats["rows"] if stats is not None else None
+
+
+def total_rows(csv_path: str) -> int:
+    """Exact row count: the embedded stats, else the CSV's row offset index."""
+    rows = row_count(csv_path)
+    return rows if rows is not None else get_row_index(csv_path).total_rows
@@ -0,0 +1,368 @@
+"""
+Materialized rollup cube of analysis outputs.
+
+While an analysis writes its ANALYSIS file it also aggregates every output
+row into a cube keyed by plan_zip x LOB x aqi_category x the model's
+condition flags (diabetes, hypertension, heart_disease) x a 0.1-point risk
+bin. Each cell holds its row count, risk sum and summed
+inpatient_cost_increase, so counts, mean risk and cost are exact for any
+slice or roll-up, and risk percentiles come from the binned histogram
+(accurate to the bin width; exact when each bin of a cell holds a single
+risk value). In range mode the counts are member-days.
+
+The cube is saved next to the output as ANALYSIS_..._CUBE.parquet (CSV
+without pyarrow). Queries filter and group its cells in memory, which takes
+milliseconds since the cube has a few thousand to a few hundred thousand
+cells however long the roster is. Outputs without a cube (or with one older
+than the output) get theirs built from the output on the first query.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from columnar import iter_chunks, pa, pq
+from telemetry import cache_lookup, log_event
+
+CUBE_DIMENSIONS = ['plan_zip', 'LOB', 'aqi_category', 'diabetes', 'hypertension', 'heart_disease']
+NUMERIC_DIMENSIONS = ['plan_zip', 'diabetes', 'hypertension', 'heart_disease']
+CUBE_MEASURES = ['members', 'risk_sum', 'cost_sum']
+CUBE_KEYS = CUBE_DIMENSIONS + ['risk_bin']
+# risk_bin is floor(risk_percentage * RISK_BINS_PER_POINT)
+RISK_BINS_PER_POINT = 10
+
+# Partial aggregates are combined once they hold this many cells
+CONSOLIDATE_CELLS = 1_000_000
+BUILD_CHUNK_ROWS = 500_000
+MAX_CACHED_CUBES = 16
+DEFAULT_PERCENTILES = "0.5,0.9"
+SORT_KEYS = ['members', 'mean_risk', 'inpatient_cost_increase']
+
+
+class CubeError(Exception):
+    """Cube query failure that maps onto an HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def cube_path(output_path: str) -> str:
+    """Cube file for an ANALYSIS output: Parquet, or CSV without pyarrow."""
+    stem = os.path.splitext(output_path)[0]
+    return f"{stem}_CUBE.parquet" if pq is not None else f"{stem}_CUBE.csv"
+
+
+def _combine(parts: list) -> pd.DataFrame:
+    frame = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    return frame.groupby(CUBE_KEYS, sort=False, dropna=False)[CUBE_MEASURES].sum().reset_index()
+
+
+class CubeBuilder:
+    """Aggregates analysis output rows (or saved cubes) into cube cells."""
+
+    def __init__(self):
+        self._parts = []
+        self._cells = 0
+
+    def add(self, frame: pd.DataFrame):
+        """
+        Aggregate output rows: plan_zip, LOB (or Payer), aqi_category, the
+        condition flags, risk_percentage and inpatient_cost_increase. Rows
+        without a risk are left out.
+        """
+        risk = pd.to_numeric(frame['risk_percentage'], errors='coerce').to_numpy(dtype=np.float64)
+        keep = ~np.isnan(risk)
+        if not keep.any():
+            return
+        risk = risk[keep]
+        lob_col = 'LOB' if 'LOB' in frame.columns else 'Payer' if 'Payer' in frame.columns else None
+        values = {
+            'plan_zip': pd.to_numeric(frame['plan_zip'], errors='coerce'),
+            'LOB': frame[lob_col] if lob_col else pd.Series(np.full(len(frame), None, dtype=object)),
+            'aqi_category': frame['aqi_category'],
+            **{flag: pd.to_numeric(frame[flag], errors='coerce') for flag in CUBE_DIMENSIONS[3:]},
+        }
+
+        # Aggregate on one integer key combining each key column's codes (much faster than a
+        # multi-column groupby), then decode the cells back to values
+        codes, labels, sizes = [], [], []
+        for dim in CUBE_DIMENSIONS:
+            dim_codes, uniques = pd.factorize(values[dim], use_na_sentinel=False)
+            codes.append(dim_codes[keep])
+            labels.append(np.asarray(uniques, dtype=object if dim not in NUMERIC_DIMENSIONS else None))
+            sizes.append(max(len(uniques), 1))
+        # Rounded first so a risk like 85.3 does not land in the bin below through float error
+        bins = np.floor(np.round(risk * RISK_BINS_PER_POINT, 6)).astype(np.int64)
+        low = int(bins.min())
+        codes.append(bins - low)
+        sizes.append(int(bins.max()) - low + 1)
+
+        inverse, cell_keys = pd.factorize(np.ravel_multi_index(codes, sizes))
+        cost = pd.to_numeric(frame['inpatient_cost_increase'], errors='coerce').to_numpy(dtype=np.float64)[keep]
+        cell_codes = np.unravel_index(cell_keys, sizes)
+        cells = pd.DataFrame({dim: labels[i][cell_codes[i]] for i, dim in enumerate(CUBE_DIMENSIONS)})
+        cells['risk_bin'] = (cell_codes[-1] + low).astype(np.int32)
+        cells['members'] = np.bincount(inverse, minlength=len(cell_keys))
+        cells['risk_sum'] = np.bincount(inverse, weights=risk, minlength=len(cell_keys))
+        cells['cost_sum'] = np.bincount(inverse, weights=np.nan_to_num(cost), minlength=len(cell_keys))
+        self.add_cube(cells)
+
+    def add_cube(self, cells: pd.DataFrame):
+        """Merge already aggregated cells (a shard's saved cube)."""
+        if len(cells) == 0:
+            return
+        self._parts.append(cells)
+        self._cells += len(cells)
+        if self._cells > CONSOLIDATE_CELLS and len(self._parts) > 1:
+            self._parts = [_combine(self._parts)]
+            self._cells = len(self._parts[0])
+
+    def frame(self) -> pd.DataFrame:
+        if not self._parts:
+            return pd.DataFrame({key: [] for key in CUBE_KEYS + CUBE_MEASURES})
+        cells = _combine(self._parts)
+        self._parts = [cells]
+        for dim in NUMERIC_DIMENSIONS:
+            values = cells[dim]
+            # Integral dimensions are stored as integers (a float chunk would otherwise widen them)
+            if values.notna().all() and pd.api.types.is_float_dtype(values) and (values % 1 == 0).all():
+                cells[dim] = values.astype(np.int64)
+        return cells
+
+    def save(self, path: str):
+        """Write the cube to path (Parquet or CSV by extension) through a temporary file."""
+        cells = self.frame()
+        tmp_path = f"{path}.tmp"
+        if path.endswith('.parquet'):
+            pq.write_table(pa.Table.from_pandas(cells, preserve_index=False), tmp_path)
+        else:
+            cells.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def read_cube(path: str) -> pd.DataFrame:
+    """Cells of a saved cube."""
+    if path.endswith('.parquet'):
+        return pq.read_table(path).to_pandas()
+    return pd.read_csv(path)
+
+
+def build_cube(output_path: str, path: str) -> CubeBuilder:
+    """Build the cube of an existing ANALYSIS output in one streaming pass and save it to path."""
+    with open(output_path, 'r', encoding='utf-8') as f:
+        header = f.readline().rstrip('\r\n').split(',')
+    lob_col = 'LOB' if 'LOB' in header else 'Payer' if 'Payer' in header else None
+    needed = [c for c in CUBE_DIMENSIONS + ['risk_percentage', 'inpatient_cost_increase'] if c != 'LOB']
+    missing = [c for c in needed if c not in header]
+    if missing:
+        raise CubeError(400, f"{os.path.basename(output_path)} is not an analysis output (missing {missing})")
+
+    builder = CubeBuilder()
+    columns = needed + ([lob_col] if lob_col else [])
+    for chunk in iter_chunks(output_path, BUILD_CHUNK_ROWS, columns=columns):
+        builder.add(chunk)
+    builder.save(path)
+    log_event("analysis_cube_built", file=os.path.basename(output_path), cells=builder._cells)
+    return builder
+
+
+class Cube:
+    """A loaded cube: dimension codes and measures as arrays, for slicing and rolling up."""
+
+    def __init__(self, cells: pd.DataFrame):
+        self.codes = {}
+        self.labels = {}
+        for dim in CUBE_DIMENSIONS:
+            codes, uniques = pd.factorize(cells[dim], use_na_sentinel=False)
+            self.codes[dim] = codes.astype(np.int64)
+            self.labels[dim] = np.asarray(uniques)
+        self.risk_bin = cells['risk_bin'].to_numpy(dtype=np.int64)
+        self.members = cells['members'].to_numpy(dtype=np.float64)
+        self.risk_sum = cells['risk_sum'].to_numpy(dtype=np.float64)
+        self.cost_sum = cells['cost_sum'].to_numpy(dtype=np.float64)
+
+    def _allowed(self, dim: str, values: list) -> np.ndarray:
+        """Codes of dim's labels that match any of values (strings from the query)."""
+        labels = self.labels[dim]
+        if dim in NUMERIC_DIMENSIONS:
+            try:
+                wanted = [float(v) for v in values]
+            except ValueError:
+                raise CubeError(400, f"{dim} values must be numeric")
+            return np.flatnonzero(np.isin(labels.astype(np.float64), wanted))
+        return np.flatnonzero(np.isin(labels.astype(str), values))
+
+    def aggregate(self, group_by: list, filters: dict, percentiles: list) -> tuple:
+        """
+        Roll the cells matching filters up to group_by.
+
+        Returns:
+        - (labels, stats): labels maps each group_by dimension to its value per
+          group; stats maps members, mean_risk, p<percentile> and
+          inpatient_cost_increase to one array entry per group
+        """
+        mask = np.ones(len(self.members), dtype=bool)
+        for dim, values in filters.items():
+            mask &= np.isin(self.codes[dim], self._allowed(dim, values))
+        rows = np.flatnonzero(mask)
+
+        sizes = [len(self.labels[dim]) for dim in group_by]
+        if group_by:
+            keys = np.ravel_multi_index([self.codes[dim][rows] for dim in group_by], sizes)
+        else:
+            keys = np.zeros(len(rows), dtype=np.int64)
+        groups, inverse = np.unique(keys, return_inverse=True)
+        n_groups = len(groups)
+
+        members = np.bincount(inverse, weights=self.members[rows], minlength=n_groups)
+        stats = {
+            "members": members.astype(np.int64),
+            "mean_risk": np.bincount(inverse, weights=self.risk_sum[rows], minlength=n_groups) / np.maximum(members, 1),
+        }
+
+        # Percentiles: the group's order statistics are read off its risk histogram (each
+        # histogram entry standing for its mean risk), then interpolated like numpy's linear quantile
+        order = np.lexsort((self.risk_bin[rows], inverse))
+        counts = self.members[rows][order]
+        entry_risk = self.risk_sum[rows][order] / counts
+        cumulative = np.cumsum(counts)
+        group_ids = np.arange(n_groups)
+        first = np.searchsorted(inverse[order], group_ids, side='left')
+        last = np.searchsorted(inverse[order], group_ids, side='right') - 1
+        starts = np.cumsum(members) - members
+
+        def ranked(rank):
+            # Risk of each group's rank-th smallest row (0-based)
+            return entry_risk[np.clip(np.searchsorted(cumulative, starts + rank, side='right'), first, last)]
+
+        for p in percentiles:
+            position = p * np.maximum(members - 1, 0)
+            lo = np.floor(position)
+            stats[percentile_name(p)] = ranked(lo) + (ranked(np.minimum(lo + 1, members - 1)) - ranked(lo)) * (position - lo)
+
+        stats["inpatient_cost_increase"] = np.bincount(inverse, weights=self.cost_sum[rows], minlength=n_groups)
+
+        group_codes = np.unravel_index(groups, sizes) if group_by else []
+        labels = {dim: self.labels[dim][codes] for dim, codes in zip(group_by, group_codes)}
+        return labels, stats
+
+
+def percentile_name(p: float) -> str:
+    return f"p{p * 100:g}"
+
+
+_cubes = OrderedDict()
+_cubes_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def _fresh_cube_path(output_path: str) -> str:
+    """The output's cube file, built first when it is missing or older than the output."""
+    path = cube_path(output_path)
+    with _build_lock:
+        try:
+            fresh = os.stat(path).st_mtime_ns >= os.stat(output_path).st_mtime_ns
+        except FileNotFoundError:
+            fresh = False
+        if not fresh:
+            build_cube(output_path, path)
+    return path
+
+
+def get_cube(output_path: str) -> Cube:
+    """The loaded cube of an ANALYSIS output (cached per cube file version)."""
+    path = _fresh_cube_path(output_path)
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _cubes_lock:
+        cube = _cubes.get(key)
+        cache_lookup("analysis_cube", cube is not None)
+        if cube is not None:
+            _cubes.move_to_end(key)
+            return cube
+
+    cube = Cube(read_cube(path))
+    with _cubes_lock:
+        _cubes[key] = cube
+        while len(_cubes) > MAX_CACHED_CUBES:
+            _cubes.popitem(last=False)
+    return cube
+
+
+def _split(values: str | None) -> list:
+    return [v.strip() for v in values.split(',') if v.strip()] if values else []
+
+
+def _json_value(value):
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+    return value
+
+
+def query_cube(output_path: str, filename: str, group_by: str | None = None, filters: dict | None = None,
+               percentiles: str = DEFAULT_PERCENTILES, sort_by: str = "members", limit: int = 1000) -> dict:
+    """
+    Slice and roll up an analysis's cube.
+
+    Parameters:
+    - output_path: the ANALYSIS output
+    - filename: its name, echoed in the response
+    - group_by: comma-separated dimensions to group by (none: one total)
+    - filters: dimension -> comma-separated values to keep (None entries are ignored)
+    - percentiles: comma-separated risk percentiles in [0, 1]
+    - sort_by: members, mean_risk, inpatient_cost_increase or a p<percentile> (descending)
+    - limit: max groups returned
+
+    Returns:
+    - dict with output_file, group_by, filters, groups (matching group count),
+      rows (one dict per group: dimension values, members, mean_risk,
+      p<percentile> and inpatient_cost_increase) and total (the whole slice)
+    """
+    dims = _split(group_by)
+    unknown = [d for d in dims if d not in CUBE_DIMENSIONS]
+    if unknown:
+        raise CubeError(400, f"Unknown dimensions {unknown}; expected some of {CUBE_DIMENSIONS}")
+    if len(set(dims)) != len(dims):
+        raise CubeError(400, "group_by lists a dimension twice")
+    slices = {dim: _split(values) for dim, values in (filters or {}).items() if values is not None}
+    try:
+        points = [float(p) for p in _split(percentiles)]
+    except ValueError:
+        raise CubeError(400, "percentiles must be numbers in [0, 1]")
+    if any(not 0 <= p <= 1 for p in points):
+        raise CubeError(400, "percentiles must be numbers in [0, 1]")
+    if sort_by not in SORT_KEYS + [percentile_name(p) for p in points]:
+        raise CubeError(400, f"sort_by must be one of {SORT_KEYS} or a requested percentile")
+    if limit <= 0:
+        raise CubeError(400, "limit must be > 0")
+
+    cube = get_cube(output_path)
+    labels, stats = cube.aggregate(dims, slices, points)
+    _, totals = cube.aggregate([], slices, points)
+
+    def row(i, group_labels, group_stats):
+        values = {dim: _json_value(group_labels[dim][i]) for dim in group_labels}
+        values["members"] = int(group_stats["members"][i])
+        for name, column in group_stats.items():
+            if name != "members":
+                values[name] = round(float(column[i]), 2)
+        return values
+
+    n_groups = len(stats["members"])
+    order = np.argsort(-stats[sort_by], kind='stable')[:limit]
+    return {
+        "output_file": filename,
+        "group_by": dims,
+        "filters": slices,
+        "groups": n_groups,
+        "rows": [row(i, labels, stats) for i in order.tolist()],
+        "total": row(0, {}, totals) if len(totals["members"]) else {"members": 0},
+    }
@@ -0,0 +1,300 @@
+"""
+Row manifests for incremental re-analysis.
+
+A single-date analysis records a manifest next to its ANALYSIS file
+(uploads/.incremental/<output>.npz). It holds one entry per roster row: a
+hash of the row's values, the byte length of its output line (0 when the
+row was dropped), its risk and its inpatient cost increase (which feed the
+rollup cube for reused rows). It also holds a fingerprint of each ZIP's AQI
+and category for the date, and everything else the output depends on
+(model version and hash, lift table, roster header, output file signature).
+
+When the roster or weather changes and the analysis runs again with the same
+model and lift table, a row whose hash is in the manifest and whose ZIP's
+weather is unchanged gets its previous output line copied (in contiguous
+byte ranges). Only new or edited rows, and rows in ZIPs whose weather
+changed, are rescored. The new roster is still read and hashed in full,
+which is cheap next to scoring and CSV formatting, so runtime follows the
+size of the delta. Date ranges always run in full.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from telemetry import log_event
+
+MANIFEST_DIRNAME = ".incremental"
+# Bump when the output format or row hashing changes, so older manifests are not reused
+MANIFEST_VERSION = 3
+INCREMENTAL = os.environ.get("ANALYSIS_INCREMENTAL", "1").lower() in ("1", "true", "yes")
+
+
+class IncrementalUnavailable(Exception):
+    """The output cannot be patched row by row; run the analysis in full."""
+
+
+def manifest_path(output_path: str) -> str:
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, MANIFEST_DIRNAME, f"{name}.npz")
+
+
+def _column_hashes(column: pd.Series) -> np.ndarray:
+    """uint64 hash of each value: numbers (and missing values) as float64, anything else as text."""
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return pd.util.hash_array(column.to_numpy(dtype=np.float64, na_value=np.nan))
+    # Text columns repeat a few values (gender, payer, LOB), so normalize each distinct value once
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    numbers = pd.to_numeric(uniques, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    numeric = ~np.isnan(numbers)
+    unique_hashes = pd.util.hash_array(uniques.astype(str).to_numpy(dtype=object))
+    unique_hashes[numeric] = pd.util.hash_array(numbers[numeric])
+    # Missing values (code -1) hash like a missing number
+    unique_hashes = np.append(unique_hashes, pd.util.hash_array(np.array([np.nan])))
+    return unique_hashes[codes]
+
+
+def row_hashes(chunk: pd.DataFrame) -> np.ndarray:
+    """
+    uint64 hash of each roster row's values.
+
+    The dtype pandas infers for a column depends on the rest of its chunk
+    (one NaN turns ints into floats, one word turns numbers into text), so
+    values are hashed by what they are, not how they were parsed: a row
+    hashes the same wherever the chunk boundaries fall and however the
+    roster was re-saved.
+    """
+    hashes = pd.DataFrame({i: _column_hashes(column) for i, (_, column) in enumerate(chunk.items())})
+    return pd.util.hash_pandas_object(hashes, index=False).to_numpy()
+
+
+def zip_fingerprints(weather_df: pd.DataFrame):
+    """
+    (sorted ZIPs, uint64 hash of each ZIP's AQI and aqi_category) for one
+    date's prepared weather, or None when a ZIP has several rows.
+    """
+    zips = weather_df['zipcode'].to_numpy(dtype=np.float64)
+    if len(np.unique(zips)) != len(zips):
+        return None
+    hashes = pd.util.hash_pandas_object(weather_df[['AQI', 'aqi_category']], index=False).to_numpy()
+    order = np.argsort(zips)
+    return zips[order], hashes[order]
+
+
+def changed_zips(old: tuple, new: tuple) -> np.ndarray:
+    """ZIPs added, removed or with a different AQI/category between two zip_fingerprints results."""
+    (old_zips, old_hashes), (new_zips, new_hashes) = old, new
+    zips = np.union1d(old_zips, new_zips)
+
+    def lookup(sorted_zips, hashes):
+        pos = np.minimum(np.searchsorted(sorted_zips, zips), max(len(sorted_zips) - 1, 0))
+        found = (sorted_zips[pos] == zips) if len(sorted_zips) else np.zeros(len(zips), dtype=bool)
+        return found, hashes[pos] if len(hashes) else np.zeros(len(zips), dtype=np.uint64)
+
+    old_found, old_at = lookup(old_zips, old_hashes)
+    new_found, new_at = lookup(new_zips, new_hashes)
+    return zips[(old_found != new_found) | (old_found & new_found & (old_at != new_at))]
+
+
+def line_lengths(data: bytes, rows: int, header: bool) -> np.ndarray:
+    """
+    Byte length of each data line in a to_csv() block (the header line
+    excluded). Raises IncrementalUnavailable when lines do not map one to one
+    onto rows (a quoted value with a newline in it).
+    """
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+    if len(ends) != rows + header:
+        raise IncrementalUnavailable("output rows span several lines")
+    lengths = np.diff(ends, prepend=-1)
+    return lengths[1:] if header else lengths
+
+
+class ManifestBuilder:
+    """Collects per-row manifest entries while an analysis writes its output."""
+
+    def __init__(self):
+        self.header_len = None
+        self.valid = True
+        self._hashes = []
+        self._lengths = []
+        self._risk = []
+        self._cost = []
+
+    def add_rows(self, hashes: np.ndarray, lengths: np.ndarray | None = None, risk: np.ndarray | None = None,
+                 cost: np.ndarray | None = None):
+        """Append entries for the next roster rows (lengths 0, risk and cost NaN until add_output fills them)."""
+        n = len(hashes)
+        self._hashes.append(hashes)
+        self._lengths.append(lengths if lengths is not None else np.zeros(n, dtype=np.int64))
+        self._risk.append(risk if risk is not None else np.full(n, np.nan))
+        self._cost.append(cost if cost is not None else np.full(n, np.nan))
+
+    def add_output(self, rows: np.ndarray, data: bytes, risk: np.ndarray, cost: np.ndarray, header: bool):
+        """
+        Record the output lines of the last add_rows() batch.
+
+        Parameters:
+        - rows: position in that batch of the roster row behind each output line
+        - data: the encoded to_csv() block
+        - risk: risk_percentage of each output line
+        - cost: inpatient_cost_increase of each output line
+        - header: whether data starts with the CSV header
+        """
+        try:
+            lengths = line_lengths(data, len(rows), header)
+        except IncrementalUnavailable:
+            self.valid = False
+            return
+        if header:
+            self.header_len = data.index(b'\n') + 1
+        self._lengths[-1][rows] = lengths
+        self._risk[-1][rows] = risk
+        self._cost[-1][rows] = cost
+
+    def extend(self, other):
+        """Append another builder's entries (a later shard)."""
+        if not other.valid:
+            self.valid = False
+        if self.header_len is None:
+            self.header_len = other.header_len
+        self._hashes += other._hashes
+        self._lengths += other._lengths
+        self._risk += other._risk
+        self._cost += other._cost
+
+    def arrays(self) -> dict:
+        def concat(parts, dtype):
+            return np.concatenate(parts).astype(dtype, copy=False) if parts else np.zeros(0, dtype=dtype)
+        return {
+            "hashes": concat(self._hashes, np.uint64),
+            "lengths": concat(self._lengths, np.int64),
+            "risk": concat(self._risk, np.float64),
+            "cost": concat(self._cost, np.float64),
+        }
+
+    def save_part(self, path: str):
+        """Write a shard's entries for the parent to merge (see load_part)."""
+        with open(path, 'wb') as f:
+            np.savez(f, header_len=np.int64(self.header_len if self.header_len is not None else -1),
+                     valid=np.bool_(self.valid), **self.arrays())
+
+    @classmethod
+    def load_part(cls, path: str):
+        with np.load(path) as part:
+            builder = cls()
+            builder.add_rows(part['hashes'], part['lengths'].copy(), part['risk'].copy(), part['cost'].copy())
+            builder.header_len = int(part['header_len']) if part['header_len'] >= 0 else None
+            builder.valid = bool(part['valid'])
+        return builder
+
+    def save(self, output_path: str, meta: dict, fingerprints: tuple):
+        """Write the manifest for output_path (already in place, so its signature can be recorded)."""
+        path = manifest_path(output_path)
+        if not self.valid or self.header_len is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        stat = os.stat(output_path)
+        meta = dict(meta, version=MANIFEST_VERSION, header_len=self.header_len,
+                    output=[stat.st_size, stat.st_mtime_ns])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), zips=fingerprints[0], zip_hashes=fingerprints[1],
+                     **self.arrays())
+        os.replace(tmp_path, path)
+
+
+class Manifest:
+    """A previous analysis's manifest, for planning which rows to reuse."""
+
+    def __init__(self, output_path: str, meta: dict, arrays: dict):
+        self.output_path = output_path
+        self.meta = meta
+        self.header_len = meta['header_len']
+        self.lengths = arrays['lengths']
+        self.risk = arrays['risk']
+        self.cost = arrays['cost']
+        self.fingerprints = (arrays['zips'], arrays['zip_hashes'])
+        self.offsets = self.header_len + np.cumsum(self.lengths) - self.lengths
+        hashes = arrays['hashes']
+        self._order = np.argsort(hashes, kind='stable')
+        self._sorted = hashes[self._order]
+
+    def match(self, hashes: np.ndarray) -> np.ndarray:
+        """Previous row with the same hash for each of hashes (-1 where there is none)."""
+        if len(self._sorted) == 0:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, hashes), len(self._sorted) - 1)
+        return np.where(self._sorted[pos] == hashes, self._order[pos], -1)
+
+
+def load_manifest(output_path: str, meta: dict) -> Manifest | None:
+    """
+    The manifest of output_path if it can be reused under meta (same model,
+    lift table, roster header, ...) and the output is unchanged since it was written.
+    """
+    path = manifest_path(output_path)
+    try:
+        stat = os.stat(output_path)
+        with np.load(path) as data:
+            saved = json.loads(str(data['meta']))
+            arrays = {name: data[name] for name in ('hashes', 'lengths', 'risk', 'cost', 'zips', 'zip_hashes')}
+    except (OSError, ValueError, KeyError):
+        return None
+    if saved.get('version') != MANIFEST_VERSION or saved.get('output') != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    stale = [key for key, value in meta.items() if saved.get(key) != value]
+    if stale:
+        log_event("incremental_manifest_stale", file=os.path.basename(output_path), changed=stale)
+        return None
+    return Manifest(output_path, saved, arrays)
+
+
+def copy_range(src, dst, offset: int, length: int, block: int = 1024 * 1024):
+    """Copy length bytes at offset in src to the current position in dst."""
+    src.seek(offset)
+    while length > 0:
+        data = src.read(min(block, length))
+        if not data:
+            raise IncrementalUnavailable("previous output is shorter than its manifest")
+        dst.write(data)
+        length -= len(data)
+
+
+def write_rows(out, old, reuse: np.ndarray, offsets: np.ndarray, lengths: np.ndarray, new_data: bytes):
+    """
+    Write one chunk's output lines in roster order.
+
+    Parameters:
+    - out: destination (binary)
+    - old: previous output (binary), the source of reused lines
+    - reuse: per roster row, True to copy from old, False to take from new_data
+    - offsets / lengths: per roster row, where its line is in old (reused rows)
+      or in new_data (rescored rows); rows without output have length 0
+    - new_data: encoded to_csv() lines of the rescored rows, in roster order
+    """
+    keep = lengths > 0
+    reuse, offsets, lengths = reuse[keep], offsets[keep], lengths[keep]
+    if len(lengths) == 0:
+        return
+    # A run continues while the source stays the same and the next line follows on directly
+    breaks = np.flatnonzero((reuse[1:] != reuse[:-1]) | (offsets[1:] != offsets[:-1] + lengths[:-1])) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(lengths)]))
+    view = memoryview(new_data)
+    for lo, hi in zip(starts.tolist(), ends.tolist()):
+        begin = int(offsets[lo])
+        size = int(offsets[hi - 1] + lengths[hi - 1]) - begin
+        if reuse[lo]:
+            copy_range(old, out, begin, size)
+        else:
+            out.write(view[begin:begin + size])
+
+
+def new_line_offsets(lengths: np.ndarray) -> np.ndarray:
+    """Start of each line in a block of consecutive lines."""
+    return np.cumsum(lengths) - lengths
+
@@ -0,0 +1,497 @@
+"""
+Streaming, hashed ingestion of roster uploads.
+
+An upload is written to uploads/.partial/<upload_id>.part as it arrives:
+request chunks are buffered to UPLOAD_WRITE_BYTES and each block is written
+and fed to a running SHA-256 in the threadpool, so a slow multi-GB upload
+never blocks the event loop. The CSV header and the first
+UPLOAD_VALIDATE_ROWS rows are checked as the bytes come in (required roster
+columns present and mostly numeric), so a bad file is rejected after its
+first few KB rather than after it has fully landed. A finished upload is moved
+into place with os.replace: readers never see a half-written roster, and an
+upload identical to the file already there is not reprocessed.
+
+POST /api/upload parses its multipart body as a stream (instead of spooling
+it to a temporary file first). Large files can use resumable sessions:
+- POST /api/uploads?filename=...                 open a session
+- PUT /api/uploads/{upload_id}?offset=N          append the raw body at byte N
+- GET /api/uploads/{upload_id}                   bytes received (where to resume)
+- POST /api/uploads/{upload_id}/complete         verify (optional sha256) and finalize
+- DELETE /api/uploads/{upload_id}                abort
+Session state is kept next to the partial file, so a session can be resumed
+after a restart or through another server worker.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+import utils
+from pipeline import PATIENT_REQUIRED_COLUMNS, UPLOADS_DIR
+from telemetry import counter, log_event
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import parse_options_header
+
+PARTIAL_DIRNAME = ".partial"
+# Bytes buffered before a block is written and hashed off the event loop
+UPLOAD_WRITE_BYTES = int(os.environ.get("UPLOAD_WRITE_BYTES", str(1024 * 1024)))
+# Data rows checked while the upload streams in (the rest is checked by the pipeline)
+UPLOAD_VALIDATE_ROWS = int(os.environ.get("UPLOAD_VALIDATE_ROWS", "1000"))
+# A required column is rejected when fewer of its non-blank sampled values than this are numeric
+# (the pipeline drops the odd bad row, e.g. a mistyped ZIP; a mostly non-numeric column is a wrong file)
+MIN_NUMERIC_FRACTION = 0.5
+# Unfinished resumable sessions idle for longer than this are deleted
+UPLOAD_SESSION_TTL_SECONDS = float(os.environ.get("UPLOAD_SESSION_TTL_HOURS", "24")) * 3600
+MAX_HEADER_BYTES = 64 * 1024
+
+UPLOAD_BYTES = counter("upload_bytes_total", "Upload bytes received")
+UPLOADS = counter("uploads_total", "Finished uploads by outcome (stored, unchanged, rejected)")
+
+
+class UploadError(Exception):
+    """Upload failure that maps onto an HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def check_filename(filename: str | None) -> str:
+    """The upload's file name, without any directory part (400 if missing or not a .csv)."""
+    name = os.path.basename(filename or '')
+    if not name:
+        raise UploadError(400, "No file uploaded")
+    if not name.endswith('.csv'):
+        raise UploadError(400, "Only CSV files are allowed")
+    return name
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+class CsvValidator:
+    """Checks a roster's header and first rows as its bytes arrive."""
+
+    def __init__(self, max_rows: int = UPLOAD_VALIDATE_ROWS):
+        self.max_rows = max_rows
+        self.header = None
+        self.rows = 0
+        self.done = False
+        self._pending = b""
+        self._columns = None
+        # column -> [non-blank values, numeric values] over the sampled rows
+        self._counts = {}
+
+    def feed(self, data: bytes):
+        """Validate every complete line in data (plus what was pending); raises UploadError."""
+        if self.done:
+            return
+        self._pending += data
+        cut = self._pending.rfind(b"\n")
+        if cut < 0:
+            if self.header is None and len(self._pending) > MAX_HEADER_BYTES:
+                raise UploadError(400, f"No CSV header line in the first {MAX_HEADER_BYTES // 1024} KB")
+            return
+        lines, self._pending = self._pending[:cut + 1], self._pending[cut + 1:]
+        self._check_lines(lines)
+
+    def close(self):
+        """Validate the last line (a file need not end with a newline)."""
+        if not self.done and self._pending.strip():
+            self._check_lines(self._pending)
+        self._pending = b""
+        if self.header is None:
+            raise UploadError(400, "The file is empty")
+        if not self.done:
+            self._check_sample()
+
+    def _check_lines(self, data: bytes):
+        try:
+            text = data.decode("utf-8-sig" if self.header is None else "utf-8")
+        except UnicodeDecodeError:
+            raise UploadError(400, "The file is not UTF-8 text")
+        # str.splitlines() would also split rows on \x0b, \x0c, \x85, \u2028 etc. in field data
+        for fields in csv.reader(io.StringIO(text, newline="")):
+            if not fields:
+                continue
+            if self.header is None:
+                self._check_header(fields)
+                continue
+            self.rows += 1
+            self._check_row(fields)
+            if self.rows >= self.max_rows:
+                self._check_sample()
+                self.done = True
+                return
+
+    def _check_header(self, fields: list):
+        self.header = [f.strip() for f in fields]
+        missing = [c for c in PATIENT_REQUIRED_COLUMNS if c not in self.header]
+        if missing:
+            raise UploadError(400, f"Missing columns: {missing}")
+        self._columns = [(c, self.header.index(c)) for c in PATIENT_REQUIRED_COLUMNS]
+        self._counts = {c: [0, 0] for c in PATIENT_REQUIRED_COLUMNS}
+
+    def _check_row(self, fields: list):
+        if len(fields) > len(self.header):
+            raise UploadError(400, f"Row {self.rows} has {len(fields)} fields, the header has {len(self.header)}")
+        for column, i in self._columns:
+            # Blank values are fine (the pipeline drops those rows)
+            value = fields[i].strip() if i < len(fields) else ""
+            if value:
+                counts = self._counts[column]
+                counts[0] += 1
+                counts[1] += _is_number(value)
+
+    def _check_sample(self):
+        for column, (filled, numeric) in self._counts.items():
+            if filled and numeric < filled * MIN_NUMERIC_FRACTION:
+                raise UploadError(400, f"{column} is not numeric in {filled - numeric} of the first {self.rows} rows")
+
+
+class UploadSession:
+    """One upload in progress: partial file, running hash and validation state."""
+
+    def __init__(self, upload_id: str, filename: str, uploads_dir: str = UPLOADS_DIR):
+        self.id = upload_id
+        self.filename = filename
+        self.uploads_dir = uploads_dir
+        self.partial_path = os.path.join(uploads_dir, PARTIAL_DIRNAME, f"{upload_id}.part")
+        self.state_path = os.path.join(uploads_dir, PARTIAL_DIRNAME, f"{upload_id}.json")
+        self.received = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._sha = hashlib.sha256()
+        self._validator = CsvValidator()
+        self._buffer = []
+        self._buffered = 0
+        # One writer at a time per session (appends must stay in offset order)
+        self.lock = threading.Lock()
+
+    def _write_block(self, block: bytes):
+        with open(self.partial_path, "ab") as f:
+            f.write(block)
+        self._sha.update(block)
+
+    async def append(self, data: bytes):
+        """Validate data now (cheap once the first rows are checked) and queue it for writing."""
+        try:
+            self._validator.feed(data)
+        except UploadError as e:
+            _rejected(self.filename, e)
+            raise
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.received += len(data)
+        UPLOAD_BYTES.inc(len(data))
+        if self._buffered >= UPLOAD_WRITE_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        if self._buffer:
+            block = b"".join(self._buffer)
+            self._buffer, self._buffered = [], 0
+            await run_in_threadpool(self._write_block, block)
+        self.updated_at = time.time()
+
+    def save_state(self):
+        state = {"filename": self.filename, "received": self.received, "created_at": self.created_at}
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def status(self) -> dict:
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "received": self.received,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def discard(self):
+        for path in (self.partial_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        _sessions.pop(self.id, None)
+
+    def finalize(self, expected_sha256: str | None = None, overwrite: bool = True) -> dict:
+        """
+        Check the tail of the file and its hash, then move it into uploads_dir.
+
+        Call after flush(), in the threadpool.
+
+        Returns:
+        - dict with path, size, sha256 and unchanged (True when the file already
+          there has the same content; it is kept as it is)
+        """
+        try:
+            self._validator.close()
+        except UploadError:
+            self.discard()
+            raise
+        digest = self._sha.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != digest:
+            self.discard()
+            raise UploadError(400, f"sha256 mismatch: received {digest}")
+
+        target = os.path.join(self.uploads_dir, self.filename)
+        unchanged = os.path.exists(target) and utils.file_digest(target) == digest
+        if unchanged:
+            self.discard()
+        elif os.path.exists(target) and not overwrite:
+            self.discard()
+            raise UploadError(409, f"{self.filename} already exists with different content")
+        else:
+            os.replace(self.partial_path, target)
+            self.discard()
+            # The content was hashed while it arrived; spare the analysis cache a re-read
+            utils.remember_digest(target, digest)
+        return {"path": target, "size": os.path.getsize(target), "sha256": digest, "unchanged": unchanged}
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _partial_dir(uploads_dir: str) -> str:
+    path = os.path.join(uploads_dir, PARTIAL_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def new_session(filename: str, uploads_dir: str = UPLOADS_DIR) -> UploadSession:
+    """Start an upload of filename (validated) with an empty partial file."""
+    name = check_filename(filename)
+    _partial_dir(uploads_dir)
+    prune_sessions(uploads_dir)
+    session = UploadSession(uuid.uuid4().hex, name, uploads_dir)
+    open(session.partial_path, "wb").close()
+    session.save_state()
+    with _sessions_lock:
+        _sessions[session.id] = session
+    return session
+
+
+def _restore_session(upload_id: str, uploads_dir: str) -> UploadSession | None:
+    """Rebuild a session from its partial file (after a restart, or in another worker)."""
+    session = UploadSession(upload_id, "", uploads_dir)
+    try:
+        with open(session.state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    session.filename = state["filename"]
+    session.created_at = state["created_at"]
+    with open(session.partial_path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_WRITE_BYTES), b""):
+            session._validator.feed(block)
+            session._sha.update(block)
+            session.received += len(block)
+    session.updated_at = os.path.getmtime(session.partial_path)
+    return session
+
+
+def get_session(upload_id: str, uploads_dir: str = UPLOADS_DIR) -> UploadSession:
+    """A resumable session by id (404 if unknown or expired)."""
+    if not upload_id.isalnum():
+        raise UploadError(404, "Upload not found")
+    partial_path = os.path.join(uploads_dir, PARTIAL_DIRNAME, f"{upload_id}.part")
+    with _sessions_lock:
+        session = _sessions.get(upload_id)
+        try:
+            partial_size = os.path.getsize(partial_path)
+        except FileNotFoundError:
+            _sessions.pop(upload_id, None)
+            raise UploadError(404, "Upload not found")
+        # Another worker may have appended to it since this one last saw it
+        if session is not None and (session.received == partial_size or session.lock.locked()):
+            return session
+
+    # Re-reading and re-hashing the partial file is slow; other sessions need not wait for it
+    restored = _restore_session(upload_id, uploads_dir)
+    if restored is None:
+        raise UploadError(404, "Upload not found")
+    with _sessions_lock:
+        current = _sessions.get(upload_id)
+        # Restored by another request, or being appended to, in the meantime
+        if current is not None and (current is not session or current.lock.locked()):
+            return current
+        if not os.path.exists(partial_path):
+            _sessions.pop(upload_id, None)
+            raise UploadError(404, "Upload not found")
+        _sessions[upload_id] = restored
+        return restored
+
+
+def prune_sessions(uploads_dir: str = UPLOADS_DIR):
+    """Delete partial uploads idle for longer than UPLOAD_SESSION_TTL_HOURS."""
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    directory = os.path.join(uploads_dir, PARTIAL_DIRNAME)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                _sessions.pop(name.split(".")[0], None)
+        except FileNotFoundError:
+            pass
+
+
+async def append_chunk(session: UploadSession, offset: int, chunks) -> UploadSession:
+    """
+    Append a resumable upload's next piece (an async byte iterator) at offset.
+
+    Raises:
+    - UploadError: 409 (with the expected offset) when offset is not where the
+      upload stands, 400 when the content fails validation (the session is discarded)
+    """
+    if not session.lock.acquire(blocking=False):
+        raise UploadError(409, "Another request is writing to this upload")
+    try:
+        if offset != session.received:
+            raise UploadError(409, f"Upload is at offset {session.received}, not {offset}")
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await session.append(chunk)
+        except UploadError:
+            session.discard()
+            raise
+        finally:
+            # Keep whatever arrived, so a dropped connection resumes from here
+            if os.path.exists(session.partial_path):
+                await session.flush()
+                await run_in_threadpool(session.save_state)
+    finally:
+        session.lock.release()
+    return session
+
+
+async def complete_session(session: UploadSession, expected_sha256: str | None = None,
+                           overwrite: bool = True) -> dict:
+    """Finalize a resumable upload (see UploadSession.finalize)."""
+    if not session.lock.acquire(blocking=False):
+        raise UploadError(409, "Another request is writing to this upload")
+    try:
+        await session.flush()
+        return await _finalize(session, expected_sha256, overwrite)
+    finally:
+        session.lock.release()
+
+
+def _rejected(filename: str, error: UploadError):
+    UPLOADS.inc(outcome="rejected")
+    log_event("upload_rejected", level="warning", filename=filename, status_code=error.status_code,
+              detail=error.detail)
+
+
+async def _finalize(session: UploadSession, expected_sha256: str | None, overwrite: bool) -> dict:
+    try:
+        result = await run_in_threadpool(session.finalize, expected_sha256, overwrite)
+    except UploadError as e:
+        _rejected(session.filename, e)
+        raise
+    UPLOADS.inc(outcome="unchanged" if result["unchanged"] else "stored")
+    return dict(result, filename=session.filename)
+
+
+async def receive_multipart(request, overwrite: bool = True, field: str = "file") -> dict:
+    """
+    Stream a multipart/form-data upload (its `field` file part) into place.
+
+    The part is validated, hashed and written as it arrives; other form
+    fields are ignored.
+
+    Returns:
+    - finalize() result plus filename
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadError(400, "Expected a multipart/form-data body")
+
+    headers = {}
+    header_field = []
+    header_value = []
+    # Parser callbacks are synchronous; they queue events that the loop below handles
+    events = []
+
+    def on_header_field(data, start, end):
+        header_field.append(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.append(data[start:end])
+
+    def on_header_end():
+        headers[b"".join(header_field).lower()] = b"".join(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    callbacks = {
+        "on_part_begin": lambda: headers.clear(),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("part", dict(headers))),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    }
+    parser = multipart.MultipartParser(boundary, callbacks)
+
+    session = None
+    result = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "part":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    is_file = options.get(b"name") == field.encode() and b"filename" in options
+                    if is_file and session is None and result is None:
+                        session = await run_in_threadpool(
+                            new_session, options[b"filename"].decode("utf-8", "replace")
+                        )
+                elif kind == "data" and session is not None:
+                    await session.append(value)
+                elif kind == "end" and session is not None:
+                    await session.flush()
+                    result = await _finalize(session, None, overwrite)
+                    session = None
+            events.clear()
+        parser.finalize()
+    except MultipartParseError as e:
+        raise UploadError(400, f"Malformed multipart body: {e}")
+    finally:
+        # A client that disconnected mid-upload, or a rejected file, leaves nothing behind
+        if session is not None:
+            session.discard()
+    if result is None:
+        raise UploadError(400, "No file uploaded")
+    return result
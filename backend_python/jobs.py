@@ -0,0 +1,271 @@
+"""
+Background job queue for risk analyses.
+
+Analyses run in a process pool so pandas parsing, model inference and CSV
+writing never block the event loop. Each job reports rows processed through a
+shared progress dict and can be cancelled between chunks. Submitting the same
+(date or date range, filename, model version) while a job for it is queued or running returns that job, and
+a submission whose inputs hit the analysis cache completes immediately.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+
+import utils
+from pipeline import analysis_label, run_risk_analysis
+from result_cache import AnalysisCache
+from telemetry import counter, merge_stages, profile
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+
+# Finished jobs kept around for status polling
+MAX_FINISHED_JOBS = 200
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+JOBS_FINISHED = counter("analysis_jobs_total", "Finished analysis jobs by status (cached hits count as completed)")
+JOB_ROWS = counter("analysis_job_rows_total", "Roster rows read by finished analysis jobs")
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job has been cancelled."""
+
+
+def _init_worker():
+    """Load the model once per worker process."""
+    if utils.model_data is None:
+        utils.load_model()
+
+
+def _run_analysis_job(job_id, date, filename, memory_budget_mb, progress, cancel_event, end_date=None,
+                      model_version=None):
+    """
+    Worker entry point: run one analysis, publishing progress and honouring cancellation.
+
+    The job's stage breakdown is published with its final progress entry.
+    """
+    started_at = time.time()
+    state = {"started_at": started_at, "rows_processed": 0, "records_written": 0}
+    progress[job_id] = state
+
+    def report(rows_read, records):
+        state.update(rows_processed=rows_read, records_written=records)
+        progress[job_id] = state
+        if cancel_event.is_set():
+            raise JobCancelled()
+
+    if cancel_event.is_set():
+        raise JobCancelled()
+    with profile() as job_profile:
+        try:
+            return run_risk_analysis(date, filename, memory_budget_mb=memory_budget_mb, progress=report,
+                                     end_date=end_date, model_version=model_version)
+        finally:
+            progress[job_id] = dict(state, stages=job_profile.as_dict())
+
+
+class Job:
+    """State for one submitted analysis."""
+
+    def __init__(self, job_id, date, filename, memory_budget_mb, cancel_event, cache_key=None, end_date=None,
+                 model_version=None):
+        self.id = job_id
+        self.date = date
+        self.end_date = end_date
+        self.filename = filename
+        self.model_version = model_version
+        self.memory_budget_mb = memory_budget_mb
+        self.cancel_event = cancel_event
+        self.cache_key = cache_key
+        self.cached = False
+        self.status = QUEUED
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.stages = None
+
+    @property
+    def key(self):
+        return (analysis_label(self.date, self.end_date), self.filename, self.model_version)
+
+
+class JobManager:
+    """Submits analyses to a process pool and tracks their status and progress."""
+
+    def __init__(self, max_workers: int = JOB_WORKERS, cache: AnalysisCache | None = None):
+        self.max_workers = max_workers
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+        self._executor = None
+        self._manager = None
+        self._progress = None
+
+    def _ensure_started(self):
+        if self._executor is None:
+            # spawn keeps workers independent of the server's threads and event loop
+            ctx = multiprocessing.get_context("spawn")
+            self._manager = ctx.Manager()
+            self._progress = self._manager.dict()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=ctx, initializer=_init_worker
+            )
+
+    def submit(self, date: str, filename: str, memory_budget_mb: int | None = None, cache_key: str | None = None,
+               end_date: str | None = None, model_version: str | None = None):
+        """
+        Queue an analysis, coalescing with an unfinished job for the same (date, filename, model_version).
+
+        With end_date the job analyses every date in [date, end_date] in one pass.
+        model_version pins the model registry version the job scores with; the
+        worker loads it from MODEL_DIR if needed (None scores with the worker's
+        active version, so resolve it first when it also keys the cache).
+
+        When cache_key (see AnalysisCache.key_for) hits the analysis cache, the
+        returned job is already completed with the cached summary; otherwise the
+        result is stored under cache_key when the job completes.
+
+        Returns:
+        - (job, created) tuple; created is False when an existing job was returned
+        """
+        with self._lock:
+            existing = self._jobs.get(self._active.get((analysis_label(date, end_date), filename, model_version)))
+            if existing is not None and existing.status not in FINISHED_STATES:
+                return existing, False
+
+            cached = self.cache.lookup(cache_key) if self.cache is not None and cache_key else None
+            if cached is not None:
+                job = Job(uuid.uuid4().hex, date, filename, memory_budget_mb, None, cache_key, end_date, model_version)
+                job.cached = True
+                job.result = cached
+                job.status = COMPLETED
+                job.finished_at = time.time()
+                job.future = Future()
+                job.future.set_result(cached)
+                JOBS_FINISHED.inc(status=COMPLETED)
+                self._jobs[job.id] = job
+                self._prune()
+                return job, True
+
+            self._ensure_started()
+            job = Job(uuid.uuid4().hex, date, filename, memory_budget_mb, self._manager.Event(), cache_key, end_date,
+                      model_version)
+            job.future = self._executor.submit(
+                _run_analysis_job, job.id, date, filename, memory_budget_mb, self._progress, job.cancel_event, end_date,
+                model_version
+            )
+            self._jobs[job.id] = job
+            self._active[job.key] = job.id
+            self._prune()
+
+        job.future.add_done_callback(lambda future, job=job: self._on_done(job, future))
+        return job, True
+
+    def _on_done(self, job, future):
+        try:
+            job.result = future.result()
+            status = COMPLETED
+        except (CancelledError, JobCancelled):
+            status = CANCELLED
+        except Exception as e:
+            job.error = e
+            status = FAILED
+        if self._progress is not None:
+            final = self._progress.get(job.id) or {}
+            job.stages = final.get("stages")
+            # Stages ran in the worker process; fold them into this process's registry
+            merge_stages(job.stages)
+            JOB_ROWS.inc(final.get("rows_processed", 0))
+        JOBS_FINISHED.inc(status=status)
+        if status == COMPLETED and job.cache_key and self.cache is not None:
+            self.cache.store(job.cache_key, job.result)
+        job.finished_at = time.time()
+        job.status = status
+        with self._lock:
+            if self._active.get(job.key) == job.id:
+                del self._active[job.key]
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:-MAX_FINISHED_JOBS or None]:
+            del self._jobs[job.id]
+            # Cache hits can be pruned before the pool (and its progress dict) exists
+            if self._progress is not None:
+                self._progress.pop(job.id, None)
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job outright or signal a running one to stop after its current chunk."""
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return False
+        job.cancel_event.set()
+        job.future.cancel()
+        return True
+
+    def status(self, job: Job) -> dict:
+        """Job status with progress (rows processed and rows/sec)."""
+        progress = dict(self._progress.get(job.id, {})) if self._progress is not None else {}
+        status = job.status
+        if status == QUEUED and progress:
+            status = RUNNING
+
+        rows_processed = progress.get("rows_processed", 0)
+        started_at = progress.get("started_at")
+        elapsed = None
+        if started_at is not None:
+            elapsed = (job.finished_at or time.time()) - started_at
+
+        error = None
+        if job.error is not None:
+            error = getattr(job.error, "detail", None) or str(job.error)
+
+        return {
+            "job_id": job.id,
+            "status": status,
+            "date": job.date,
+            "end_date": job.end_date,
+            "filename": job.filename,
+            "model_version": job.model_version,
+            "submitted_at": job.submitted_at,
+            "started_at": started_at,
+            "finished_at": job.finished_at,
+            "cached": job.cached,
+            "progress": {
+                "rows_processed": rows_processed,
+                "records_written": progress.get("records_written", 0),
+                "elapsed_seconds": round(elapsed, 2) if elapsed is not None else None,
+                "rows_per_sec": round(rows_processed / elapsed, 1) if elapsed else None,
+            },
+            "result": job.result,
+            "error": error,
+            "stages": job.stages,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
+            self._manager = None
+            self._progress = None
+
+
+job_manager = JobManager(cache=AnalysisCache())
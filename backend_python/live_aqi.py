@@ -0,0 +1,241 @@
+"""
+Live AQI lookups from the Open-Meteo air-quality API.
+
+ZIP codes are mapped to coordinates through a dict built once from the
+zipcodes package, then snapped to a grid so nearby ZIPs share one request.
+Requests go through one pooled httpx client, at most LIVE_AQI_CONCURRENCY
+at a time, with retries and exponential backoff on transport errors, 429
+and 5xx responses. Results are cached per grid cell on disk for
+LIVE_AQI_TTL_SECONDS. LIVE_AQI_BASE_URL points the fetcher at another server
+(e.g. a local mock) with the same query interface.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+import httpx
+import pandas as pd
+import zipcodes
+
+from telemetry import cache_lookup, log_event
+
+BASE_URL = os.environ.get("LIVE_AQI_BASE_URL", "https://air-quality-api.open-meteo.com/v1/air-quality")
+CONCURRENCY = int(os.environ.get("LIVE_AQI_CONCURRENCY", "8"))
+RETRIES = int(os.environ.get("LIVE_AQI_RETRIES", "3"))
+BACKOFF_SECONDS = float(os.environ.get("LIVE_AQI_BACKOFF_SECONDS", "0.5"))
+TIMEOUT_SECONDS = float(os.environ.get("LIVE_AQI_TIMEOUT_SECONDS", "10"))
+TTL_SECONDS = int(os.environ.get("LIVE_AQI_TTL_SECONDS", "3600"))
+# Grid cell size in degrees (0.1 degree is roughly 11 km of latitude)
+GRID_DEGREES = float(os.environ.get("LIVE_AQI_GRID_DEGREES", "0.1"))
+CACHE_PATH = os.environ.get(
+    "LIVE_AQI_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'live_aqi_cache.json')
+)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_zip_coordinates = None
+_zip_lock = threading.Lock()
+
+_client = None
+_client_loop = None
+
+
+def zip_coordinates() -> dict:
+    """5-digit ZIP string -> (lat, lon), built once from the zipcodes package."""
+    global _zip_coordinates
+    with _zip_lock:
+        if _zip_coordinates is None:
+            coordinates = {}
+            for entry in zipcodes.list_all():
+                try:
+                    coordinates[entry['zip_code']] = (float(entry['lat']), float(entry['long']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            _zip_coordinates = coordinates
+    return _zip_coordinates
+
+
+def normalize_zip(zip_code) -> str | None:
+    """Zero-padded 5-digit ZIP string, or None if zip_code is not a ZIP."""
+    text = str(zip_code).strip()
+    if text.endswith('.0'):  # plan_zip read as float
+        text = text[:-2]
+    text = text.split('-')[0]
+    if not text.isdigit() or len(text) > 5:
+        return None
+    return text.zfill(5)
+
+
+def grid_cell(lat: float, lon: float, grid_degrees: float = GRID_DEGREES) -> tuple:
+    """Centre of the grid cell containing (lat, lon), rounded for use as a cache key."""
+    return (
+        round((lat // grid_degrees + 0.5) * grid_degrees, 4),
+        round((lon // grid_degrees + 0.5) * grid_degrees, 4),
+    )
+
+
+class AQICache:
+    """Grid cell -> (AQI, fetched_at) on disk, entries expire after ttl seconds."""
+
+    def __init__(self, path: str = CACHE_PATH, ttl: int = TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _key(cell: tuple) -> str:
+        return f"{cell[0]},{cell[1]}"
+
+    def get(self, cell: tuple, now: float):
+        """Cached entry for cell if still fresh, else None."""
+        entry = self._entries.get(self._key(cell))
+        if entry is None or now - entry["fetched_at"] > self.ttl:
+            return None
+        return entry
+
+    def update(self, values: dict, now: float):
+        """Store {cell: aqi} and write the cache file, dropping expired entries."""
+        with self._lock:
+            for cell, aqi in values.items():
+                self._entries[self._key(cell)] = {"aqi": aqi, "fetched_at": now}
+            self._entries = {k: e for k, e in self._entries.items() if now - e["fetched_at"] <= self.ttl}
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not persist live AQI cache: {e}")
+
+
+def parse_aqi(payload: dict):
+    """First daily US AQI value from an air-quality response, or None."""
+    values = (payload.get("daily") or {}).get("us_aqi") or []
+    return values[0] if values else None
+
+
+def get_client() -> httpx.AsyncClient:
+    """The pooled client shared by every fetch on the running event loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    # A client's connections belong to the loop that opened them (asyncio.run callers get their own)
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+        _client = httpx.AsyncClient(timeout=TIMEOUT_SECONDS, limits=limits)
+        _client_loop = loop
+    return _client
+
+
+async def close_client():
+    """Close the pooled client (on app shutdown)."""
+    global _client, _client_loop
+    client, _client, _client_loop = _client, None, None
+    if client is not None:
+        await client.aclose()
+
+
+async def _fetch_cell(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, cell: tuple, base_url: str):
+    """AQI for one grid cell; returns (aqi, error)."""
+    params = {"latitude": cell[0], "longitude": cell[1], "daily": "us_aqi", "timezone": "auto"}
+    error = None
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1))
+        try:
+            async with semaphore:
+                resp = await client.get(base_url, params=params)
+            if resp.status_code in RETRY_STATUS_CODES:
+                error = f"HTTP {resp.status_code}"
+                continue
+            resp.raise_for_status()
+            return parse_aqi(resp.json()), None
+        except httpx.TransportError as e:
+            error = str(e) or type(e).__name__
+        except (httpx.HTTPStatusError, ValueError) as e:
+            # Client errors and malformed bodies will not improve on retry
+            return None, str(e)
+    return None, error
+
+
+async def fetch_aqi_for_zips(zip_codes, base_url: str | None = None, cache: AQICache | None = None) -> pd.DataFrame:
+    """
+    Current AQI for a collection of ZIP codes.
+
+    Parameters:
+    - zip_codes: iterable of ZIP codes (str or int; duplicates are fine)
+    - base_url: air-quality endpoint (defaults to LIVE_AQI_BASE_URL)
+    - cache: grid-cell cache (defaults to the shared on-disk cache)
+
+    Returns:
+    - DataFrame with columns zip, aqi and error, one row per unique input ZIP
+    """
+    base_url = base_url or BASE_URL
+    # The cache file is read (first use) and rewritten (update) off the event loop
+    cache = cache if cache is not None else await asyncio.to_thread(get_aqi_cache)
+    coordinates = await asyncio.to_thread(zip_coordinates)
+
+    rows = []
+    cells = {}
+    for zip_code in pd.unique(pd.Series(list(zip_codes), dtype=object)):
+        key = normalize_zip(zip_code)
+        location = coordinates.get(key) if key else None
+        if location is None:
+            rows.append({"zip": zip_code, "cell": None, "error": "Invalid ZIP code"})
+            continue
+        cell = grid_cell(*location)
+        cells[cell] = None
+        rows.append({"zip": zip_code, "cell": cell, "error": None})
+
+    now = time.time()
+    results = {}
+    missing = []
+    for cell in cells:
+        entry = cache.get(cell, now)
+        if entry is not None:
+            results[cell] = (entry["aqi"], None)
+        else:
+            missing.append(cell)
+
+    cache_lookup("live_aqi", True, len(cells) - len(missing))
+    cache_lookup("live_aqi", False, len(missing))
+    if missing:
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        client = get_client()
+        fetched = await asyncio.gather(*[_fetch_cell(client, semaphore, cell, base_url) for cell in missing])
+        results.update(zip(missing, fetched))
+        await asyncio.to_thread(
+            cache.update, {cell: aqi for cell, (aqi, error) in zip(missing, fetched) if error is None}, time.time()
+        )
+        log_event("live_aqi_fetched", cells_fetched=len(missing), cells_cached=len(cells) - len(missing), zips=len(rows))
+
+    for row in rows:
+        cell = row.pop("cell")
+        aqi, error = results.get(cell, (None, row["error"]))
+        row["aqi"] = aqi
+        row["error"] = error
+    return pd.DataFrame(rows, columns=["zip", "aqi", "error"])
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_aqi_cache() -> AQICache:
+    """Shared on-disk AQI cache (reads the cache file on first use)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AQICache()
+    return _cache
@@ -1,15 +1,34 @@
 # main.py - FastAPI Backend for Climate Hackathon 2025
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import uvicorn
+import asyncio
 import traceback
 import os
-import shutil
 from datetime import datetime
+from concurrent.futures import CancelledError
 import time
 import pandas as pd
-from utils import calc_inpatient_dollars_increase, load_model, predict_risk_percentage, predict_risk_batch, get_weather as load_weather_for_date
+import utils
+from utils import get_weather_current, load_model
+from pipeline import AnalysisError
+from jobs import JobCancelled, job_manager
+from weather_store import get_weather_store
+from columnar import convert_to_columnar, row_count
+from summary import get_summary
+from top_risk import top_risk_rows
+from cube import DEFAULT_PERCENTILES, CubeError, query_cube
+from row_index import iter_file, read_page
+from live_aqi import close_client, fetch_aqi_for_zips
+from bulk_scoring import BULK_QUEUE_SECONDS, BulkScoringError, open_bulk_stream
+from risk_batcher import score_risk
+from model_registry import ModelVersionError, get_registry
+from ingest import UploadError, append_chunk, complete_session, get_session, new_session, receive_multipart
+import telemetry
+from telemetry import log_event, stage
 
 
 app = FastAPI(
@@ -30,6 +49,29 @@ app.add_middleware(
 # Enable gzip compression for large responses
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
+# Send "X-Profile: 1" to get the request's stage breakdown back in a Server-Timing header
+PROFILE_HEADER = "x-profile"
+
+HTTP_LATENCY = telemetry.histogram("http_request_duration_seconds", "Request latency by route, method and status")
+JOBS_BY_STATUS = telemetry.gauge("analysis_jobs", "Tracked analysis jobs by current status")
+UPTIME = telemetry.gauge("process_uptime_seconds", "Seconds since the server started")
+
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Record per-route latency and, on request, return the stage breakdown."""
+    start = time.perf_counter()
+    profiling = request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+    with telemetry.profile() as request_profile:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # Label by route template, not raw path, so the series count stays bounded
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_LATENCY.observe(elapsed, method=request.method, route=route, status=str(response.status_code))
+    if profiling:
+        response.headers["Server-Timing"] = request_profile.server_timing(elapsed)
+    return response
+
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 
@@ -40,6 +82,44 @@ start_time = time.time()
 print("Loading climate health model...")
 load_model()
 
+@app.on_event("startup")
+def watch_models():
+    # Pick up new model versions dropped into MODEL_DIR without a restart
+    get_registry().start_watching()
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    get_registry().stop_watching()
+    job_manager.shutdown()
+
+@app.on_event("shutdown")
+async def close_live_aqi_client():
+    await close_client()
+
+
+def pin_model_version(model_version: str | None) -> str:
+    """
+    The model version an analysis will use: the requested one, or the version
+    active right now (so the cache key and the job agree even if a swap happens
+    in between).
+    """
+    try:
+        return get_registry().get(model_version)['version']
+    except ModelVersionError as e:
+        raise AnalysisError(e.status_code, e.detail)
+
+
+def collect_server_metrics():
+    UPTIME.set(round(time.time() - start_time, 3))
+    counts = {}
+    for job in job_manager.list():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    for status in ("queued", "running", "completed", "failed", "cancelled"):
+        JOBS_BY_STATUS.set(counts.get(status, 0), status=status)
+
+
+telemetry.register_collector(collect_server_metrics)
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -50,6 +130,9 @@ async def root():
         "endpoints": {
             "health": "/health",
             "upload": "/api/upload",
+            "jobs": "/api/jobs",
+            "models": "/api/models",
+            "metrics": "/metrics",
             "docs": "/docs",
             "redoc": "/redoc"
         }
@@ -66,45 +149,146 @@ async def health_check():
         "framework": "FastAPI",
         "timestamp": datetime.now().isoformat(),
         "uptime": round(uptime, 2),
+        "weather_store": get_weather_store().stats(),
+        "analysis_cache": job_manager.cache.stats(),
+        "model_version": (utils.model_data or {}).get("version"),
         "endpoints": [
             "GET /",
             "GET /health", 
             "POST /api/upload",
+            "POST /api/uploads",
+            "PUT /api/uploads/{upload_id}",
+            "POST /api/uploads/{upload_id}/complete",
+            "POST /api/jobs/compute_risk_with_weather",
+            "GET /api/jobs/{job_id}",
+            "DELETE /api/jobs/{job_id}",
+            "GET /api/models",
+            "POST /api/models/{version}/activate",
+            "GET /metrics",
             "GET /docs"
         ]
     }
 
-@app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """File upload endpoint"""
-    print(f"Upload request received for file: {file.filename}")
-    
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="No file uploaded")
-    
-    # Check if it's a CSV file
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Only CSV files are allowed")
-    
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of latency histograms, stage timings, cache ratios and job counts"""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+async def store_upload(upload: dict) -> dict:
+    """Columnar copy and data summary for a finished upload, then the upload response."""
+    file_path = upload["path"]
+    if upload["unchanged"]:
+        # Same content as the file already there: its columnar copy and summary still apply
+        rows = await run_in_threadpool(row_count, file_path)
+        columnar = rows is not None
+    else:
+        # Typed columnar copy so later endpoints read only the columns they need,
+        # then the persisted data summary (a cheap pass over the columnar copy)
+        with stage("columnar_convert") as span:
+            columnar_stats = await run_in_threadpool(convert_to_columnar, file_path)
+            span.rows = columnar_stats["rows"] if columnar_stats else 0
+        with stage("summary"):
+            await run_in_threadpool(get_summary, file_path)
+        rows = columnar_stats["rows"] if columnar_stats else None
+        columnar = columnar_stats is not None
+    log_event("upload_saved", sample_rate=1.0, path=file_path, bytes=upload["size"], rows=rows,
+              unchanged=upload["unchanged"])
+
+    return {
+        "message": "CSV uploaded successfully!",
+        "filename": upload["filename"],
+        "path": file_path,
+        "size": upload["size"],
+        "sha256": upload["sha256"],
+        "unchanged": upload["unchanged"],
+        "rows": rows,
+        "columnar": columnar
+    }
+
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"]
+        }}}
+    }
+}
+
+@app.post("/api/upload", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_file(request: Request, overwrite: bool = True):
+    """File upload endpoint
+
+    The multipart body is streamed to disk (validated and hashed as it
+    arrives) rather than spooled first, so a bad roster is rejected early and
+    a slow upload does not hold up other requests. With overwrite=false an
+    existing file with different content is a 409.
+    """
+    log_event("upload_received", content_length=request.headers.get("content-length"))
     try:
-        # Save file to uploads directory
-        file_path = f"uploads/{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        print(f"File saved to: {file_path}")
-        
-        return {
-            "message": "CSV uploaded successfully!",
-            "filename": file.filename,
-            "path": file_path,
-            "size": os.path.getsize(file_path)
-        }
-    
+        with stage("upload_write") as span:
+            upload = await receive_multipart(request, overwrite)
+            span.nbytes = upload["size"]
+        return await store_upload(upload)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
-        print(f"Error saving file: {e}")
+        log_event("upload_failed", level="error", error=str(e))
         raise HTTPException(status_code=500, detail="Error saving file")
 
+@app.post("/api/uploads")
+async def start_upload(filename: str):
+    """Open a resumable upload session for a large CSV (send the bytes with PUT /api/uploads/{upload_id})"""
+    try:
+        session = await run_in_threadpool(new_session, filename)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return session.status()
+
+@app.get("/api/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Bytes received so far by a resumable upload (the offset to resume from)"""
+    try:
+        session = await run_in_threadpool(get_session, upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return session.status()
+
+@app.put("/api/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, offset: int = 0):
+    """Append the request body to a resumable upload at byte offset (409 with the current offset on a mismatch)"""
+    try:
+        session = await run_in_threadpool(get_session, upload_id)
+        with stage("upload_write") as span:
+            before = session.received
+            await append_chunk(session, offset, request.stream())
+            span.nbytes = session.received - before
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return session.status()
+
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, sha256: str | None = None, overwrite: bool = True):
+    """Finish a resumable upload: check the optional sha256, move the file into place and process it"""
+    try:
+        session = await run_in_threadpool(get_session, upload_id)
+        upload = await complete_session(session, sha256, overwrite)
+        return await store_upload(upload)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.delete("/api/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """Abandon a resumable upload and delete what it received"""
+    try:
+        session = await run_in_threadpool(get_session, upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    await run_in_threadpool(session.discard)
+    return {"upload_id": upload_id, "status": "aborted"}
+
 @app.get("/api/get_weather")
 async def get_weather_mock():
     """Get mock weather data"""
@@ -116,6 +300,25 @@ async def get_weather_mock():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/live_aqi")
+async def get_live_aqi(zips: str | None = None):
+    """Get current AQI from the live air-quality API
+
+    Args:
+        zips: comma-separated ZIP codes; defaults to every ZIP in the weather data
+    """
+    try:
+        if zips:
+            result = await fetch_aqi_for_zips([z for z in zips.split(',') if z.strip()])
+        else:
+            result = await get_weather_current()
+        result = result.astype(object).where(result.notna(), None)
+        return {"count": len(result), "aqi": result.to_dict('records')}
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Weather data file not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
 @app.get("/api/files")
 async def list_files():
     """List all files in the data directory"""
@@ -130,99 +333,54 @@ async def list_files():
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.get("/api/view/{filename}")
-async def view_file(filename: str, rows: int | None = None):
-    """View file contents (supports preview via rows param)"""
+async def view_file(filename: str, rows: int | None = None, offset: int = 0, limit: int | None = None):
+    """View file contents
+
+    With rows (a preview) or offset/limit, returns one page as CSV text plus
+    total_rows and next_offset; pages are located through a row-offset index
+    built once per file, so any page costs the same. Without either, the file
+    is streamed as text/csv in chunks instead of being buffered into JSON.
+    """
     try:
         file_path = os.path.join("uploads", filename)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
 
-        # If rows is provided, return a preview using pandas (fast)
         if rows and rows > 0:
-            df = pd.read_csv(file_path, nrows=rows)
-            return {"data": df.to_csv(index=False)}
-
-        # Otherwise return the full file (legacy behavior)
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return {"data": content}
+            limit = rows
+        if limit is not None:
+            if offset < 0 or limit <= 0:
+                raise HTTPException(status_code=400, detail="offset must be >= 0 and limit > 0")
+            return await run_in_threadpool(read_page, file_path, offset, limit)
+
+        return StreamingResponse(
+            iter_file(file_path),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'inline; filename="{os.path.basename(filename)}"'}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.get("/api/data-summary/{filename}")
-async def get_data_summary(filename: str):
-    """Get clean data summary statistics"""
+async def get_data_summary(filename: str, approximate: bool = False):
+    """Get clean data summary statistics
+
+    Computed in one streaming pass and persisted per file content hash, so
+    repeat calls are O(1). With approximate=true, a summary that is not ready
+    yet is estimated from a random sample of rows, with 95% error bounds,
+    while the exact pass finishes in the background.
+    """
     try:
         file_path = os.path.join("uploads", filename)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Read CSV file with pandas
-        df = pd.read_csv(file_path)
-        
-        # Basic counts
-        total_records = len(df)
-        
-        # Age stats (handle different possible column names)
-        age_col = None
-        for col in ['Age', 'age', 'AGE']:
-            if col in df.columns:
-                age_col = col
-                break
-        avg_age = df[age_col].mean() if age_col else None
-        
-        # Gender stats (F percentage)
-        gender_col = None
-        for col in ['gender', 'Gender', 'GENDER']:
-            if col in df.columns:
-                gender_col = col
-                break
-        
-        pct_female = None
-        if gender_col:
-            if df[gender_col].dtype == 'object':  # String values like 'F', 'M'
-                pct_female = (df[gender_col] == 'F').mean() * 100
-            else:  # Numeric values like 0, 1
-                pct_female = (df[gender_col] == 0).mean() * 100
-        
-        # Medical conditions percentages
-        conditions = ['diabetes', 'hypertension', 'chronic_kidney', 'liver_disease', 'copd', 'heart_disease']
-        condition_stats = {}
-        
-        for condition in conditions:
-            # Try different case variations
-            col_found = None
-            for col in df.columns:
-                if col.lower().replace(' ', '_') == condition:
-                    col_found = col
-                    break
-            
-            if col_found:
-                condition_stats[condition] = (df[col_found] == 1).mean() * 100
-        
-        # Payer distribution
-        payer_col = None
-        for col in ['Payer', 'payer', 'PAYER']:
-            if col in df.columns:
-                payer_col = col
-                break
-        
-        payer_stats = {}
-        if payer_col:
-            payer_counts = df[payer_col].value_counts()
-            payer_stats = {
-                payer: (count / total_records * 100) 
-                for payer, count in payer_counts.items()
-            }
-        
-        return {
-            "total_records": total_records,
-            "average_age": round(avg_age, 1) if avg_age else None,
-            "percent_female": round(pct_female, 1) if pct_female else None,
-            "condition_percentages": {k: round(v, 1) for k, v in condition_stats.items()},
-            "payer_distribution": {k: round(v, 1) for k, v in payer_stats.items()}
-        }
+        return await run_in_threadpool(get_summary, file_path, approximate)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -230,21 +388,16 @@ async def get_data_summary(filename: str):
 async def get_weather_data(date: str):
     """Get weather data for a specific date"""
     try:
-        weather_file = os.path.join("data", "weather_data.csv")
-        if not os.path.exists(weather_file):
+        store = get_weather_store()
+        try:
+            filtered_data = store.rows(date, columns=['date', 'zipcode', 'AQI'])
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Weather data file not found")
         
-        # Read weather data
-        df = pd.read_csv(weather_file)
-        
-        # Filter by date
-        filtered_data = df[df['date'].astype(str) == date]
-        
         if len(filtered_data) == 0:
             raise HTTPException(status_code=404, detail=f"No weather data found for date {date}")
         
-        # Return only required columns
-        result = filtered_data[['date', 'zipcode', 'AQI']].to_dict('records')
+        result = filtered_data.to_dict('records')
         
         return {
             "date": date,
@@ -252,164 +405,91 @@ async def get_weather_data(date: str):
             "weather_data": result
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.post("/api/compute_risk_with_weather")
-async def compute_risk_with_weather(date: str = None, filename: str = None):
-    """Compute risk by merging patient data with weather data for a specific date"""
+async def compute_risk_with_weather(date: str = None, filename: str = None, memory_budget_mb: int | None = None,
+                                    end_date: str | None = None, model_version: str | None = None):
+    """Compute risk by merging patient data with weather data for a specific date
+
+    The analysis runs as a background job (see /api/jobs) and this endpoint
+    waits for it without blocking the event loop. The patient file is streamed
+    in chunks sized to memory_budget_mb (defaults to RISK_MEMORY_BUDGET_MB).
+    With end_date, every date in [date, end_date] is analysed in one pass,
+    producing per-member-per-day rows plus a per-member rollup file.
+    model_version pins a model registry version (defaults to the active one).
+    """
     try:
-        print(f"[risk] compute_risk_with_weather START date={date}, filename={filename}")
-        # Load the model
-        if not hasattr(compute_risk_with_weather, 'model_loaded'):
-            load_model()
-            compute_risk_with_weather.model_loaded = True
-        
-        # 1. Get weather data for the date
-        try:
-            weather_filtered = load_weather_for_date(date)
-        except FileNotFoundError as e:
-            raise HTTPException(status_code=404, detail=str(e))
-        
-        print(f"[risk] weather rows for {date}: {len(weather_filtered)}")
-        if len(weather_filtered) > 0:
-            print(f"[risk] weather sample ZIPs: {weather_filtered['zipcode'].head(5).tolist()}")
-        if len(weather_filtered) == 0:
-            raise HTTPException(status_code=404, detail=f"No weather data for date {date}")
-        
-        # 2. Load patient CSV file (if ANALYSIS_..., use the original source file)
-        request_filename = filename or ''
-        base_filename = request_filename
-        if request_filename.startswith('ANALYSIS_'):
-            # Strip ANALYSIS_YYYYMMDD_ prefix if present
-            parts = request_filename.split('_', 2)
-            if len(parts) >= 3 and parts[0] == 'ANALYSIS' and parts[1].isdigit():
-                base_filename = parts[2]
-        patient_file = os.path.join("uploads", base_filename)
-        if not os.path.exists(patient_file):
-            # Fallback to the provided filename if derived base not found
-            patient_file = os.path.join("uploads", request_filename)
-        if not os.path.exists(patient_file):
-            raise HTTPException(status_code=404, detail=f"Patient file not found: {base_filename} or {request_filename}")
-
-        print(f"[risk] loading patient file: {os.path.basename(patient_file)} (requested={request_filename})")
-        patient_df = pd.read_csv(patient_file)
-        print(f"[risk] patient file shape: {patient_df.shape}")
-        print(f"[risk] patient columns: {list(patient_df.columns)[:20]}")
-        # Guarantee there is no AQI column entering the merge from patient side
-        if 'AQI' in patient_df.columns:
-            patient_df = patient_df.drop(columns=['AQI'])
-        
-        # Coerce zip columns to numeric (strict), drop rows where conversion fails
-        patient_df['plan_zip'] = pd.to_numeric(patient_df['plan_zip'], errors='coerce')
-        weather_filtered['zipcode'] = pd.to_numeric(weather_filtered['zipcode'], errors='coerce')
-        before_zip_patient = len(patient_df)
-        before_zip_weather = len(weather_filtered)
-        patient_df = patient_df.dropna(subset=['plan_zip'])
-        weather_filtered = weather_filtered.dropna(subset=['zipcode'])
-        print(f"[risk] dropped non-numeric zips -> patients: {before_zip_patient}->{len(patient_df)}, weather: {before_zip_weather}->{len(weather_filtered)}")
-
-        merged_df = patient_df.merge(
-            weather_filtered,
-            left_on='plan_zip',
-            right_on='zipcode',
-            how='inner'  # exclude rows without AQI
-        )
-        print(f"[risk] merged shape (inner on Plan Zip vs zipcode): {merged_df.shape}")
-        
-        # Keep only needed columns
-        # Weather provides the AQI; normalize any suffixes then drop helpers
-        if 'AQI_y' in merged_df.columns:
-            merged_df = merged_df.rename(columns={'AQI_y': 'AQI'})
-        if 'AQI_x' in merged_df.columns:
-            merged_df = merged_df.drop(columns=['AQI_x'])
-        if 'AQI' not in merged_df.columns:
-            raise HTTPException(status_code=400, detail="AQI missing after merge")
-        if 'zipcode' in merged_df.columns:
-            merged_df = merged_df.drop(columns=['zipcode'])
-        
-        # 4. Apply the model (no fallbacks; require exact columns)
-        required_cols = ['Age', 'AQI', 'diabetes', 'hypertension', 'heart_disease']
-        missing_cols = [c for c in required_cols if c not in merged_df.columns]
-        if missing_cols:
-            print(f"[risk] missing columns: {missing_cols}")
-            raise HTTPException(status_code=400, detail=f"Missing columns: {missing_cols}")
-
-        # Coerce required numeric columns to numeric (no filling)
-        for c in ['Age', 'AQI', 'diabetes', 'hypertension', 'heart_disease']:
-            merged_df[c] = pd.to_numeric(merged_df[c], errors='coerce')
-
-        # Per requirements: do not fill NA; drop rows with any NA in required columns
-        before_rows = len(merged_df)
-        merged_df = merged_df.dropna(subset=required_cols)
-        after_rows = len(merged_df)
-        print(f"[risk] rows after dropna on required cols: {before_rows}->{after_rows}")
-        if after_rows == 0:
-            raise HTTPException(status_code=400, detail="All rows dropped after filtering: missing values in required columns or no ZIP matches for chosen date")
-        
-        # Apply model to all rows at once (MUCH FASTER - batch processing)
-        print(f"⚡ Processing {len(merged_df)} records with batch prediction...")
-        start_time = time.time()
-        
-        try:
-            # Use batch prediction for massive speed improvement
-            risk_scores = predict_risk_batch(merged_df)
-            merged_df['risk_percentage'] = risk_scores
-            
-            processing_time = time.time() - start_time
-            print(f"✅ Batch processing completed in {processing_time:.2f} seconds")
-            print(f"🚀 Speed: {len(merged_df)/processing_time:.0f} records/second")
-            
-        except Exception as e:
-            print(f"❌ Batch processing failed: {e}")
-            print(traceback.format_exc())
-            print("🔄 Falling back to row-by-row processing...")
-            
-            # Fallback to individual processing if batch fails
-            risk_scores = []
-            for _, row in merged_df.iterrows():
-                try:
-                    risk = predict_risk_percentage(
-                        age=int(row['Age']),
-                        aqi=int(row['AQI']),
-                        diabetes=int(row['diabetes']),
-                        hypertension=int(row['hypertension']),
-                        heart_disease=int(row['heart_disease'])
-                    )
-                    risk_scores.append(risk)
-                except Exception as e:
-                    risk_scores.append(None)
-            
-            merged_df['risk_percentage'] = risk_scores
-        
-        # Add inpatient dollars increase using AQI category and lift table
-        merged_df = calc_inpatient_dollars_increase(merged_df)
-        
-        # 5. Save updated file with clear composite name using BASE patient file
-        # Format: ANALYSIS_<ANALYSISDATE>_<BASEFILENAME>
-        output_filename = f"ANALYSIS_{date}_{os.path.basename(base_filename)}"
-        output_path = os.path.join("uploads", output_filename)
-        merged_df.to_csv(output_path, index=False)
-        
-        return {
-            "message": "Risk analysis completed",
-            "output_file": output_filename,
-            "records_processed": len(merged_df),
-            "weather_matches": len(merged_df[merged_df['AQI'].notna()]),
-            "average_risk": merged_df['risk_percentage'].mean() if len(merged_df) > 0 else None
-        }
+        log_event("risk_analysis_requested", date=date, end_date=end_date, filename=filename,
+                  model_version=model_version)
+        model_version = pin_model_version(model_version)
+        with stage("cache_key"):
+            cache_key = await run_in_threadpool(job_manager.cache.key_for, date, filename, end_date, model_version)
+        job, _ = job_manager.submit(date, filename, memory_budget_mb, cache_key, end_date, model_version)
+        result = await asyncio.wrap_future(job.future)
+        # The analysis ran in a worker process; add its stages to this request's breakdown
+        telemetry.add_to_profile(job.stages)
+        return result
         
+    except AnalysisError as ae:
+        log_event("risk_analysis_failed", level="warning", status_code=ae.status_code, detail=ae.detail)
+        raise HTTPException(status_code=ae.status_code, detail=ae.detail)
+    except (CancelledError, JobCancelled):
+        raise HTTPException(status_code=409, detail="Risk analysis was cancelled")
     except HTTPException as he:
         # Let FastAPI handle these gracefully with their status codes
-        print(f"[risk] HTTPException: {he.status_code} {he.detail}")
+        log_event("risk_analysis_failed", level="warning", status_code=he.status_code, detail=he.detail)
         raise he
     except Exception as e:
-        print("[risk] Unhandled error in compute_risk_with_weather:")
-        print(traceback.format_exc())
+        log_event("risk_analysis_failed", level="error", error=str(e), traceback=traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.post("/api/jobs/compute_risk_with_weather")
+async def submit_risk_job(date: str, filename: str, memory_budget_mb: int | None = None, end_date: str | None = None,
+                         model_version: str | None = None):
+    """Queue a risk analysis (a single date, or [date, end_date]) and return its job id immediately"""
+    try:
+        model_version = pin_model_version(model_version)
+        cache_key = await run_in_threadpool(job_manager.cache.key_for, date, filename, end_date, model_version)
+    except AnalysisError as ae:
+        raise HTTPException(status_code=ae.status_code, detail=ae.detail)
+    job, created = job_manager.submit(date, filename, memory_budget_mb, cache_key, end_date, model_version)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "model_version": job.model_version,
+        "coalesced": not created,
+        "cached": job.cached
+    }
+
+@app.get("/api/jobs")
+async def list_jobs():
+    """List known analysis jobs with their status and progress"""
+    return {"jobs": [job_manager.status(job) for job in job_manager.list()]}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get status, progress (rows processed, rows/sec) and result of a job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_manager.status(job)
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job_manager.status(job)
+
 @app.post("/api/top_risk")
-async def top_risk(filename: str, percentile: float = 0.9, rows: int = 200, write_file: bool = True):
+async def top_risk(filename: str, percentile: float = 0.9, rows: int = 200, write_file: bool = True, offset: int = 0):
     """Return top percentile risk rows and optionally write a filtered file.
 
     Args:
@@ -417,49 +497,64 @@ async def top_risk(filename: str, percentile: float = 0.9, rows: int = 200, writ
         percentile: threshold percentile (e.g., 0.9 for top 10%)
         rows: number of preview rows to return
         write_file: whether to write filtered file to uploads
+        offset: preview page start, for paging through the top-risk rows
     """
     try:
         file_path = os.path.join("uploads", filename)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
 
-        df = pd.read_csv(file_path)
-        if 'risk_percentage' not in df.columns:
-            raise HTTPException(status_code=400, detail="risk_percentage column not found. Run analysis first.")
-
-        # Compute threshold and filter
-        threshold = df['risk_percentage'].quantile(percentile)
-        filtered = df[df['risk_percentage'] >= threshold].sort_values('risk_percentage', ascending=False)
-
-        # Write filtered file
-        output_filename = None
-        if write_file:
-            output_filename = f"ANALYSIS_TOP{int((1-percentile)*100)}_{filename}"
-            filtered.to_csv(os.path.join("uploads", output_filename), index=False)
+        return await run_in_threadpool(top_risk_rows, file_path, filename, percentile, rows, offset, write_file)
+    except LookupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
-        # Preview as CSV string (first N rows)
-        preview_csv = filtered.head(rows).to_csv(index=False)
+@app.get("/api/cube/{filename}")
+async def cube_query(filename: str, group_by: str | None = None, plan_zip: str | None = None, LOB: str | None = None,
+                     aqi_category: str | None = None, diabetes: str | None = None, hypertension: str | None = None,
+                     heart_disease: str | None = None, percentiles: str = DEFAULT_PERCENTILES,
+                     sort_by: str = "members", limit: int = 1000):
+    """Slice and roll up an analysis's rollup cube.
 
-        return {
-            "count": int(len(filtered)),
-            "threshold": float(threshold) if pd.notna(threshold) else None,
-            "csv_preview": preview_csv,
-            "output_file": output_filename
-        }
+    Args:
+        filename: ANALYSIS_ file in uploads directory
+        group_by: comma-separated dimensions (plan_zip, LOB, aqi_category, diabetes,
+            hypertension, heart_disease); omit for a single total
+        plan_zip ... heart_disease: comma-separated values to keep for that dimension
+        percentiles: comma-separated risk percentiles (e.g. 0.5,0.9)
+        sort_by: members, mean_risk, inpatient_cost_increase or a percentile (p50, p90, ...)
+        limit: max groups returned
+    """
+    try:
+        file_path = os.path.join("uploads", filename)
+        if not filename.startswith("ANALYSIS_") or not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="Analysis file not found")
+
+        filters = {"plan_zip": plan_zip, "LOB": LOB, "aqi_category": aqi_category, "diabetes": diabetes,
+                   "hypertension": hypertension, "heart_disease": heart_disease}
+        return await run_in_threadpool(query_cube, file_path, filename, group_by, filters, percentiles, sort_by, limit)
+    except CubeError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.get("/api/compute_risk")
-async def compute_risk(age: int, aqi: int = 150, diabetes: int = 0, hypertension: int = 0, heart_disease: int = 0):
-    """Calculate health risk using the trained climate health model"""
-    print(f"Risk calculation requested - Age: {age}, AQI: {aqi}, Diabetes: {diabetes}, Hypertension: {hypertension}, Heart Disease: {heart_disease}")
+async def compute_risk(age: int, aqi: int = 150, diabetes: int = 0, hypertension: int = 0, heart_disease: int = 0,
+                       model_version: str | None = None):
+    """Calculate health risk using the trained climate health model (the active version, or model_version)"""
     
     try:
-        # Use the trained model to predict risk
-        risk_percentage = predict_risk_percentage(age, aqi, diabetes, hypertension, heart_disease)
+        # Use the trained model to predict risk (micro-batched with concurrent calls when enabled)
+        risk_percentage, version = await score_risk(age, aqi, diabetes, hypertension, heart_disease, model_version)
         
         result = {
             "risk_percentage": risk_percentage,
+            "model_version": version,
             "inputs": {
                 "age": age,
                 "aqi": aqi,
@@ -469,13 +564,52 @@ async def compute_risk(age: int, aqi: int = 150, diabetes: int = 0, hypertension
             }
         }
         
-        print(f"Risk calculation result: {result}")
+        log_event("risk_score", risk_percentage=risk_percentage, model_version=version, **result["inputs"])
         return result
         
+    except ModelVersionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
-        print(f"Error calculating risk: {e}")
+        log_event("risk_score_failed", level="error", error=str(e))
         raise HTTPException(status_code=500, detail=f"Error calculating risk: {str(e)}")
 
+@app.post("/api/compute_risk/bulk")
+async def compute_risk_bulk(request: Request, format: str | None = None, model_version: str | None = None):
+    """
+    Score many /api/compute_risk records in one request.
+
+    The body is a JSON array, NDJSON or an Arrow IPC stream of
+    {age, aqi, diabetes, hypertension, heart_disease[, id]} records (see
+    bulk_scoring). Results are streamed back batch by batch in the request's
+    format, or in `format` (json, ndjson or arrow) / the Accept header's.
+    Every record is scored with one model version (model_version, or the
+    active one), returned in the X-Model-Version header.
+    """
+    try:
+        return await open_bulk_stream(request, format, model_version)
+    except BulkScoringError as e:
+        headers = {"Retry-After": str(max(1, round(BULK_QUEUE_SECONDS)))} if e.status_code == 429 else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+@app.get("/api/models")
+async def list_models():
+    """List loaded model versions (newest first) and the active one"""
+    models = get_registry().versions()
+    return {
+        "active": next((m["version"] for m in models if m["active"]), None),
+        "models": models
+    }
+
+@app.post("/api/models/{version}/activate")
+async def activate_model(version: str):
+    """Make a model version the active one (for every server process sharing MODEL_DIR)"""
+    try:
+        data = await run_in_threadpool(get_registry().activate, version)
+    except ModelVersionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    log_event("model_activation_requested", sample_rate=1.0, version=version)
+    return {"active": data.get("version"), "models": get_registry().versions()}
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app", 
@@ -0,0 +1,216 @@
+"""
+Versioned model registry with background hot-swap.
+
+Every *.pkl in MODEL_DIR is a model version named after its file stem (the
+original data-exploration/climate_health_model.pkl is version
+"climate_health_model"). refresh() loads new or changed pickles and pre-warms
+them (fast scorer parity check, risk table) before they can be served, then
+activates the version named in MODEL_DIR/ACTIVE_MODEL, or the newest pickle
+when that file is absent. Activation swaps utils.model_data, a single
+reference, so a request scores with one version from start to finish and
+in-flight requests keep the version they started with.
+
+The server runs refresh() every MODEL_POLL_SECONDS in a background thread, so
+dropping a retrained pickle into MODEL_DIR (write it under another name and
+rename it in, so it never appears half-written) swaps it in without a
+restart. Requests can pin a version by name; job workers load pinned
+versions from MODEL_DIR on demand.
+"""
+import os
+import threading
+import time
+
+import utils
+from telemetry import counter, gauge, log_event
+
+MODEL_DIR = os.path.abspath(
+    os.environ.get("MODEL_DIR")
+    or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data-exploration')
+)
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", "10"))
+# Holds the name of the version to serve; written by activate()
+ACTIVE_FILE = "ACTIVE_MODEL"
+MODEL_SUFFIX = ".pkl"
+
+MODEL_SWAPS = counter("model_swaps_total", "Active model version changes")
+MODEL_ACTIVE = gauge("model_active", "1 for the active model version, 0 for the other loaded versions")
+
+
+class ModelVersionError(Exception):
+    """Unknown or unloadable model version, mapped onto an HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class ModelRegistry:
+    """Loaded model versions from one directory, plus the active one."""
+
+    def __init__(self, model_dir: str = MODEL_DIR):
+        self.model_dir = model_dir
+        # Serializes refreshes (the watcher, on-demand loads, activate); readers never wait on it
+        self._lock = threading.RLock()
+        # version -> loaded model dict (with 'version', 'path', 'signature' and 'loaded_at')
+        self._versions = {}
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def _scan(self) -> dict:
+        """version -> (path, (mtime_ns, size)) for every pickle in the directory."""
+        found = {}
+        try:
+            names = os.listdir(self.model_dir)
+        except FileNotFoundError:
+            return found
+        for name in names:
+            if not name.endswith(MODEL_SUFFIX):
+                continue
+            path = os.path.join(self.model_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found[name[:-len(MODEL_SUFFIX)]] = (path, (stat.st_mtime_ns, stat.st_size))
+        return found
+
+    def _load(self, version: str, path: str, signature: tuple) -> dict:
+        data = utils.load_model_file(path)
+        data.update(version=version, path=path, signature=signature, loaded_at=time.time())
+        return data
+
+    def _requested_version(self):
+        try:
+            with open(os.path.join(self.model_dir, ACTIVE_FILE), 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def refresh(self) -> dict | None:
+        """
+        Load new or changed versions, forget deleted ones (except the active one)
+        and activate the requested or newest version.
+
+        Returns:
+        - the active model dict, or None when no version could be loaded
+        """
+        with self._lock:
+            found = self._scan()
+            loaded = dict(self._versions)
+            for version, (path, signature) in found.items():
+                current = loaded.get(version)
+                if current is not None and current['signature'] == signature:
+                    continue
+                # Loaded and pre-warmed before it is visible to requests
+                try:
+                    loaded[version] = self._load(version, path, signature)
+                    log_event("model_version_loaded", sample_rate=1.0, version=version,
+                              model_hash=loaded[version]['model_hash'][:16])
+                except Exception as e:
+                    log_event("model_version_load_failed", level="error", version=version, error=str(e))
+
+            active = utils.model_data
+            active_version = active.get('version') if active is not None else None
+            loaded = {v: d for v, d in loaded.items() if v in found or v == active_version}
+
+            requested = self._requested_version()
+            if requested not in loaded:
+                if requested is not None:
+                    log_event("model_version_missing", level="warning", version=requested, file=ACTIVE_FILE)
+                requested = max(loaded, key=lambda v: loaded[v]['signature'][0], default=None)
+
+            self._versions = loaded
+            if requested is not None and loaded[requested] is not active:
+                self._swap(loaded[requested], active_version)
+            self._update_gauge()
+        return utils.model_data
+
+    def _swap(self, data: dict, previous):
+        utils.model_data = data
+        MODEL_SWAPS.inc()
+        log_event("model_activated", sample_rate=1.0, version=data['version'], previous=previous,
+                  model_hash=data['model_hash'][:16])
+
+    def _update_gauge(self):
+        active = utils.model_data
+        for version in self._versions:
+            MODEL_ACTIVE.set(1 if active is not None and active.get('version') == version else 0, version=version)
+
+    def get(self, version: str | None = None) -> dict:
+        """
+        The active model, or a pinned version (loaded from MODEL_DIR if this
+        process has not seen it yet).
+
+        Raises:
+        - ModelVersionError: 503 when no model is loaded, 404 for an unknown version
+        """
+        if version is None:
+            data = utils.model_data
+            if data is None:
+                raise ModelVersionError(503, "Model not loaded")
+            return data
+        data = self._versions.get(version)
+        if data is None:
+            self.refresh()
+            data = self._versions.get(version)
+        if data is None:
+            raise ModelVersionError(404, f"Unknown model version {version}")
+        return data
+
+    def activate(self, version: str) -> dict:
+        """Make version the active one, here and (through ACTIVE_FILE) in every other server process."""
+        self.get(version)
+        path = os.path.join(self.model_dir, ACTIVE_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(tmp_path, path)
+        return self.refresh()
+
+    def versions(self) -> list:
+        """Loaded versions, newest first."""
+        active = utils.model_data
+        return [
+            {
+                "version": version,
+                "active": active is not None and data is active,
+                "model_hash": data['model_hash'],
+                "fast_scorer": data.get('fast_scorer') is not None,
+                "risk_table": data.get('risk_table') is not None,
+                "modified_at": data['signature'][0] / 1e9,
+                "loaded_at": data['loaded_at'],
+            }
+            for version, data in sorted(self._versions.items(), key=lambda item: -item[1]['signature'][0])
+        ]
+
+    def _watch(self):
+        while not self._stop.wait(MODEL_POLL_SECONDS):
+            try:
+                self.refresh()
+            except Exception as e:
+                log_event("model_refresh_failed", level="error", error=str(e))
+
+    def start_watching(self):
+        """Poll MODEL_DIR for new versions in a background thread (once per process)."""
+        if self._watcher is None and MODEL_POLL_SECONDS > 0:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        self._watcher = None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """The process-wide registry for MODEL_DIR."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,744 @@
+"""
+Chunked risk analysis pipeline for patient rosters.
+
+The patient roster (its columnar copy when available, otherwise the CSV) is
+streamed in chunks sized from a memory budget:
+read chunk -> coerce -> join AQI -> predict_risk_batch -> lift join -> append
+to the ANALYSIS output. Only one chunk (plus the weather slice for the date)
+is resident at a time, and the response aggregates are kept as running totals.
+For a single date the AQI join is a gather from the date's dense ZIP index.
+
+With an end date the weather slice covers every date in the range, so each
+chunk is joined against all dates in one merge and scored in one batch,
+giving one output row per member per day. Per-member rollups (max/mean risk,
+peak day, cumulative cost increase) are written alongside as Parquet.
+
+Large rosters can be analysed in sharded mode: the roster is split into
+row-range shards, each analysed by a worker process (forked, so the model and
+weather store are shared copy-on-write), and the shard outputs are
+concatenated in row order into the ANALYSIS file.
+
+Single-date analyses record a row manifest beside their output; when the
+roster or weather changes, the next run copies the unchanged rows' output
+and rescores only the delta (see incremental).
+
+Every analysis also aggregates its output rows into a rollup cube (counts,
+risk and inpatient cost by plan_zip x LOB x aqi_category x conditions),
+saved beside the output for dashboard slice and roll-up queries (see cube).
+
+The model version is resolved once per analysis (the active one, or a pinned
+version) and used for every chunk and shard, even if the registry swaps the
+active model mid-run; each output row records it in a model_version column.
+"""
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import utils
+from columnar import column_names, iter_chunks, pa, pq, read_head, total_rows
+from cube import CubeBuilder, cube_path, read_cube
+from incremental import (INCREMENTAL, IncrementalUnavailable, Manifest, ManifestBuilder, changed_zips, copy_range,
+                         line_lengths, load_manifest, new_line_offsets, row_hashes, write_rows, zip_fingerprints)
+from model_registry import ModelVersionError, get_registry
+from row_index import ROW_INDEX_STRIDE
+from telemetry import log_event, merge_stages, profile, record_stage, stage
+from utils import (calc_inpatient_dollars_increase, predict_risk_percentage, predict_risk_batch, get_weather,
+                   get_weather_range, get_weather_zip_index)
+
+UPLOADS_DIR = "uploads"
+
+# Peak memory budget for one analysis (MB); override per request or via env
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get("RISK_MEMORY_BUDGET_MB", "256"))
+
+# A chunk is alive in roughly this many copies at once (raw, merged, scored, lifted)
+WORKING_COPIES = 4
+MIN_CHUNK_ROWS = 1_000
+SAMPLE_ROWS = 1_000
+
+REQUIRED_COLUMNS = ['Age', 'AQI', 'diabetes', 'hypertension', 'heart_disease']
+PATIENT_REQUIRED_COLUMNS = ['plan_zip', 'Age', 'diabetes', 'hypertension', 'heart_disease']
+
+# Sharded execution: worker processes per analysis (1 disables sharding), shard sizing
+SHARD_WORKERS = int(os.environ.get("ANALYSIS_SHARD_WORKERS", "1"))
+SHARDS_PER_WORKER = 4
+MIN_SHARD_ROWS = 50_000
+COPY_BLOCK_BYTES = 1024 * 1024
+
+# Roster row number carried through the join in range mode (not written out)
+MEMBER_ROW_COLUMN = '_member_row'
+
+
+class AnalysisError(Exception):
+    """Analysis failure that maps onto an HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+    def __reduce__(self):
+        # Keep both fields when the error crosses a process boundary
+        return (AnalysisError, (self.status_code, self.detail))
+
+
+def resolve_patient_file(filename: str | None, uploads_dir: str = UPLOADS_DIR):
+    """
+    Resolve the patient roster for a request (if ANALYSIS_..., use the original source file).
+
+    Both ANALYSIS_YYYYMMDD_ and ANALYSIS_YYYYMMDD-YYYYMMDD_ (date range) prefixes are recognised.
+
+    Returns:
+    - (base_filename, patient_file) tuple
+    """
+    request_filename = filename or ''
+    base_filename = request_filename
+    if request_filename.startswith('ANALYSIS_'):
+        # Strip ANALYSIS_YYYYMMDD_ prefix if present
+        parts = request_filename.split('_', 2)
+        if len(parts) >= 3 and parts[0] == 'ANALYSIS' and parts[1].replace('-', '').isdigit():
+            base_filename = parts[2]
+    patient_file = os.path.join(uploads_dir, base_filename)
+    if not os.path.exists(patient_file):
+        # Fallback to the provided filename if derived base not found
+        patient_file = os.path.join(uploads_dir, request_filename)
+    if not os.path.exists(patient_file):
+        raise AnalysisError(404, f"Patient file not found: {base_filename} or {request_filename}")
+    return base_filename, patient_file
+
+
+def resolve_model(model_version: str | None = None) -> dict:
+    """The model to score an analysis with: a pinned registry version, or the active one."""
+    try:
+        return get_registry().get(model_version)
+    except ModelVersionError as e:
+        raise AnalysisError(e.status_code, e.detail)
+
+
+def analysis_label(date, end_date=None) -> str:
+    """Date part of an ANALYSIS_ file name: YYYYMMDD, or YYYYMMDD-YYYYMMDD for a range."""
+    return str(date) if end_date is None else f"{date}-{end_date}"
+
+
+def estimate_chunk_rows(patient_file: str, memory_budget_mb: int | None = None) -> int:
+    """Pick a chunk size so WORKING_COPIES of one chunk fit in the memory budget."""
+    budget_bytes = (memory_budget_mb or DEFAULT_MEMORY_BUDGET_MB) * 1024 * 1024
+    sample = read_head(patient_file, SAMPLE_ROWS)
+    if len(sample) == 0:
+        return MIN_CHUNK_ROWS
+    bytes_per_row = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+    return max(MIN_CHUNK_ROWS, int(budget_bytes / (bytes_per_row * WORKING_COPIES)))
+
+
+def prepare_weather(weather_df: pd.DataFrame) -> pd.DataFrame:
+    """Coerce weather zipcodes to numeric once per analysis and drop the unusable rows."""
+    weather_df = weather_df.copy()
+    weather_df['zipcode'] = pd.to_numeric(weather_df['zipcode'], errors='coerce')
+    return weather_df.dropna(subset=['zipcode'])
+
+
+def score_frame(merged_df: pd.DataFrame, model=None):
+    """Batch-score a frame, falling back to row-by-row prediction if the batch path fails."""
+    try:
+        return predict_risk_batch(merged_df, model)
+    except Exception as e:
+        log_event("batch_scoring_failed", level="error", error=str(e), traceback=traceback.format_exc(),
+                  fallback="row_by_row")
+
+    risk_scores = []
+    for _, row in merged_df.iterrows():
+        try:
+            risk = predict_risk_percentage(
+                age=int(row['Age']),
+                aqi=int(row['AQI']),
+                diabetes=int(row['diabetes']),
+                hypertension=int(row['hypertension']),
+                heart_disease=int(row['heart_disease']),
+                model=model
+            )
+            risk_scores.append(risk)
+        except Exception:
+            risk_scores.append(None)
+    return risk_scores
+
+
+def join_weather(patient_df: pd.DataFrame, weather_df: pd.DataFrame, zip_index=None) -> pd.DataFrame:
+    """
+    Inner-join patients to weather on plan_zip, appending AQI and aqi_category.
+
+    With a ZipIndex (single date) the join is a gather from the dense ZIP
+    arrays plus a validity mask; otherwise (date ranges, or weather that
+    cannot be indexed densely) it is a merge on zipcode. Both keep patient
+    row order and produce the same columns; the gather returns aqi_category
+    as a Categorical.
+    """
+    if zip_index is None:
+        return patient_df.merge(
+            weather_df,
+            left_on='plan_zip',
+            right_on='zipcode',
+            how='inner'  # exclude rows without AQI
+        ).drop(columns=['zipcode'])
+
+    mask, aqi, categories = zip_index.lookup(patient_df['plan_zip'].to_numpy())
+    joined = patient_df.reset_index(drop=True) if mask.all() else patient_df[mask].reset_index(drop=True)
+    joined['AQI'] = aqi
+    joined['aqi_category'] = categories
+    return joined
+
+
+def process_chunk(patient_df: pd.DataFrame, weather_df: pd.DataFrame, zip_index=None, model=None) -> pd.DataFrame:
+    """
+    Join one patient chunk with the prepared weather slice, score it (with
+    model, a registry version; defaults to the active one) and apply the AQI lift.
+    """
+    model = model if model is not None else utils.model_data
+    # Guarantee there is no AQI column entering the merge from patient side
+    patient_df = patient_df.drop(columns=[c for c in ('AQI', 'aqi_category') if c in patient_df.columns])
+
+    # Coerce zip column to numeric (strict), drop rows where conversion fails
+    with stage("zip_coercion", rows=len(patient_df)):
+        patient_df['plan_zip'] = pd.to_numeric(patient_df['plan_zip'], errors='coerce')
+        patient_df = patient_df.dropna(subset=['plan_zip'])
+        # Keep integral ZIPs as integers so every chunk writes them the same way
+        if len(patient_df) and (patient_df['plan_zip'] % 1 == 0).all():
+            patient_df['plan_zip'] = patient_df['plan_zip'].astype(np.int64)
+
+    with stage("merge") as span:
+        merged_df = join_weather(patient_df, weather_df, zip_index)
+        span.rows = len(merged_df)
+
+    with stage("scoring") as span:
+        # Coerce required numeric columns to numeric (no filling) and drop incomplete rows
+        for c in REQUIRED_COLUMNS:
+            merged_df[c] = pd.to_numeric(merged_df[c], errors='coerce')
+        merged_df = merged_df.dropna(subset=REQUIRED_COLUMNS)
+        if len(merged_df) == 0:
+            return merged_df
+        span.rows = len(merged_df)
+        merged_df['risk_percentage'] = score_frame(merged_df, model)
+        merged_df['model_version'] = model.get('version')
+
+    # Add inpatient dollars increase using AQI category and lift table
+    with stage("lift_join", rows=len(merged_df)):
+        return calc_inpatient_dollars_increase(merged_df)
+
+
+def rollup_members(result_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-member rollup of per-day results (grouped by roster row).
+
+    Returns:
+    - DataFrame with member_row, member_id (if present), plan_zip, days,
+      max_risk, mean_risk, peak_date, max_aqi and total_cost_increase
+    """
+    frame = result_df.assign(risk_percentage=pd.to_numeric(result_df['risk_percentage'], errors='coerce'))
+    grouped = frame.groupby(MEMBER_ROW_COLUMN, sort=False)
+
+    rollup = pd.DataFrame({'member_row': grouped.size().index.to_numpy(dtype=np.int64)})
+    if 'member_id' in frame.columns:
+        rollup['member_id'] = grouped['member_id'].first().to_numpy()
+    rollup['plan_zip'] = grouped['plan_zip'].first().to_numpy()
+    rollup['days'] = grouped.size().to_numpy().astype(np.int16)
+    rollup['max_risk'] = grouped['risk_percentage'].max().to_numpy().astype(np.float32)
+    rollup['mean_risk'] = grouped['risk_percentage'].mean().to_numpy().astype(np.float32)
+    peak = frame['risk_percentage'].fillna(-1).groupby(frame[MEMBER_ROW_COLUMN], sort=False).idxmax()
+    rollup['peak_date'] = frame.loc[peak.to_numpy(), 'date'].astype(str).to_numpy()
+    rollup['max_aqi'] = grouped['AQI'].max().to_numpy().astype(np.float32)
+    if 'inpatient_cost_increase' in frame.columns:
+        rollup['total_cost_increase'] = grouped['inpatient_cost_increase'].sum().to_numpy()
+    return rollup
+
+
+def rollup_path(stem: str) -> str:
+    """Rollup file for an output stem: Parquet, or CSV without pyarrow."""
+    return f"{stem}.parquet" if pq is not None else f"{stem}.csv"
+
+
+class RollupWriter:
+    """Streams rollup chunks to a temporary Parquet file (CSV without pyarrow), moved into place on commit."""
+
+    def __init__(self, stem: str):
+        self.path = rollup_path(stem)
+        self.tmp_path = f"{self.path}.{uuid.uuid4().hex}.partial"
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+
+    def write(self, rollup: pd.DataFrame):
+        if pq is not None:
+            table = pa.Table.from_pandas(rollup, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema.remove_metadata()
+                self._writer = pq.ParquetWriter(self.tmp_path, self._schema)
+            self._writer.write_table(table.cast(self._schema))
+        else:
+            rollup.to_csv(self.tmp_path, mode='a', index=False, header=(self.rows == 0))
+        self.rows += len(rollup)
+
+    def close(self, commit: bool):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if commit and self.rows:
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def load_weather_slice(date, end_date=None):
+    """
+    Weather rows for a date (or every date in [date, end_date]), prepared for the join.
+
+    Returns:
+    - (weather_df, n_dates, zip_index): zip_index is the date's ZipIndex for a
+      single date (None for ranges or weather that cannot be indexed densely)
+    """
+    label = analysis_label(date, end_date)
+    with stage("weather_slice") as span:
+        try:
+            weather_df = get_weather(date) if end_date is None else get_weather_range(date, end_date)
+        except FileNotFoundError as e:
+            raise AnalysisError(404, str(e))
+        if len(weather_df) == 0:
+            raise AnalysisError(404, f"No weather data for date {label}")
+        weather_df = prepare_weather(weather_df)
+        n_dates = weather_df['date'].nunique() if end_date is not None else 1
+        zip_index = get_weather_zip_index(date) if end_date is None else None
+        span.rows = len(weather_df)
+    return weather_df, n_dates, zip_index
+
+
+def _timed_chunks(chunks):
+    """Yield from a chunk iterator, recording each read as a csv_read stage."""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        record_stage("csv_read", time.perf_counter() - start, len(chunk),
+                     int(chunk.memory_usage(index=False).sum()))
+        yield chunk
+
+
+def analyze_rows(patient_file: str, weather_df: pd.DataFrame, zip_index, chunk_rows: int, out,
+                 rollups: RollupWriter | None = None, start: int = 0, stop: int | None = None,
+                 progress=None, model=None, manifest: ManifestBuilder | None = None,
+                 cube: CubeBuilder | None = None) -> dict:
+    """
+    Stream roster rows [start, stop) through process_chunk, appending results to out (binary).
+
+    The CSV header is written with the first non-empty result. Member rows
+    (range mode) are numbered from start, so shards number them the same way
+    a single pass would. With a manifest builder, every roster row's hash and
+    output line are recorded for later incremental runs; with a cube builder,
+    every output row is aggregated into the rollup cube.
+
+    Returns:
+    - running totals: rows_read, records, risk_sum, risk_count
+    """
+    rows_read = 0
+    records = 0
+    risk_sum = 0.0
+    risk_count = 0
+    for chunk in _timed_chunks(iter_chunks(patient_file, chunk_rows, start=start, stop=stop)):
+        first = start + rows_read
+        if manifest is not None:
+            manifest.add_rows(row_hashes(chunk))
+        if rollups is not None or manifest is not None:
+            chunk[MEMBER_ROW_COLUMN] = np.arange(first, first + len(chunk), dtype=np.int64)
+        rows_read += len(chunk)
+        result_df = process_chunk(chunk, weather_df, zip_index, model)
+        if rollups is not None and len(result_df) > 0:
+            rollups.write(rollup_members(result_df))
+        if cube is not None and len(result_df) > 0:
+            with stage("cube", rows=len(result_df)):
+                cube.add(result_df)
+        if MEMBER_ROW_COLUMN in result_df.columns:
+            member_rows = result_df.pop(MEMBER_ROW_COLUMN).to_numpy()
+        if len(result_df) > 0:
+            with stage("csv_write", rows=len(result_df)) as span:
+                data = result_df.to_csv(index=False, header=(records == 0)).encode('utf-8')
+                out.write(data)
+                span.nbytes = len(data)
+            risk = pd.to_numeric(result_df['risk_percentage'], errors='coerce')
+            if manifest is not None:
+                cost = pd.to_numeric(result_df['inpatient_cost_increase'], errors='coerce').to_numpy(dtype=np.float64)
+                manifest.add_output(member_rows - first, data, risk.to_numpy(dtype=np.float64), cost,
+                                    header=(records == 0))
+            records += len(result_df)
+            risk_sum += float(risk.sum())
+            risk_count += int(risk.notna().sum())
+        if progress is not None:
+            progress(rows_read, records)
+    return {"rows_read": rows_read, "records": records, "risk_sum": risk_sum, "risk_count": risk_count}
+
+
+def _init_shard_worker():
+    """Load the model once per shard worker (already present when the pool forks)."""
+    if utils.model_data is None:
+        utils.load_model()
+
+
+def _analyze_shard(patient_file: str, date, end_date, chunk_rows: int, part_stem: str,
+                   start: int, stop: int, model_version: str | None = None, record_manifest: bool = False) -> dict:
+    """
+    Shard worker entry point: analyse rows [start, stop) into <part_stem>.csv (and its rollup,
+    cube and manifest parts).
+
+    Returns analyze_rows totals plus members and the shard's stage breakdown.
+    """
+    with profile() as shard_profile:
+        model = resolve_model(model_version)
+        weather_df, _, zip_index = load_weather_slice(date, end_date)
+        rollups = RollupWriter(f"{part_stem}_ROLLUP") if end_date is not None else None
+        manifest = ManifestBuilder() if record_manifest else None
+        cube = CubeBuilder()
+        committed = False
+        try:
+            with open(f"{part_stem}.csv", 'wb') as out:
+                totals = analyze_rows(patient_file, weather_df, zip_index, chunk_rows, out, rollups, start, stop,
+                                      model=model, manifest=manifest, cube=cube)
+            cube.save(rollup_path(f"{part_stem}_CUBE"))
+            if manifest is not None:
+                manifest.save_part(f"{part_stem}.manifest.npz")
+            committed = True
+        finally:
+            if rollups is not None:
+                rollups.close(committed)
+    totals["members"] = rollups.rows if rollups is not None else 0
+    totals["stages"] = shard_profile.as_dict()
+    return totals
+
+
+def shard_ranges(total_rows: int, workers: int) -> list:
+    """
+    Split [0, total_rows) into contiguous row ranges for sharded execution.
+
+    There are about SHARDS_PER_WORKER shards per worker (so a slow shard does
+    not leave the other workers idle at the end), each at least
+    MIN_SHARD_ROWS rows and aligned to the row index stride so a CSV shard
+    starts at an indexed offset.
+    """
+    shard_rows = max(MIN_SHARD_ROWS, -(-total_rows // (workers * SHARDS_PER_WORKER)))
+    shard_rows = -(-shard_rows // ROW_INDEX_STRIDE) * ROW_INDEX_STRIDE
+    return [(lo, min(lo + shard_rows, total_rows)) for lo in range(0, total_rows, shard_rows)]
+
+
+def _shard_pool(workers: int) -> ProcessPoolExecutor:
+    # Fork where available so workers inherit the loaded model and weather store
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                               initializer=_init_shard_worker)
+
+
+def _concat_csv_parts(part_paths: list, out_path: str):
+    """Concatenate shard CSVs in order, keeping only the first header."""
+    header_written = False
+    with open(out_path, 'wb') as out:
+        for path in part_paths:
+            with open(path, 'rb') as part:
+                header = part.readline()
+                if not header:
+                    continue
+                if not header_written:
+                    out.write(header)
+                    header_written = True
+                shutil.copyfileobj(part, out, COPY_BLOCK_BYTES)
+
+
+def _run_sharded(patient_file: str, date, end_date, chunk_rows: int, workers: int, total_rows: int,
+                 tmp_path: str, rollups: RollupWriter | None, progress=None, model_version: str | None = None,
+                 manifest: ManifestBuilder | None = None, cube: CubeBuilder | None = None) -> dict:
+    """Analyse row-range shards in a process pool and combine them into tmp_path (and rollups, manifest, cube)."""
+    ranges = shard_ranges(total_rows, workers)
+    part_stems = [f"{tmp_path}.{i:05d}" for i in range(len(ranges))]
+    log_event("analysis_sharded", shards=len(ranges), workers=workers, rows=total_rows)
+
+    totals = {"rows_read": 0, "records": 0, "risk_sum": 0.0, "risk_count": 0, "members": 0}
+    pool = _shard_pool(workers)
+    try:
+        futures = [
+            pool.submit(_analyze_shard, patient_file, date, end_date, chunk_rows, stem, lo, hi, model_version,
+                        manifest is not None)
+            for stem, (lo, hi) in zip(part_stems, ranges)
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            merge_stages(result.pop("stages"))
+            for key, value in result.items():
+                totals[key] += value
+            if progress is not None:
+                progress(totals["rows_read"], totals["records"])
+        pool.shutdown()
+
+        with stage("shard_concat", rows=totals["records"]):
+            _concat_csv_parts([f"{stem}.csv" for stem in part_stems], tmp_path)
+            if rollups is not None:
+                for stem in part_stems:
+                    path = rollup_path(f"{stem}_ROLLUP")
+                    if os.path.exists(path):
+                        rollups.write(pq.read_table(path).to_pandas() if pq is not None else pd.read_csv(path))
+            if manifest is not None:
+                for stem in part_stems:
+                    manifest.extend(ManifestBuilder.load_part(f"{stem}.manifest.npz"))
+            if cube is not None:
+                for stem in part_stems:
+                    cube.add_cube(read_cube(rollup_path(f"{stem}_CUBE")))
+    finally:
+        # Cancel queued shards on failure or cancellation; running ones finish before cleanup
+        pool.shutdown(cancel_futures=True)
+        for stem in part_stems:
+            for path in (f"{stem}.csv", rollup_path(f"{stem}_ROLLUP"), rollup_path(f"{stem}_CUBE"),
+                         f"{stem}.manifest.npz"):
+                if os.path.exists(path):
+                    os.remove(path)
+    return totals
+
+
+def _run_incremental(patient_file: str, weather_df: pd.DataFrame, zip_index, chunk_rows: int, out,
+                     previous: Manifest, stale_zips: np.ndarray, model, manifest: ManifestBuilder,
+                     progress=None, cube: CubeBuilder | None = None) -> dict:
+    """
+    Write the analysis to out (binary) from the previous output, rescoring only
+    roster rows that are new or changed, or whose ZIP is in stale_zips.
+
+    Reused rows are aggregated into the cube from the roster chunk, the date's
+    AQI categories and the risk and cost recorded in the previous manifest.
+
+    Raises IncrementalUnavailable when the previous output cannot be reused line by line.
+
+    Returns:
+    - analyze_rows totals plus reused_rows and rescored_rows
+    """
+    totals = {"rows_read": 0, "records": 0, "risk_sum": 0.0, "risk_count": 0, "reused_rows": 0, "rescored_rows": 0}
+    with open(previous.output_path, 'rb') as old:
+        copy_range(old, out, 0, previous.header_len)
+        manifest.header_len = previous.header_len
+        for chunk in _timed_chunks(iter_chunks(patient_file, chunk_rows)):
+            n = len(chunk)
+            with stage("incremental_plan", rows=n):
+                hashes = row_hashes(chunk)
+                matched = previous.match(hashes)
+                zips = pd.to_numeric(chunk['plan_zip'], errors='coerce').to_numpy(dtype=np.float64)
+                reuse = (matched >= 0) & ~np.isin(zips, stale_zips)
+                old_rows = matched[reuse]
+                lengths = np.zeros(n, dtype=np.int64)
+                offsets = np.zeros(n, dtype=np.int64)
+                risk = np.full(n, np.nan)
+                cost = np.full(n, np.nan)
+                lengths[reuse] = previous.lengths[old_rows]
+                offsets[reuse] = previous.offsets[old_rows]
+                risk[reuse] = previous.risk[old_rows]
+                cost[reuse] = previous.cost[old_rows]
+
+            reused = np.flatnonzero(lengths > 0)
+            if cube is not None and len(reused):
+                with stage("cube", rows=len(reused)):
+                    _, _, categories = zip_index.lookup(zips[reused])
+                    cube.add(chunk.iloc[reused].assign(plan_zip=zips[reused], aqi_category=categories,
+                                                       risk_percentage=risk[reused], inpatient_cost_increase=cost[reused]))
+
+            data = b""
+            rescore = np.flatnonzero(~reuse)
+            if len(rescore):
+                subset = chunk.iloc[rescore].assign(**{MEMBER_ROW_COLUMN: rescore})
+                result_df = process_chunk(subset, weather_df, zip_index, model)
+                if cube is not None and len(result_df) > 0:
+                    with stage("cube", rows=len(result_df)):
+                        cube.add(result_df)
+                if len(result_df) > 0:
+                    rows = result_df.pop(MEMBER_ROW_COLUMN).to_numpy()
+                    with stage("csv_write", rows=len(result_df)) as span:
+                        data = result_df.to_csv(index=False, header=False).encode('utf-8')
+                        span.nbytes = len(data)
+                    new_lengths = line_lengths(data, len(rows), header=False)
+                    lengths[rows] = new_lengths
+                    offsets[rows] = new_line_offsets(new_lengths)
+                    risk[rows] = pd.to_numeric(result_df['risk_percentage'], errors='coerce').to_numpy(dtype=np.float64)
+                    cost[rows] = pd.to_numeric(result_df['inpatient_cost_increase'],
+                                               errors='coerce').to_numpy(dtype=np.float64)
+
+            written = lengths > 0
+            with stage("incremental_write", rows=int(written.sum())) as span:
+                write_rows(out, old, reuse, offsets, lengths, data)
+                span.nbytes = int(lengths.sum())
+            manifest.add_rows(hashes, lengths, risk, cost)
+
+            totals["rows_read"] += n
+            totals["records"] += int(written.sum())
+            totals["risk_sum"] += float(np.nansum(risk[written]))
+            totals["risk_count"] += int(np.count_nonzero(~np.isnan(risk[written])))
+            totals["reused_rows"] += int(reuse.sum())
+            totals["rescored_rows"] += len(rescore)
+            if progress is not None:
+                progress(totals["rows_read"], totals["records"])
+    return totals
+
+
+def run_risk_analysis(date: str, filename: str | None, uploads_dir: str = UPLOADS_DIR,
+                      memory_budget_mb: int | None = None, progress=None, end_date: str | None = None,
+                      shard_workers: int | None = None, model_version: str | None = None) -> dict:
+    """
+    Stream a patient roster through the risk pipeline and write ANALYSIS_<date>_<file>.csv.
+
+    With end_date, every date in [date, end_date] is analysed in the same pass:
+    the output is ANALYSIS_<date>-<end_date>_<file>.csv with one row per member
+    per day (plus a date column), and per-member rollups are written to
+    ANALYSIS_<date>-<end_date>_<file stem>_ROLLUP.parquet.
+
+    The output's rollup cube is written to ANALYSIS_<label>_<file stem>_CUBE.parquet.
+
+    With more than one shard worker, rosters of at least MIN_SHARD_ROWS rows
+    are split into row-range shards analysed in parallel worker processes;
+    the shard outputs are concatenated in row order, so the output matches a
+    single-process run.
+
+    Parameters:
+    - date: YYYYMMDD weather date (start of the range when end_date is given)
+    - filename: patient file (or an ANALYSIS_ file derived from it) in uploads_dir
+    - uploads_dir: directory holding uploads and analysis outputs
+    - memory_budget_mb: peak memory budget used to size chunks (defaults to RISK_MEMORY_BUDGET_MB)
+    - progress: optional callable(rows_read, records_written) invoked after every chunk
+      (every shard when sharded); raising from it aborts the analysis and discards the partial output
+    - end_date: optional inclusive YYYYMMDD end of a date range
+    - shard_workers: worker processes for sharded execution (defaults to ANALYSIS_SHARD_WORKERS)
+    - model_version: model registry version to score with (defaults to the active one)
+
+    Returns:
+    - summary dict (output_file, records_processed, weather_matches, average_risk,
+      model_version, incremental (reused_rows, rescored_rows and changed_zips when the
+      previous output was patched, else None), cube_file; in range mode also start_date,
+      end_date, days, members and rollup_file)
+    """
+    label = analysis_label(date, end_date)
+    if end_date is not None and str(end_date) < str(date):
+        raise AnalysisError(400, f"end_date {end_date} is before start date {date}")
+
+    # Pin the model version for the whole run (and every shard)
+    model = resolve_model(model_version)
+
+    # 1. Get weather data for the date (or every date in the range, in one slice)
+    weather_df, n_dates, zip_index = load_weather_slice(date, end_date)
+
+    # 2. Locate patient CSV and validate its header
+    base_filename, patient_file = resolve_patient_file(filename, uploads_dir)
+    header = column_names(patient_file)
+    missing_cols = [c for c in PATIENT_REQUIRED_COLUMNS if c not in header]
+    if missing_cols:
+        log_event("analysis_rejected", level="warning", file=base_filename, missing_columns=missing_cols)
+        raise AnalysisError(400, f"Missing columns: {missing_cols}")
+
+    workers = max(1, shard_workers if shard_workers is not None else SHARD_WORKERS)
+    n_rows = total_rows(patient_file) if workers > 1 else None
+    sharded = n_rows is not None and n_rows >= MIN_SHARD_ROWS * 2
+
+    # Each roster row fans out to one row per date after the join; shard workers split the budget
+    chunk_rows = estimate_chunk_rows(patient_file, memory_budget_mb) // n_dates
+    chunk_rows = max(MIN_CHUNK_ROWS, chunk_rows // workers if sharded else chunk_rows)
+    log_event("analysis_started", date=label, file=os.path.basename(patient_file), weather_rows=len(weather_df),
+              chunk_rows=chunk_rows, sharded=sharded)
+
+    # 3. Stream chunks into a temporary output, then move it into place
+    # Format: ANALYSIS_<ANALYSISDATE>_<BASEFILENAME>
+    output_filename = f"ANALYSIS_{label}_{os.path.basename(base_filename)}"
+    output_path = os.path.join(uploads_dir, output_filename)
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.partial"
+    rollups = RollupWriter(f"{os.path.splitext(output_path)[0]}_ROLLUP") if end_date is not None else None
+    cube = CubeBuilder()
+
+    # Single dates indexed by ZIP record a row manifest, and reuse the previous one when it still applies
+    fingerprints = zip_fingerprints(weather_df) if INCREMENTAL and end_date is None and zip_index is not None else None
+    manifest = manifest_meta = previous = None
+    if fingerprints is not None:
+        manifest = ManifestBuilder()
+        manifest_meta = {
+            "date": str(date),
+            "columns": list(header),
+            "model_version": model.get('version'),
+            "model_hash": model['model_hash'],
+            "lift_table": utils.file_digest(utils.load_lift_table()['path']),
+        }
+        previous = load_manifest(output_path, manifest_meta)
+
+    start_time = time.time()
+    committed = False
+    try:
+        totals = None
+        if previous is not None:
+            stale_zips = changed_zips(previous.fingerprints, fingerprints)
+            try:
+                with open(tmp_path, 'wb') as out:
+                    totals = _run_incremental(patient_file, weather_df, zip_index, chunk_rows, out, previous,
+                                              stale_zips, model, manifest, progress, cube)
+                totals["changed_zips"] = len(stale_zips)
+            except IncrementalUnavailable as e:
+                log_event("incremental_fallback", level="warning", file=output_filename, reason=str(e))
+                manifest = ManifestBuilder()
+                cube = CubeBuilder()
+                totals = None
+        if totals is None and sharded:
+            totals = _run_sharded(patient_file, date, end_date, chunk_rows, workers, n_rows,
+                                  tmp_path, rollups, progress, model.get('version'), manifest, cube)
+        elif totals is None:
+            with open(tmp_path, 'wb') as out:
+                totals = analyze_rows(patient_file, weather_df, zip_index, chunk_rows, out, rollups,
+                                      progress=progress, model=model, manifest=manifest, cube=cube)
+
+        if totals["records"] == 0:
+            raise AnalysisError(400, "All rows dropped after filtering: missing values in required columns or no ZIP matches for chosen date")
+        os.replace(tmp_path, output_path)
+        committed = True
+        # Written after the output, so a cube older than its output is known to be stale
+        try:
+            with stage("cube_save"):
+                cube.save(cube_path(output_path))
+        except OSError as e:
+            log_event("analysis_cube_failed", level="warning", file=output_filename, error=str(e))
+        if manifest is not None:
+            try:
+                manifest.save(output_path, manifest_meta, fingerprints)
+            except OSError as e:
+                log_event("incremental_manifest_failed", level="warning", file=output_filename, error=str(e))
+    finally:
+        if rollups is not None:
+            rollups.close(committed)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    records = totals["records"]
+    processing_time = time.time() - start_time
+    log_event("analysis_completed", sample_rate=1.0, date=label, file=output_filename, rows_read=totals["rows_read"],
+              records=records, seconds=round(processing_time, 3),
+              rows_per_sec=round(totals["rows_read"] / processing_time, 1) if processing_time else None)
+
+    summary = {
+        "message": "Risk analysis completed",
+        "output_file": output_filename,
+        "records_processed": records,
+        "weather_matches": records,
+        "average_risk": totals["risk_sum"] / totals["risk_count"] if totals["risk_count"] else None,
+        "model_version": model.get('version'),
+        "incremental": {
+            "reused_rows": totals["reused_rows"],
+            "rescored_rows": totals["rescored_rows"],
+            "changed_zips": totals["changed_zips"],
+        } if "reused_rows" in totals else None,
+        "cube_file": os.path.basename(cube_path(output_path)),
+    }
+    if rollups is not None:
+        summary.update({
+            "start_date": str(date),
+            "end_date": str(end_date),
+            "days": int(n_dates),
+            "members": rollups.rows,
+            "rollup_file": os.path.basename(rollups.path),
+        })
+    return summary
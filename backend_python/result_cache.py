@@ -0,0 +1,215 @@
+"""
+Content-addressed cache of completed risk analyses.
+
+An analysis is keyed by the hashes of everything it reads: the patient
+upload, the weather rows for the date, the AQI lift table and the model
+pickle (plus the output name). A hit returns the summary of the ANALYSIS
+file already on disk. The index lives in uploads/.analysis_cache.json and is
+bounded by entry count and total output size, evicting least recently used
+entries (their ANALYSIS files and the rollup, cube, row index and
+incremental manifest files kept alongside) first.
+
+Every process using the same uploads directory (serve.py workers) shares the
+index: lookups and stores hold an exclusive lock on
+uploads/.analysis_cache.lock and re-read the index when another process has
+rewritten it, so hits, stores and the bounds are global. Without fcntl
+(Windows) the lock only covers this process.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows; the index is then only safe within one process
+    fcntl = None
+
+import utils
+from incremental import manifest_path
+from model_registry import ModelVersionError, get_registry
+from telemetry import cache_lookup
+from pipeline import UPLOADS_DIR, AnalysisError, analysis_label, resolve_patient_file
+from row_index import row_index_path
+from weather_store import get_weather_store
+
+MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "64"))
+MAX_BYTES = int(os.environ.get("ANALYSIS_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+INDEX_FILENAME = ".analysis_cache.json"
+LOCK_FILENAME = ".analysis_cache.lock"
+
+
+class AnalysisCache:
+    """LRU, size-bounded index of ANALYSIS outputs keyed by input content hash."""
+
+    def __init__(self, uploads_dir: str = UPLOADS_DIR, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.uploads_dir = uploads_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(uploads_dir, INDEX_FILENAME)
+        self.lock_path = os.path.join(uploads_dir, LOCK_FILENAME)
+        self._lock = threading.Lock()
+        self._entries = {}
+        # (inode, size, mtime) of the index file as last read or written here
+        self._index_seen = None
+        # Lookup and eviction counters are this process's own
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _index_signature(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _write_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.index_path)
+        self._index_seen = self._index_signature()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the index lock (across processes where fcntl exists) with the entries up to date."""
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another worker may have written the index since this one last saw it
+            signature = self._index_signature()
+            if signature != self._index_seen:
+                self._entries = self._read_index()
+                self._index_seen = signature
+            yield
+
+    def key_for(self, date: str, filename: str | None, end_date: str | None = None,
+                model_version: str | None = None) -> str:
+        """
+        Content hash identifying an analysis of (patient file, date or date range)
+        scored with model_version (the active model when None).
+
+        Hashing a large upload is slow the first time (results are memoized by
+        file size and mtime), so call this off the event loop.
+        """
+        base_filename, patient_file = resolve_patient_file(filename, self.uploads_dir)
+        try:
+            weather_digest = get_weather_store().digest(date, end_date)
+        except FileNotFoundError as e:
+            raise AnalysisError(404, str(e))
+        if utils.model_data is None:
+            utils.load_model()
+        try:
+            model = get_registry().get(model_version)
+        except ModelVersionError as e:
+            raise AnalysisError(e.status_code, e.detail)
+
+        parts = [
+            f"ANALYSIS_{analysis_label(date, end_date)}_{os.path.basename(base_filename)}",
+            utils.file_digest(patient_file),
+            weather_digest,
+            utils.file_digest(utils.load_lift_table()['path']),
+            model['model_hash'],
+            # Outputs record the version name, so identical pickles under two names differ
+            model['version'],
+        ]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def _output_signature(self, output_file: str):
+        try:
+            stat = os.stat(os.path.join(self.uploads_dir, output_file))
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def lookup(self, key: str):
+        """Return the cached summary for key, or None on a miss."""
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is not None and self._output_signature(entry["output_file"]) != entry["signature"]:
+                # Output was overwritten or removed since it was cached
+                del self._entries[key]
+                entry = None
+
+            cache_lookup("analysis", entry is not None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry["last_access"] = time.time()
+            self._write_index()
+            return entry["summary"]
+
+    def store(self, key: str, summary: dict):
+        """Record a completed analysis, then evict down to the size/entry bounds."""
+        output_file = summary["output_file"]
+        signature = self._output_signature(output_file)
+        if signature is None:
+            return
+
+        with self._locked():
+            # Older entries for the same output name no longer describe the file on disk
+            for stale_key in [k for k, e in self._entries.items() if e["output_file"] == output_file]:
+                del self._entries[stale_key]
+            self._entries[key] = {
+                "output_file": output_file,
+                "signature": signature,
+                "summary": summary,
+                "last_access": time.time(),
+            }
+            self._evict(keep=key)
+            self._write_index()
+
+    def _evict(self, keep: str):
+        total_bytes = sum(e["signature"][0] for e in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_access"]):
+            if len(self._entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+
+            del self._entries[key]
+            total_bytes -= entry["signature"][0]
+            self.evictions += 1
+            if self._output_signature(entry["output_file"]) == entry["signature"]:
+                self._remove_output(entry)
+
+    def _remove_output(self, entry: dict):
+        """Delete an evicted ANALYSIS file and the files kept alongside it."""
+        output_path = os.path.join(self.uploads_dir, entry["output_file"])
+        side_paths = [
+            os.path.join(self.uploads_dir, side_file)
+            for side_file in (entry["summary"].get("rollup_file"), entry["summary"].get("cube_file"))
+            if side_file
+        ]
+        side_paths += [row_index_path(output_path), manifest_path(output_path)]
+        os.remove(output_path)
+        for path in side_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._locked():
+            entries = len(self._entries)
+            total_bytes = sum(e["signature"][0] for e in self._entries.values())
+        return {
+            "entries": entries,
+            "bytes": total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
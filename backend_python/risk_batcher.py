@@ -0,0 +1,109 @@
+"""
+Micro-batching for concurrent single-patient /api/compute_risk calls.
+
+With RISK_MICRO_BATCH on, each call queues its (age, aqi, flags) row and
+waits on a future. The queue is scored in one predict_risk_percentages call
+once it holds RISK_BATCH_MAX_ROWS rows, or RISK_BATCH_MAX_WAIT_MS after its
+first row arrived, whichever comes first; each caller then gets its own
+row's result. Batches are scored on the event loop (a few hundred rows take
+microseconds), so there is no thread hand-off per call.
+
+Results are identical to predict_risk_percentage: both go through the same
+vectorized scorer, one row or many. A batch is scored with the model version
+active when it is flushed; calls pinning a version are scored directly.
+"""
+import asyncio
+import os
+
+import numpy as np
+
+import utils
+from model_registry import get_registry
+from telemetry import histogram, stage
+
+RISK_MICRO_BATCH = os.environ.get("RISK_MICRO_BATCH", "0").lower() in ("1", "true", "yes")
+RISK_BATCH_MAX_ROWS = int(os.environ.get("RISK_BATCH_MAX_ROWS", "256"))
+# Longest a call waits for others to join its batch; 0 still coalesces calls queued in the same loop pass
+RISK_BATCH_MAX_WAIT_MS = float(os.environ.get("RISK_BATCH_MAX_WAIT_MS", "2"))
+
+BATCH_SIZE = histogram("risk_micro_batch_size", "Rows per micro-batch of /api/compute_risk calls",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+
+
+class RiskBatcher:
+    """Coalesces concurrent single-row risk calls into vectorized batches."""
+
+    def __init__(self, max_rows: int = RISK_BATCH_MAX_ROWS, max_wait_ms: float = RISK_BATCH_MAX_WAIT_MS):
+        self.max_rows = max(1, max_rows)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._rows = []
+        self._futures = []
+        self._timer = None
+
+    async def score(self, age, aqi, diabetes, hypertension, heart_disease) -> tuple:
+        """Queue one row and wait for its (risk percentage, model version)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._rows.append((age, aqi, diabetes, hypertension, heart_disease))
+        self._futures.append(future)
+        if len(self._rows) >= self.max_rows:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        """Score every queued row now and resolve the callers' futures."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        rows, futures = self._rows, self._futures
+        self._rows, self._futures = [], []
+        if not rows:
+            return
+
+        model = utils.model_data
+        try:
+            with stage("micro_batch_scoring", rows=len(rows)):
+                risk = utils.predict_risk_percentages(np.array(rows, dtype=np.float64), model)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        BATCH_SIZE.observe(len(rows))
+        # Callers that went away (client disconnects) have cancelled futures
+        version = model.get('version')
+        for future, value in zip(futures, risk.tolist()):
+            if not future.done():
+                future.set_result((value, version))
+
+
+_batcher = None
+
+
+def get_batcher() -> RiskBatcher:
+    """The process-wide batcher, created on first use."""
+    global _batcher
+    if _batcher is None:
+        _batcher = RiskBatcher()
+    return _batcher
+
+
+async def score_risk(age, aqi, diabetes, hypertension, heart_disease, model_version: str | None = None) -> tuple:
+    """
+    Risk percentage for one patient, micro-batched with concurrent calls when
+    RISK_MICRO_BATCH is on (and no version is pinned) and scored directly otherwise.
+
+    Returns:
+    - (risk percentage, model version) tuple
+
+    Raises:
+    - ModelVersionError for an unknown pinned version, or when no model is loaded
+    """
+    if RISK_MICRO_BATCH and model_version is None and utils.model_data is not None:
+        return await get_batcher().score(age, aqi, diabetes, hypertension, heart_disease)
+    model = get_registry().get(model_version)
+    risk = utils.predict_risk_percentage(age, aqi, diabetes, hypertension, heart_disease, model=model)
+    return risk, model.get('version')
@@ -0,0 +1,252 @@
+"""
+Row-offset index for paging through CSV files.
+
+The byte offset of every ROW_INDEX_STRIDE-th data row is recorded in one
+pass over the file and saved to uploads/.row_index/<filename>.npz, tagged
+with the file's size and mtime. Seeking to any row is then a file seek plus
+at most ROW_INDEX_STRIDE - 1 skipped rows, independent of the page number.
+Rows are counted the way pandas.read_csv parses them: a newline inside a
+quoted field does not end a row, and whitespace-only lines are not rows
+(both turn up in user uploads).
+"""
+import io
+import os
+import threading
+from itertools import islice
+
+import numpy as np
+
+from telemetry import cache_lookup
+
+ROW_INDEX_DIRNAME = ".row_index"
+ROW_INDEX_STRIDE = 256
+# Bumped when saved indexes must be rebuilt (2: rows are CSV records, not lines)
+ROW_INDEX_VERSION = 2
+SCAN_BLOCK_BYTES = 8 * 1024 * 1024
+# Bytes pandas.read_csv treats as blank when a line holds nothing else
+WHITESPACE = b' \t\r\n'
+STREAM_BLOCK_BYTES = 1024 * 1024
+
+
+class RowIndex:
+    """Header bytes, row count and sampled row start offsets for one file version."""
+
+    def __init__(self, file_path: str, header: bytes, offsets: np.ndarray, total_rows: int, stride: int):
+        self.file_path = file_path
+        self.header = header
+        self.offsets = offsets
+        self.total_rows = total_rows
+        self.stride = stride
+
+    def _records(self, f, row: int):
+        """(start offset, raw record) pairs from data row `row` on; f is positioned as needed."""
+        block, skip = divmod(row, self.stride)
+        start = int(self.offsets[block])
+        f.seek(start)
+        return islice(_iter_records(f, start), skip, None)
+
+    def read_rows(self, offset: int, limit: int) -> list:
+        """Raw CSV records of rows [offset, offset + limit), each ending in a newline."""
+        if offset >= self.total_rows or limit <= 0:
+            return []
+        with open(self.file_path, 'rb') as f:
+            lines = [record for _, record in islice(self._records(f, offset), limit)]
+        if lines and not lines[-1].endswith(b'\n'):
+            lines[-1] += b'\n'
+        return lines
+
+    def sample_rows(self, count: int, seed: int = 0) -> list:
+        """
+        Raw CSV records of a seeded simple random sample of count rows (every
+        row when there are no more than count), in file order.
+
+        Each block of stride rows holding a sampled row is read once.
+        """
+        if count >= self.total_rows:
+            return self.read_rows(0, self.total_rows)
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(self.total_rows, count, replace=False))
+        blocks, rank = np.unique(rows // self.stride, return_inverse=True)
+        with open(self.file_path, 'rb') as f:
+            ends = np.append(self.offsets[1:], f.seek(0, os.SEEK_END))
+            parts = []
+            for block in blocks.tolist():
+                f.seek(int(self.offsets[block]))
+                parts.append(f.read(int(ends[block] - self.offsets[block])))
+        data = b''.join(parts)
+        # Every block but the last holds exactly stride records, so rows map straight onto data's records
+        starts = np.append(_scan_records(io.BytesIO(data), 0), len(data))
+        picks = rank * self.stride + rows % self.stride
+        lines = [data[starts[i]:starts[i + 1]] for i in picks.tolist()]
+        return [line if line.endswith(b'\n') else line + b'\n' for line in lines]
+
+    def row_offset(self, row: int) -> int:
+        """Byte offset at which data row `row` starts (the file size from total_rows on)."""
+        with open(self.file_path, 'rb') as f:
+            if row < self.total_rows:
+                return next(self._records(f, row))[0]
+            return f.seek(0, os.SEEK_END)
+
+
+def _iter_records(lines, position: int):
+    """
+    (start offset, raw record) for each CSV record in lines, which start at
+    byte offset position: lines are joined while a quoted field is open and
+    whitespace-only records are skipped.
+    """
+    record = b''
+    start = position
+    for line in lines:
+        record += line
+        position += len(line)
+        if record.count(b'"') % 2:
+            continue
+        if record.strip(WHITESPACE):
+            yield start, record
+        record = b''
+        start = position
+    if record.strip(WHITESPACE):
+        yield start, record
+
+
+def row_index_path(file_path: str) -> str:
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, ROW_INDEX_DIRNAME, f"{name}.npz")
+
+
+def _source_signature(file_path: str) -> np.ndarray:
+    stat = os.stat(file_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _scan_records(f, position: int) -> np.ndarray:
+    """
+    Start offsets of the CSV records in f, read from byte offset position on.
+
+    A newline ends a record only when an even number of quotes precede it,
+    and records holding nothing but whitespace are dropped, so the starts
+    line up with the rows pandas.read_csv parses.
+    """
+    starts = []
+    quoted = 0
+    # The record still open at the end of the previous block, and whether it has any content yet
+    open_start = position
+    open_filled = False
+    while True:
+        block = f.read(SCAN_BLOCK_BYTES)
+        if not block:
+            break
+        data = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord('\n'))
+        quotes = data == ord('"')
+        if quoted or quotes.any():
+            # uint8 wraps at 256, which keeps the parity
+            parity = (np.cumsum(quotes, dtype=np.uint8) + quoted) & 1
+            ends = ends[parity[ends] == 0]
+            quoted = int(parity[-1])
+        filled = np.ones(len(data), dtype=bool)
+        for code in WHITESPACE:
+            filled &= data != code
+        if len(ends):
+            # filled.any() over each record ending in this block (reduceat runs the last one to the block end)
+            bounds = np.concatenate(([0], ends + 1))
+            nonblank = np.logical_or.reduceat(filled, bounds[:-1])
+            nonblank[-1] = filled[bounds[-2]:bounds[-1]].any()
+            nonblank[0] |= open_filled
+            record_starts = np.concatenate(([open_start], bounds[1:-1] + position))
+            starts.append(record_starts[nonblank])
+            open_start = int(ends[-1]) + 1 + position
+            open_filled = bool(filled[ends[-1] + 1:].any())
+        else:
+            open_filled = open_filled or bool(filled.any())
+        position += len(block)
+    # A last record without a trailing newline
+    if open_filled:
+        starts.append(np.array([open_start], dtype=np.int64))
+    return np.concatenate(starts).astype(np.int64) if starts else np.zeros(0, dtype=np.int64)
+
+
+def build_row_index(file_path: str, stride: int = ROW_INDEX_STRIDE) -> RowIndex:
+    """Scan the file once for record starts and keep every stride-th one."""
+    source = _source_signature(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        starts = _scan_records(f, len(header))
+
+    total_rows = len(starts)
+    offsets = starts[::stride] if total_rows else np.array([len(header)], dtype=np.int64)
+
+    target = row_index_path(file_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp.npz"
+    np.savez(tmp_path, offsets=offsets, source=source, header=np.frombuffer(header, dtype=np.uint8),
+             meta=np.array([total_rows, stride, ROW_INDEX_VERSION], dtype=np.int64))
+    os.replace(tmp_path, target)
+    return RowIndex(file_path, header, offsets, total_rows, stride)
+
+
+def _load_row_index(file_path: str):
+    try:
+        with np.load(row_index_path(file_path)) as saved:
+            if not np.array_equal(saved['source'], _source_signature(file_path)):
+                return None
+            total_rows, stride, version = (int(v) for v in saved['meta'])
+            if version != ROW_INDEX_VERSION:
+                return None
+            return RowIndex(file_path, saved['header'].tobytes(), saved['offsets'], total_rows, stride)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_row_index(file_path: str) -> RowIndex:
+    """Row index for the current version of file_path, built on first use."""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        index = _indexes.get(key)
+        cache_lookup("row_index", index is not None)
+        if index is None:
+            index = _load_row_index(file_path) or build_row_index(file_path)
+            # One entry per path: older versions of the file are dropped
+            for stale in [k for k in _indexes if k[0] == key[0]]:
+                del _indexes[stale]
+            _indexes[key] = index
+    return index
+
+
+def read_page(file_path: str, offset: int, limit: int) -> dict:
+    """
+    One page of a CSV file as CSV text (header included).
+
+    Parameters:
+    - file_path: CSV path
+    - offset: first data row (0-based)
+    - limit: maximum number of rows
+
+    Returns:
+    - dict with data, offset, limit, total_rows and next_offset (None on the last page)
+    """
+    index = get_row_index(file_path)
+    lines = index.read_rows(offset, limit)
+    next_offset = offset + len(lines)
+    return {
+        "data": (index.header + b''.join(lines)).decode('utf-8'),
+        "offset": offset,
+        "limit": limit,
+        "total_rows": index.total_rows,
+        "next_offset": next_offset if next_offset < index.total_rows else None,
+    }
+
+
+def iter_file(file_path: str, block_bytes: int = STREAM_BLOCK_BYTES):
+    """Yield the file in fixed-size blocks for a streaming download."""
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            yield block
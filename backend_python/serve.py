@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Production launcher: one preloaded master, N forked uvicorn workers.
+
+run.py (and `uvicorn --workers`) start every worker from scratch, so each one
+unpickles the model and parses weather_data.csv itself. Here the master binds
+the socket, imports main (which loads the model) and preloads the weather
+store and the lift table, then forks the workers. The workers share those
+pages copy-on-write; gc.freeze() keeps the collector from writing to the
+preloaded objects and unsharing them. The risk table is memory-mapped, so the
+job workers (spawned per web worker) share it too.
+
+Each worker keeps its own job registry, job pool (JOB_WORKERS processes) and
+metrics. GET/DELETE /api/jobs/{job_id} must therefore reach the worker that
+queued the job; with several workers use POST /api/compute_risk_with_weather,
+which waits for its result. Completed analyses are cached on disk, and every
+worker sees the others' results: the cache index in uploads/ is re-read and
+rewritten under a cross-process file lock (see result_cache). Coalescing of
+identical in-flight analyses is per worker, though, so two workers can still
+run the same analysis at the same time.
+
+Usage (from backend_python/):
+    python serve.py --workers 4
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import uvicorn
+
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", str(os.cpu_count() or 1)))
+# A worker that dies sooner than this after starting is not restarted (it would crash-loop)
+MIN_WORKER_UPTIME_SECONDS = 5.0
+# How often a worker checks that its master is still alive
+PARENT_CHECK_SECONDS = 1.0
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket created once in the master and inherited by every worker."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload():
+    """
+    Load everything the workers only read: the model (on importing main), the
+    weather store and the lift table.
+
+    Returns:
+    - the FastAPI app
+    """
+    import main
+    import utils
+    from weather_store import get_weather_store
+
+    start = time.perf_counter()
+    try:
+        get_weather_store().dates()
+    except FileNotFoundError as e:
+        print(f"⚠️ Weather data not preloaded: {e}")
+    try:
+        utils.load_lift_table()
+    except (FileNotFoundError, ValueError) as e:
+        print(f"⚠️ Lift table not preloaded: {e}")
+    print(f"✅ Preload finished in {time.perf_counter() - start:.2f}s")
+    return main.app
+
+
+def watch_parent(master_pid: int):
+    """Shut this worker down (gracefully, via SIGTERM) if the master dies without stopping it."""
+    while os.getppid() == master_pid:
+        time.sleep(PARENT_CHECK_SECONDS)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def run_worker(app, sock: socket.socket, log_level: str, master_pid: int):
+    """Serve app on the inherited socket until the master signals shutdown."""
+    threading.Thread(target=watch_parent, args=(master_pid,), daemon=True).start()
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(app, sock: socket.socket, log_level: str) -> int:
+    master_pid = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            run_worker(app, sock, log_level, master_pid)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(host: str = "0.0.0.0", port: int = 2003, workers: int = WEB_WORKERS, log_level: str = "info"):
+    """Preload, fork workers and supervise them (restarting any that die) until SIGINT/SIGTERM."""
+    sock = bind_socket(host, port)
+    app = preload()
+    # Everything allocated so far is shared with the workers; keep the GC off it
+    gc.collect()
+    gc.freeze()
+
+    started = {}
+    for _ in range(max(1, workers)):
+        started[spawn_worker(app, sock, log_level)] = time.monotonic()
+    print(f"🚀 Serving on http://{host}:{port} with {len(started)} workers (pids {', '.join(map(str, started))})")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(started):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while started:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        began = started.pop(pid, None)
+        if began is None or stopping:
+            continue
+        uptime = time.monotonic() - began
+        print(f"⚠️ Worker {pid} exited (status {os.waitstatus_to_exitcode(status)}) after {uptime:.1f}s",
+              file=sys.stderr)
+        if uptime >= MIN_WORKER_UPTIME_SECONDS:
+            started[spawn_worker(app, sock, log_level)] = time.monotonic()
+    sock.close()
+    print("👋 All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=2003)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Single-pass data summaries for uploaded rosters.
+
+The summary (record count, average age, % female, condition and payer
+percentages) is accumulated in one streaming pass over just the columns it
+needs, then persisted to uploads/.summary/<sha256>.json so repeat requests
+are a file read. In approximate mode the exact pass runs in the background
+and callers get an estimate from a seeded random sample of rows (drawn
+through the row offset index, see RowIndex.sample_rows) with 95% error
+bounds. Rosters are usually grouped by ZIP or payer, so the file's first
+rows would not do as a sample.
+"""
+import io
+import json
+import math
+import os
+import threading
+
+import pandas as pd
+
+from columnar import column_names, iter_chunks
+from row_index import get_row_index
+from telemetry import cache_lookup
+from utils import file_digest
+
+SUMMARY_DIRNAME = ".summary"
+SUMMARY_CHUNK_ROWS = 500_000
+ESTIMATE_SAMPLE_ROWS = 10_000
+# Fixed so repeated estimates of a file agree
+ESTIMATE_SEED = 0
+
+# z-score for the 95% error bounds reported in approximate mode
+Z_95 = 1.96
+
+CONDITIONS = ['diabetes', 'hypertension', 'chronic_kidney', 'liver_disease', 'copd', 'heart_disease']
+AGE_COLUMNS = ['Age', 'age', 'AGE']
+GENDER_COLUMNS = ['gender', 'Gender', 'GENDER']
+PAYER_COLUMNS = ['Payer', 'payer', 'PAYER']
+
+
+def _first_present(candidates, columns):
+    for col in candidates:
+        if col in columns:
+            return col
+    return None
+
+
+class SummaryAccumulator:
+    """Running counts for the data summary, updated one chunk at a time."""
+
+    def __init__(self, columns: list):
+        self.age_col = _first_present(AGE_COLUMNS, columns)
+        self.gender_col = _first_present(GENDER_COLUMNS, columns)
+        self.payer_col = _first_present(PAYER_COLUMNS, columns)
+        self.condition_cols = {}
+        for condition in CONDITIONS:
+            for col in columns:
+                if col.lower().replace(' ', '_') == condition:
+                    self.condition_cols[condition] = col
+                    break
+
+        self.rows = 0
+        self.age_count = 0
+        self.age_sum = 0.0
+        self.age_sq_sum = 0.0
+        self.female = 0
+        self.condition_counts = {condition: 0 for condition in self.condition_cols}
+        self.payer_counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self) -> list:
+        cols = [self.age_col, self.gender_col, self.payer_col, *self.condition_cols.values()]
+        return [c for c in dict.fromkeys(cols) if c is not None]
+
+    def update(self, chunk: pd.DataFrame):
+        age = pd.to_numeric(chunk[self.age_col], errors='coerce').dropna() if self.age_col else None
+        female = 0
+        if self.gender_col:
+            gender = chunk[self.gender_col]
+            if pd.api.types.is_numeric_dtype(gender):  # Numeric values like 0, 1
+                female = int((gender == 0).sum())
+            else:  # String values like 'F', 'M'
+                female = int((gender == 'F').sum())
+        conditions = {condition: int((chunk[col] == 1).sum()) for condition, col in self.condition_cols.items()}
+        payers = chunk[self.payer_col].value_counts() if self.payer_col else {}
+
+        with self._lock:
+            self.rows += len(chunk)
+            if age is not None:
+                self.age_count += len(age)
+                self.age_sum += float(age.sum())
+                self.age_sq_sum += float((age.astype(float) ** 2).sum())
+            self.female += female
+            for condition, count in conditions.items():
+                self.condition_counts[condition] += count
+            for payer, count in payers.items():
+                self.payer_counts[payer] = self.payer_counts.get(payer, 0) + int(count)
+
+    def result(self, approximate: bool = False, total_rows: int | None = None) -> dict:
+        """
+        Summary in the /api/data-summary response format.
+
+        With approximate=True the counts are treated as a simple random sample
+        of total_rows (finite-population corrected when known) and 95% error
+        bounds are added.
+        """
+        with self._lock:
+            n = self.rows
+            avg_age = self.age_sum / self.age_count if self.age_count else None
+            pct_female = self.female / n * 100 if self.gender_col and n else None
+            condition_stats = {k: v / n * 100 for k, v in self.condition_counts.items()} if n else {}
+            payer_stats = {k: v / n * 100 for k, v in self.payer_counts.items()} if n else {}
+
+            summary = {
+                "total_records": n,
+                "average_age": round(avg_age, 1) if avg_age else None,
+                "percent_female": round(pct_female, 1) if pct_female else None,
+                "condition_percentages": {k: round(v, 1) for k, v in condition_stats.items()},
+                "payer_distribution": {k: round(v, 1) for k, v in payer_stats.items()}
+            }
+            if not approximate:
+                return summary
+
+            fpc = 1.0
+            if total_rows and total_rows > 1 and n:
+                fpc = math.sqrt(max(total_rows - n, 0) / (total_rows - 1))
+
+            def pct_bound(pct):
+                p = pct / 100
+                return round(Z_95 * math.sqrt(p * (1 - p) / n) * fpc * 100, 2) if n else None
+
+            age_bound = None
+            if self.age_count > 1:
+                variance = max(self.age_sq_sum / self.age_count - avg_age ** 2, 0.0) * self.age_count / (self.age_count - 1)
+                age_bound = round(Z_95 * math.sqrt(variance / self.age_count) * fpc, 2)
+
+            summary["total_records"] = total_rows
+            summary.update({
+                "approximate": True,
+                "rows_scanned": n,
+                "error_bounds": {
+                    "average_age": age_bound,
+                    "percent_female": pct_bound(pct_female) if pct_female is not None else None,
+                    "condition_percentages": {k: pct_bound(v) for k, v in condition_stats.items()},
+                    "payer_distribution": {k: pct_bound(v) for k, v in payer_stats.items()},
+                },
+            })
+            return summary
+
+
+_summaries = {}
+_running = {}
+# digest -> approximate summary, kept while the exact pass runs
+_estimates = {}
+_lock = threading.Lock()
+
+
+def _sidecar_path(file_path: str, digest: str) -> str:
+    return os.path.join(os.path.dirname(file_path), SUMMARY_DIRNAME, f"{digest}.json")
+
+
+def _load_summary(file_path: str, digest: str):
+    summary = _summaries.get(digest)
+    if summary is None:
+        try:
+            with open(_sidecar_path(file_path, digest), 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+            _summaries[digest] = summary
+        except (OSError, ValueError):
+            return None
+    return summary
+
+
+def _exact_pass(file_path: str, digest: str, accumulator: SummaryAccumulator) -> dict:
+    """Run the streaming pass, persist the sidecar and publish the result."""
+    try:
+        columns = accumulator.columns or column_names(file_path)[:1]
+        for chunk in iter_chunks(file_path, SUMMARY_CHUNK_ROWS, columns=columns):
+            accumulator.update(chunk)
+        summary = accumulator.result()
+
+        sidecar = _sidecar_path(file_path, digest)
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        tmp_path = f"{sidecar}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, sidecar)
+        _summaries[digest] = summary
+        return summary
+    finally:
+        with _lock:
+            _running.pop(digest, None)
+            _estimates.pop(digest, None)
+
+
+def _estimate(file_path: str) -> dict:
+    """Approximate summary from a seeded random sample of ESTIMATE_SAMPLE_ROWS rows."""
+    index = get_row_index(file_path)
+    accumulator = SummaryAccumulator(column_names(file_path))
+    records = index.sample_rows(ESTIMATE_SAMPLE_ROWS, ESTIMATE_SEED)
+    sample = pd.read_csv(io.BytesIO(index.header + b''.join(records)), usecols=accumulator.columns or None)
+    accumulator.update(sample)
+    return accumulator.result(approximate=True, total_rows=index.total_rows)
+
+
+def get_summary(file_path: str, approximate: bool = False) -> dict:
+    """
+    Data summary for an uploaded file, computed once per file content.
+
+    Parameters:
+    - file_path: CSV path under uploads/
+    - approximate: if the exact summary is not ready yet, start it in the
+      background and return an estimate from a random sample, with error bounds
+
+    Returns:
+    - summary dict (see SummaryAccumulator.result)
+    """
+    digest = file_digest(file_path)
+    summary = _load_summary(file_path, digest)
+    cache_lookup("summary", summary is not None)
+    if summary is not None:
+        return summary
+
+    with _lock:
+        running = _running.get(digest)
+        if running is None:
+            accumulator = SummaryAccumulator(column_names(file_path))
+            thread = None
+            if approximate:
+                thread = threading.Thread(target=_exact_pass, args=(file_path, digest, accumulator), daemon=True)
+                _running[digest] = (thread, accumulator)
+                thread.start()
+        else:
+            thread, accumulator = running
+
+    if not approximate:
+        if thread is None:
+            return _exact_pass(file_path, digest, accumulator)
+        thread.join()
+        return _load_summary(file_path, digest) or accumulator.result()
+
+    estimate = _estimates.get(digest)
+    if estimate is None:
+        # Not the rows the exact pass has reached: those are the head of the file, not a sample
+        estimate = _estimate(file_path)
+        with _lock:
+            if digest in _running:
+                _estimates[digest] = estimate
+    return estimate
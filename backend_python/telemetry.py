@@ -0,0 +1,333 @@
+"""
+In-process metrics, stage spans and sampled structured logging.
+
+Hot paths wrap their stages in stage(name), which records the duration, rows
+and bytes into this process's registry and, while a profile is active (see
+profile()), into that request's stage breakdown. render() formats the
+registry in the Prometheus text exposition format for /metrics.
+
+Analysis jobs run in worker processes, so a worker collects its stage totals
+with profile() and returns them to the server, which folds them in with
+merge_stages().
+
+log_event() writes one JSON line per event. Info events are sampled at
+LOG_SAMPLE_RATE so per-request and per-chunk logging stays cheap; warnings
+and errors are always written.
+"""
+import bisect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Fraction of info-level log events written (warnings and errors are never sampled)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, key, value) for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down (set replaces it)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label key -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value: float, count: int = 1, **labels):
+        """Record value (count times, for pre-aggregated observations)."""
+        key = _label_key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if slot < len(self.buckets):
+                state[slot] += count
+            state[-2] += value * count
+            state[-1] += count
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), state[-1]))
+            samples.append((f"{self.name}_sum", key, state[-2]))
+            samples.append((f"{self.name}_count", key, state[-1]))
+        return samples
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+_collectors = []
+
+
+def _register(cls, name: str, help_text: str, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help_text, **kwargs)
+        return metric
+
+
+def counter(name: str, help_text: str) -> Counter:
+    """Get or create a counter in the process registry."""
+    return _register(Counter, name, help_text)
+
+
+def gauge(name: str, help_text: str) -> Gauge:
+    """Get or create a gauge in the process registry."""
+    return _register(Gauge, name, help_text)
+
+
+def histogram(name: str, help_text: str, buckets=LATENCY_BUCKETS) -> Histogram:
+    """Get or create a histogram in the process registry."""
+    return _register(Histogram, name, help_text, buckets=buckets)
+
+
+def register_collector(collect):
+    """Register a callable run before every render() (e.g. to refresh gauges from cache stats)."""
+    _collectors.append(collect)
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    for collect in list(_collectors):
+        try:
+            collect()
+        except Exception as e:
+            log_event("metrics_collector_failed", level="warning", error=str(e))
+
+    lines = []
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# -- Cache lookups -------------------------------------------------------------
+
+CACHE_LOOKUPS = counter("cache_lookups_total", "Cache lookups by cache and result (hit or miss)")
+CACHE_HIT_RATIO = gauge("cache_hit_ratio", "Hits over lookups for each cache since start")
+
+
+def cache_lookup(cache: str, hit: bool, count: int = 1):
+    """Count lookups against a named cache."""
+    if count:
+        CACHE_LOOKUPS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+
+def _collect_hit_ratios():
+    lookups = {}
+    for _, key, value in CACHE_LOOKUPS.samples():
+        labels = dict(key)
+        hits, total = lookups.get(labels["cache"], (0, 0))
+        lookups[labels["cache"]] = (hits + (value if labels["result"] == "hit" else 0), total + value)
+    for cache, (hits, total) in lookups.items():
+        CACHE_HIT_RATIO.set(round(hits / total, 4) if total else 0, cache=cache)
+
+
+register_collector(_collect_hit_ratios)
+
+
+# -- Stage spans ---------------------------------------------------------------
+
+STAGE_SECONDS = histogram("risk_stage_seconds", "Time spent in each risk pipeline stage per call")
+STAGE_ROWS = counter("risk_stage_rows_total", "Rows handled by each risk pipeline stage")
+STAGE_BYTES = counter("risk_stage_bytes_total", "Bytes handled by each risk pipeline stage")
+
+
+class Profile:
+    """Per-request stage breakdown: name -> seconds, calls, rows and bytes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, name: str, seconds: float, calls: int = 1, rows: int = 0, nbytes: int = 0):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = {"seconds": 0.0, "calls": 0, "rows": 0, "bytes": 0}
+            entry["seconds"] += seconds
+            entry["calls"] += calls
+            entry["rows"] += rows
+            entry["bytes"] += nbytes
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {name: dict(entry, seconds=round(entry["seconds"], 6)) for name, entry in self.stages.items()}
+
+    def server_timing(self, total_seconds: float | None = None) -> str:
+        """Stage breakdown as a Server-Timing header value (durations in ms)."""
+        parts = [
+            f'{name};dur={entry["seconds"] * 1000:.2f};desc="rows={entry["rows"]} bytes={entry["bytes"]}"'
+            for name, entry in self.as_dict().items()
+        ]
+        if total_seconds is not None:
+            parts.append(f"total;dur={total_seconds * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current_profile = ContextVar("profile", default=None)
+
+
+class Span:
+    """Rows and bytes for the stage being timed (set them inside the with block)."""
+
+    __slots__ = ("rows", "nbytes")
+
+    def __init__(self, rows: int, nbytes: int):
+        self.rows = rows
+        self.nbytes = nbytes
+
+
+def record_stage(name: str, seconds: float, rows: int = 0, nbytes: int = 0, calls: int = 1):
+    """Record a finished stage into the registry and the active profile."""
+    STAGE_SECONDS.observe(seconds / calls if calls > 1 else seconds, count=calls, stage=name)
+    if rows:
+        STAGE_ROWS.inc(rows, stage=name)
+    if nbytes:
+        STAGE_BYTES.inc(nbytes, stage=name)
+    active = _current_profile.get()
+    if active is not None:
+        active.add(name, seconds, calls, rows, nbytes)
+
+
+@contextmanager
+def stage(name: str, rows: int = 0, nbytes: int = 0):
+    """
+    Time a pipeline stage.
+
+    Usage:
+        with stage("scoring", rows=len(df)):
+            ...
+    The yielded Span's rows/nbytes can be filled in once they are known.
+    """
+    span = Span(rows, nbytes)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        record_stage(name, time.perf_counter() - start, span.rows, span.nbytes)
+
+
+@contextmanager
+def profile():
+    """Collect a stage breakdown for everything run in this context; yields the Profile."""
+    active = Profile()
+    token = _current_profile.set(active)
+    try:
+        yield active
+    finally:
+        _current_profile.reset(token)
+
+
+def merge_stages(stages: dict | None):
+    """Fold a stage breakdown collected in another process into this one (registry and active profile)."""
+    for name, entry in (stages or {}).items():
+        record_stage(name, entry["seconds"], entry["rows"], entry["bytes"], entry["calls"])
+
+
+def add_to_profile(stages: dict | None):
+    """Add an already-recorded stage breakdown to the active profile only (no registry update)."""
+    active = _current_profile.get()
+    if active is not None:
+        for name, entry in (stages or {}).items():
+            active.add(name, entry["seconds"], entry["calls"], entry["rows"], entry["bytes"])
+
+
+# -- Sampled structured logging ------------------------------------------------
+
+LOG_EVENTS = counter("log_events_total", "Structured log events by level and whether they were written")
+
+
+def log_event(event: str, level: str = "info", sample_rate: float | None = None, **fields):
+    """
+    Write one structured (JSON line) log event.
+
+    Info events are written with probability sample_rate (defaults to
+    LOG_SAMPLE_RATE); warnings and errors are always written. Every event is
+    counted in log_events_total, sampled out or not.
+    """
+    rate = 1.0 if level != "info" else (LOG_SAMPLE_RATE if sample_rate is None else sample_rate)
+    if rate < 1.0 and random.random() >= rate:
+        LOG_EVENTS.inc(level=level, written="false")
+        return
+    LOG_EVENTS.inc(level=level, written="true")
+    record = {"ts": round(time.time(), 3), "level": level, "event": event}
+    if rate < 1.0:
+        record["sample_rate"] = rate
+    record.update(fields)
+    stream = sys.stderr if level in ("warning", "error") else sys.stdout
+    print(json.dumps(record, default=str), file=stream)
@@ -0,0 +1,37 @@
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import pytest  # noqa: E402
+import synthetic  # noqa: E402
+
+WEATHER_ZIPS = 200
+WEATHER_DATES = synthetic.weather_dates(3)
+
+# The server modules read these at import time (as in the benchmark suite)
+_workdir = tempfile.mkdtemp(prefix='risk_tests_')
+os.environ['WEATHER_DATA_PATH'] = synthetic.write_weather(
+    os.path.join(_workdir, 'weather_data.csv'), WEATHER_ZIPS, len(WEATHER_DATES)
+)
+os.environ.setdefault('LOG_SAMPLE_RATE', '0')
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def model():
+    """The active model version, loaded once from MODEL_DIR."""
+    import utils
+    from model_registry import get_registry
+
+    assert utils.load_model()
+    return get_registry().get(None)
@@ -0,0 +1,62 @@
+import asyncio
+
+from bulk_scoring import BulkStreamingResponse, _release_once
+
+SCOPE = {"type": "http", "asgi": {"spec_version": "2.3"}}
+
+
+async def receive():
+    await asyncio.sleep(3600)
+
+
+def test_slot_released_when_body_iterator_never_starts():
+    async def run():
+        slot = asyncio.Semaphore(1)
+        await slot.acquire()
+        started = []
+
+        async def body():
+            started.append(True)
+            yield b"never sent"
+
+        async def send(message):
+            raise OSError("client gone")
+
+        body_read = asyncio.Event()
+        body_read.set()
+        response = BulkStreamingResponse(body(), _release_once(slot), body_read)
+        try:
+            await response(SCOPE, receive, send)
+        except Exception:
+            pass
+        return slot, started
+
+    slot, started = asyncio.run(run())
+    assert not started
+    assert not slot.locked()
+
+
+def test_slot_released_once_after_streaming():
+    async def run():
+        slot = asyncio.Semaphore(2)
+        await slot.acquire()
+        release = _release_once(slot)
+        sent = []
+
+        async def body():
+            try:
+                yield b"scores"
+            finally:
+                release()
+
+        async def send(message):
+            sent.append(message)
+
+        body_read = asyncio.Event()
+        body_read.set()
+        await BulkStreamingResponse(body(), release, body_read)(SCOPE, receive, send)
+        return slot, sent
+
+    slot, sent = asyncio.run(run())
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+    assert slot._value == 2
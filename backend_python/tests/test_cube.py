@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import cube
+import pipeline
+import synthetic
+from conftest import WEATHER_DATES, WEATHER_ZIPS
+
+
+def expected_rows(analysis: pd.DataFrame, group_by: list) -> pd.DataFrame:
+    grouped = analysis.groupby(group_by)
+    return pd.DataFrame({
+        'members': grouped.size(),
+        'mean_risk': grouped['risk_percentage'].mean(),
+        'p50': grouped['risk_percentage'].quantile(0.5),
+        'p90': grouped['risk_percentage'].quantile(0.9),
+        'inpatient_cost_increase': grouped['inpatient_cost_increase'].sum(),
+    })
+
+
+def assert_matches_groupby(output_path: str, group_by: list, filters: dict):
+    analysis = pd.read_csv(output_path)
+    for dim, values in filters.items():
+        analysis = analysis[analysis[dim].astype(str).isin(values.split(','))]
+    expected = expected_rows(analysis, group_by)
+
+    result = cube.query_cube(output_path, os.path.basename(output_path), group_by=','.join(group_by),
+                             filters=filters, limit=10_000)
+    actual = pd.DataFrame(result["rows"]).set_index(group_by).loc[expected.index]
+    assert result["groups"] == len(expected)
+    np.testing.assert_array_equal(actual['members'], expected['members'])
+    np.testing.assert_allclose(actual['mean_risk'], expected['mean_risk'], atol=0.005)
+    np.testing.assert_allclose(actual['inpatient_cost_increase'], expected['inpatient_cost_increase'], atol=0.005)
+    # Percentiles come from 0.1-point risk bins
+    for p in ('p50', 'p90'):
+        np.testing.assert_allclose(actual[p], expected[p], atol=1 / cube.RISK_BINS_PER_POINT)
+    assert result["total"]["members"] == len(analysis)
+
+
+def test_cube_matches_groupby_on_the_analysis_file(tmp_path, model):
+    zips = synthetic.zip_codes(WEATHER_ZIPS)
+    roster = synthetic.make_roster(5000, zips, seed=11, dirty_fraction=0.02)
+    roster.to_csv(tmp_path / "roster.csv", index=False)
+    pipeline.run_risk_analysis(WEATHER_DATES[0], "roster.csv", uploads_dir=str(tmp_path), shard_workers=1)
+
+    # Rerun on an edited roster, so part of the cube comes from reused rows
+    edited = pd.concat([roster.iloc[300:], synthetic.make_roster(500, zips, seed=12, first_member_id=5000)])
+    edited.to_csv(tmp_path / "roster.csv", index=False)
+    summary = pipeline.run_risk_analysis(WEATHER_DATES[0], "roster.csv", uploads_dir=str(tmp_path), shard_workers=1)
+    assert summary["incremental"]["reused_rows"] > 0
+    output_path = str(tmp_path / summary["output_file"])
+
+    assert_matches_groupby(output_path, ['LOB', 'aqi_category'], {})
+    assert_matches_groupby(output_path, ['plan_zip', 'diabetes'], {'LOB': 'ADV,MCD', 'heart_disease': '1'})
+
+    # Rebuilt from the output when the saved cube is gone
+    os.remove(cube.cube_path(output_path))
+    assert_matches_groupby(output_path, ['LOB', 'aqi_category'], {})
@@ -0,0 +1,50 @@
+import pandas as pd
+
+import pipeline
+import synthetic
+from conftest import WEATHER_DATES, WEATHER_ZIPS
+
+
+def run(uploads, roster):
+    roster.to_csv(uploads / "roster.csv", index=False)
+    summary = pipeline.run_risk_analysis(WEATHER_DATES[0], "roster.csv", uploads_dir=str(uploads), shard_workers=1)
+    return summary, uploads / summary["output_file"]
+
+
+def test_edited_roster_matches_full_run(tmp_path, monkeypatch, model):
+    roster = synthetic.make_roster(3000, synthetic.zip_codes(WEATHER_ZIPS), seed=7)
+    edited = roster.drop(index=range(100, 150)).copy()
+    edited.loc[500:520, 'Age'] += 1
+    edited = pd.concat([edited, synthetic.make_roster(200, synthetic.zip_codes(WEATHER_ZIPS), seed=8,
+                                                      first_member_id=3000)])
+
+    patched_dir, full_dir = tmp_path / "patched", tmp_path / "full"
+    patched_dir.mkdir()
+    full_dir.mkdir()
+    run(patched_dir, roster)
+    summary, patched = run(patched_dir, edited)
+    assert summary["incremental"]["reused_rows"] > 2500
+
+    monkeypatch.setattr(pipeline, "INCREMENTAL", False)
+    summary, full = run(full_dir, edited)
+    assert summary["incremental"] is None
+    assert patched.read_bytes() == full.read_bytes()
+
+
+def test_rows_are_reused_when_the_head_is_deleted(tmp_path, model):
+    roster = synthetic.make_roster(3000, synthetic.zip_codes(WEATHER_ZIPS), seed=9)
+    # Missing ages at the head make pandas parse the whole Age column as float
+    roster['Age'] = roster['Age'].astype('Int64')
+    roster.loc[:4, 'Age'] = pd.NA
+    run(tmp_path, roster)
+
+    # Re-saved without those rows, Age parses as int
+    summary, patched = run(tmp_path, roster.iloc[20:])
+    assert summary["incremental"]["reused_rows"] == len(roster) - 20
+    assert summary["incremental"]["rescored_rows"] == 0
+
+    expected = pd.read_csv(patched)
+    (tmp_path / ".incremental").rename(tmp_path / ".stale")
+    summary, full = run(tmp_path, roster.iloc[20:])
+    assert summary["incremental"] is None
+    pd.testing.assert_frame_equal(expected, pd.read_csv(full), check_dtype=False)
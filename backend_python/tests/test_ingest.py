@@ -0,0 +1,31 @@
+import ingest
+from pipeline import PATIENT_REQUIRED_COLUMNS
+
+
+def test_get_session_restores_outside_the_sessions_lock(tmp_path, monkeypatch):
+    session = ingest.new_session("roster.csv", str(tmp_path))
+    data = (",".join(PATIENT_REQUIRED_COLUMNS) + "\n").encode()
+    # Appended by another worker: this worker's session is now stale
+    with open(session.partial_path, "ab") as f:
+        f.write(data)
+
+    restore = ingest._restore_session
+    lock_held = []
+
+    def checked_restore(upload_id, uploads_dir):
+        lock_held.append(ingest._sessions_lock.locked())
+        return restore(upload_id, uploads_dir)
+
+    monkeypatch.setattr(ingest, "_restore_session", checked_restore)
+    restored = ingest.get_session(session.id, str(tmp_path))
+    assert lock_held == [False]
+    assert restored is not session and restored.received == len(data)
+    assert ingest.get_session(session.id, str(tmp_path)) is restored
+
+
+def test_validator_splits_rows_only_on_newlines():
+    validator = ingest.CsvValidator()
+    header = ",".join(PATIENT_REQUIRED_COLUMNS + ["note"])
+    validator.feed(f'{header}\r\n10001,40,0,1,0,a\x0cb\r\n10002,50,1,0,0,"c\u2028d"\r\n'.encode())
+    validator.close()
+    assert validator.rows == 2
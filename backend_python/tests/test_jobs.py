@@ -0,0 +1,18 @@
+from jobs import COMPLETED, MAX_FINISHED_JOBS, JobManager
+
+
+class HitCache:
+    """Analysis cache stub where every key hits."""
+
+    def lookup(self, key):
+        return {"output_file": f"ANALYSIS_20170101_{key}.csv"}
+
+
+def test_cache_hits_past_retention_limit_without_pool():
+    manager = JobManager(cache=HitCache())
+    for i in range(MAX_FINISHED_JOBS + 5):
+        job, created = manager.submit("20170101", f"roster_{i}.csv", cache_key=f"key{i}")
+        assert created and job.status == COMPLETED
+
+    assert manager._executor is None
+    assert len(manager.list()) == MAX_FINISHED_JOBS
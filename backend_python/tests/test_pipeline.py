@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+import synthetic
+from bench_zip_join import make_frames
+from weather_store import ZipIndex
+from conftest import WEATHER_DATES, WEATHER_ZIPS
+
+
+def write_messy_roster(path, rows):
+    """A synthetic roster with blank lines and quoted multi-line fields scattered through it."""
+    roster = synthetic.make_roster(rows, synthetic.zip_codes(WEATHER_ZIPS), seed=3)
+    roster['notes'] = np.where(np.arange(rows) % 97 == 0, 'call back\nafter 5pm', 'none')
+    lines = roster.to_csv(index=False).splitlines(keepends=True)
+    rng = np.random.default_rng(0)
+    with open(path, 'w', newline='') as f:
+        for i, line in enumerate(lines):
+            f.write(line)
+            if i and rng.random() < 0.02:
+                f.write('\n')
+
+
+def test_sharded_output_matches_single_process(tmp_path, monkeypatch, model):
+    monkeypatch.setattr(pipeline, 'MIN_SHARD_ROWS', 256)
+    outputs = {}
+    for workers in (1, 3):
+        uploads = tmp_path / f"workers{workers}"
+        uploads.mkdir()
+        write_messy_roster(uploads / "roster.csv", 4000)
+        summary = pipeline.run_risk_analysis(WEATHER_DATES[0], "roster.csv", uploads_dir=str(uploads),
+                                             shard_workers=workers)
+        outputs[workers] = (uploads / summary["output_file"]).read_bytes()
+    assert outputs[3] == outputs[1]
+    assert len(pd.read_csv(tmp_path / "workers1" / "roster.csv")) == 4000
+
+
+# The merge warns about the fractional ZIPs, which are there on purpose
+@pytest.mark.filterwarnings("ignore:You are merging on int and float")
+def test_zip_index_join_matches_merge(model):
+    patients, weather = make_frames(20_000, 500)
+    weather.loc[::40, 'aqi_category'] = None
+    prepared = pipeline.prepare_weather(weather)
+    zip_index = ZipIndex.build(weather)
+    assert zip_index is not None
+
+    fractional = patients.assign(plan_zip=patients['plan_zip'].astype(np.float64))
+    fractional.loc[::97, 'plan_zip'] += 0.5
+    fractional.loc[1::97, 'plan_zip'] = -fractional['plan_zip']
+    for frame in (patients, fractional):
+        pd.testing.assert_frame_equal(pipeline.join_weather(frame, prepared, zip_index),
+                                      pipeline.join_weather(frame, prepared),
+                                      check_categorical=False, check_dtype=False)
+    pd.testing.assert_frame_equal(pipeline.process_chunk(patients.copy(), prepared, zip_index, model),
+                                  pipeline.process_chunk(patients.copy(), prepared, None, model),
+                                  check_categorical=False, check_dtype=False)
@@ -0,0 +1,70 @@
+import os
+
+from incremental import manifest_path
+from result_cache import AnalysisCache
+from row_index import row_index_path
+
+
+def write(path, text="a,b\n1,2\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_eviction_removes_output_side_files(tmp_path):
+    cache = AnalysisCache(uploads_dir=str(tmp_path), max_entries=1)
+    output = tmp_path / "ANALYSIS_20170101_a.csv"
+    cube = tmp_path / "ANALYSIS_20170101_a_CUBE.parquet"
+    write(str(output))
+    write(str(cube))
+    write(row_index_path(str(output)))
+    write(manifest_path(str(output)))
+    cache.store("a", {"output_file": output.name, "cube_file": cube.name})
+
+    write(str(tmp_path / "ANALYSIS_20170101_b.csv"))
+    cache.store("b", {"output_file": "ANALYSIS_20170101_b.csv"})
+
+    assert not output.exists()
+    assert not cube.exists()
+    assert not os.path.exists(row_index_path(str(output)))
+    assert not os.path.exists(manifest_path(str(output)))
+    assert (tmp_path / "ANALYSIS_20170101_b.csv").exists()
+
+
+def test_index_is_shared_between_processes(tmp_path):
+    first = AnalysisCache(uploads_dir=str(tmp_path), max_entries=3)
+    second = AnalysisCache(uploads_dir=str(tmp_path), max_entries=3)
+    for name in "abcd":
+        write(str(tmp_path / f"ANALYSIS_20170101_{name}.csv"))
+
+    first.store("a", {"output_file": "ANALYSIS_20170101_a.csv"})
+    assert second.lookup("a") == {"output_file": "ANALYSIS_20170101_a.csv"}
+    second.store("b", {"output_file": "ANALYSIS_20170101_b.csv"})
+    first.store("c", {"output_file": "ANALYSIS_20170101_c.csv"})
+    assert first.lookup("b") is not None and second.lookup("c") is not None
+
+    # The entry bound applies to both together: "a" is the least recently used
+    second.store("d", {"output_file": "ANALYSIS_20170101_d.csv"})
+    assert first.lookup("a") is None
+    assert not (tmp_path / "ANALYSIS_20170101_a.csv").exists()
+    assert first.stats()["entries"] == second.stats()["entries"] == 3
+
+
+def _store_many(uploads_dir, prefix):
+    cache = AnalysisCache(uploads_dir=uploads_dir)
+    for i in range(20):
+        name = f"ANALYSIS_20170101_{prefix}{i}.csv"
+        write(os.path.join(uploads_dir, name))
+        cache.store(f"{prefix}{i}", {"output_file": name})
+
+
+def test_concurrent_stores_from_processes_are_all_kept(tmp_path):
+    import multiprocessing
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_store_many, args=(str(tmp_path), prefix)) for prefix in "xyz"]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert AnalysisCache(uploads_dir=str(tmp_path)).stats()["entries"] == 60
@@ -0,0 +1,43 @@
+import io
+
+import pandas as pd
+
+from row_index import build_row_index, read_page
+
+ROSTER = (
+    'member_id,note,Age\n'
+    '1,plain,40\n'
+    '\n'
+    '2,"two\nlines",50\n'
+    '   \r\n'
+    '3,"a ""quoted"", b",60\n'
+    '4,last,70'
+)
+
+
+def test_pages_follow_csv_records(tmp_path):
+    path = tmp_path / "roster.csv"
+    path.write_text(ROSTER)
+    expected = pd.read_csv(path)
+
+    pages = []
+    offset = 0
+    while offset is not None:
+        page = read_page(str(path), offset, 2)
+        assert page["total_rows"] == len(expected)
+        pages.append(pd.read_csv(io.StringIO(page["data"])))
+        offset = page["next_offset"]
+    pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), expected)
+
+
+def test_row_offsets_bound_records(tmp_path):
+    path = tmp_path / "roster.csv"
+    path.write_text(ROSTER)
+    index = build_row_index(str(path), stride=3)
+    data = path.read_bytes()
+    # Rows 1..2 parsed from their byte range alone
+    part = data[index.row_offset(1):index.row_offset(3)]
+    parsed = pd.read_csv(io.BytesIO(part), header=None, names=['member_id', 'note', 'Age'])
+    assert parsed['member_id'].tolist() == [2, 3]
+    assert parsed['note'].tolist() == ['two\nlines', 'a "quoted", b']
+    assert index.row_offset(index.total_rows) == len(data)
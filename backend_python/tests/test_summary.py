@@ -0,0 +1,26 @@
+import numpy as np
+
+import summary
+import synthetic
+from conftest import WEATHER_ZIPS
+
+
+def test_estimate_bounds_cover_a_grouped_roster(tmp_path, monkeypatch):
+    roster = synthetic.make_roster(60_000, synthetic.zip_codes(WEATHER_ZIPS), seed=5)
+    # Grouped by payer, as rosters usually are: the head of the file is all one payer
+    roster = roster.sort_values('Payer', kind='stable')
+    path = tmp_path / "roster.csv"
+    roster.to_csv(path, index=False)
+    monkeypatch.setattr(summary, "ESTIMATE_SAMPLE_ROWS", 2_000)
+    # Keep the exact pass from finishing (and replacing the estimate) first
+    monkeypatch.setattr(summary, "_exact_pass", lambda *args: None)
+
+    estimate = summary.get_summary(str(path), approximate=True)
+    assert estimate["approximate"] and estimate["rows_scanned"] == 2_000
+    assert estimate["total_records"] == len(roster)
+    truth = roster['Payer'].value_counts(normalize=True) * 100
+    for payer, pct in estimate["payer_distribution"].items():
+        assert abs(pct - truth[payer]) <= estimate["error_bounds"]["payer_distribution"][payer]
+    age_error = abs(estimate["average_age"] - roster['Age'].mean())
+    assert age_error <= estimate["error_bounds"]["average_age"] + 0.05
+    assert set(estimate["payer_distribution"]) == set(np.unique(roster['Payer']))
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import utils
+from bench_dedup_scoring import make_frame, score_every_row
+
+
+def sklearn_risk(model, features):
+    """Risk percentages straight from the pickled scaler and classifier."""
+    scaled = model['scaler'].transform(pd.DataFrame(features, columns=utils.FEATURE_NAMES))
+    return model['model'].predict_proba(scaled)[:, 1] * 100
+
+
+def test_fast_scorer_matches_the_pickle(model):
+    scorer = utils.build_fast_scorer(model)
+    assert scorer is not None
+    rng = np.random.default_rng(0)
+    # Off the parity grid, including fractional and out-of-domain values
+    features = np.column_stack([
+        rng.uniform(-10, 150, 5000), rng.uniform(-50, 800, 5000), rng.integers(0, 2, (5000, 3)),
+    ])
+    np.testing.assert_allclose(scorer.predict_proba(features) * 100, sklearn_risk(model, features),
+                               rtol=0, atol=utils.PARITY_TOLERANCE * 100)
+
+
+def test_dedup_scoring_matches_scoring_every_row(model, monkeypatch):
+    frame = make_frame(20_000, 300)
+    expected = score_every_row(frame)
+    np.testing.assert_array_equal(utils.predict_risk_batch(frame), expected)
+
+    # Wide spreads are deduplicated by hashing instead of direct indexing
+    monkeypatch.setattr(utils, 'DEDUP_MAX_DOMAIN', 0)
+    np.testing.assert_array_equal(utils.predict_risk_batch(frame), expected)
+
+    # Non-binary flags skip deduplication
+    frame.loc[::50, 'diabetes'] = 2
+    np.testing.assert_array_equal(utils.predict_risk_batch(frame), score_every_row(frame))
+
+
+def test_risk_table_matches_the_pickle(model, tmp_path):
+    table = utils.build_risk_table(model, str(tmp_path / "model.pkl"))
+    assert table.shape == (utils.TABLE_MAX_AGE + 1, utils.TABLE_MAX_AQI + 1, 8)
+    with_table = dict(model, risk_table=table)
+
+    rng = np.random.default_rng(1)
+    features = np.column_stack([
+        rng.integers(0, utils.TABLE_MAX_AGE + 1, 20_000), rng.integers(0, utils.TABLE_MAX_AQI + 1, 20_000),
+        rng.integers(0, 2, (20_000, 3)),
+    ])
+    # A few rows outside the table fall back to the model
+    features[:10, 0] = utils.TABLE_MAX_AGE + 5
+    features[10:20, 1] = -1
+    expected = sklearn_risk(model, features).round(2)
+    np.testing.assert_allclose(utils.predict_risk_percentages(features, with_table), expected, rtol=0, atol=1e-9)
+
+    # Persisted next to the model and mapped on the next load
+    reloaded = utils.build_risk_table(model, str(tmp_path / "model.pkl"))
+    assert isinstance(reloaded, np.memmap)
+    np.testing.assert_array_equal(reloaded, table)
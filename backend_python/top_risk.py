@@ -0,0 +1,219 @@
+"""
+Top-percentile risk selection for analysis outputs.
+
+Only the risk_percentage column is read. The percentile threshold comes from
+np.partition (linear-time selection) instead of a full sort, and preview
+pages are ordered with argpartition over the selected rows only. The
+filtered output file and the preview rows come from one pass that copies the
+selected raw CSV lines instead of parsing and re-formatting every row.
+Selections are cached per (file, percentile) so the dashboard can page
+through the top-risk members without recomputing.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+from itertools import compress
+
+import numpy as np
+import pandas as pd
+
+from columnar import column_names, iter_chunks, read_table
+from telemetry import cache_lookup
+
+SCAN_CHUNK_ROWS = 250_000
+# Rows fetched ahead of the requested page on every pass over the file
+PREFETCH_ROWS = 1_000
+MAX_CACHED_SELECTIONS = 32
+
+
+def quantile_threshold(values: np.ndarray, percentile: float) -> float:
+    """Linear-interpolated quantile (pandas/numpy default) via partial selection, ignoring NaN."""
+    if not 0 <= percentile <= 1:
+        raise ValueError("percentiles should all be in the interval [0, 1]")
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return float('nan')
+
+    position = percentile * (len(values) - 1)
+    lo = int(np.floor(position))
+    hi = min(lo + 1, len(values) - 1)
+    part = np.partition(values, [lo, hi])
+    a, b, t = part[lo], part[hi], position - lo
+    # Same lerp numpy uses, so the threshold matches Series.quantile exactly
+    diff = b - a
+    return float(b - diff * (1 - t) if t >= 0.5 else a + diff * t)
+
+
+class TopRiskSelection:
+    """Rows at or above the percentile threshold for one file version."""
+
+    def __init__(self, risk: np.ndarray, percentile: float):
+        self.n_rows = len(risk)
+        self.threshold = quantile_threshold(risk, percentile)
+        self.selected = np.flatnonzero(risk >= self.threshold)
+        self.selected_risk = risk[self.selected]
+        self._ordered = np.empty(0, dtype=np.int64)
+        self.rows = {}
+        self.output_written = False
+        self.lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return len(self.selected)
+
+    def ordered(self, stop: int) -> np.ndarray:
+        """File row numbers of the top `stop` selected rows, by risk descending."""
+        stop = min(stop, self.count)
+        if stop > len(self._ordered):
+            if stop < self.count:
+                top = np.argpartition(-self.selected_risk, stop - 1)[:stop]
+            else:
+                top = np.arange(self.count)
+            # Ties keep file order
+            top = top[np.lexsort((self.selected[top], -self.selected_risk[top]))]
+            self._ordered = self.selected[top]
+        return self._ordered[:stop]
+
+
+_selections = OrderedDict()
+_selections_lock = threading.Lock()
+
+
+def _get_selection(file_path: str, percentile: float) -> TopRiskSelection:
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, percentile)
+    with _selections_lock:
+        selection = _selections.get(key)
+        cache_lookup("top_risk_selection", selection is not None)
+        if selection is not None:
+            _selections.move_to_end(key)
+            return selection
+
+    risk = pd.to_numeric(read_table(file_path, columns=['risk_percentage'])['risk_percentage'], errors='coerce')
+    selection = TopRiskSelection(risk.to_numpy(dtype=np.float64), percentile)
+    with _selections_lock:
+        _selections[key] = selection
+        while len(_selections) > MAX_CACHED_SELECTIONS:
+            _selections.popitem(last=False)
+    return selection
+
+
+def _in_chunk(sorted_positions: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Chunk-local offsets of the sorted file positions that fall in [start, stop)."""
+    lo, hi = np.searchsorted(sorted_positions, [start, stop])
+    return sorted_positions[lo:hi] - start
+
+
+class _LineMismatch(Exception):
+    """The file's physical lines do not map 1:1 onto data rows (e.g. quoted newlines)."""
+
+
+def _read_lines(file_path: str, selection: TopRiskSelection, keep: np.ndarray):
+    """Header and the raw CSV lines of the (sorted) file rows in keep, without parsing."""
+    mask = np.zeros(selection.n_rows, dtype=bool)
+    mask[keep] = True
+    with open(file_path, 'rb') as src:
+        header = src.readline()
+        lines = list(compress(src, mask.tolist()))
+        if len(lines) != len(keep) or src.readline():
+            raise _LineMismatch()
+    return header, lines
+
+
+def _scan_lines(file_path: str, selection: TopRiskSelection, wanted: np.ndarray, output_path: str | None):
+    """Copy selected raw CSV lines to output_path (risk descending) and parse only the wanted rows."""
+    # Wanted rows are top-ranked, so they are always a subset of the selection
+    keep = selection.selected if output_path else wanted
+    header, lines = _read_lines(file_path, selection, keep)
+
+    if output_path:
+        ranks = np.searchsorted(keep, selection.ordered(selection.count))
+        with open(output_path, 'wb') as out:
+            out.write(header)
+            out.writelines(lines[r] for r in ranks.tolist())
+
+    if len(wanted):
+        raw = [lines[r] for r in np.searchsorted(keep, wanted).tolist()]
+        parsed = pd.read_csv(io.BytesIO(header + b''.join(raw)))
+        for j, position in enumerate(wanted):
+            selection.rows[int(position)] = parsed.iloc[[j]]
+
+
+def _scan_frames(file_path: str, selection: TopRiskSelection, wanted: np.ndarray, output_path: str | None):
+    """Parse the file in chunks, keeping the selected rows, then write them (risk descending)."""
+    keep = selection.selected if output_path else wanted
+    parts = []
+    start = 0
+    for chunk in iter_chunks(file_path, SCAN_CHUNK_ROWS):
+        stop = start + len(chunk)
+        parts.append(chunk.iloc[_in_chunk(keep, start, stop)])
+        start = stop
+    kept = pd.concat(parts) if parts else pd.DataFrame(columns=column_names(file_path))
+
+    if output_path:
+        ranks = np.searchsorted(keep, selection.ordered(selection.count))
+        kept.iloc[ranks].to_csv(output_path, index=False)
+    for r, position in zip(np.searchsorted(keep, wanted).tolist(), wanted):
+        selection.rows[int(position)] = kept.iloc[[r]]
+
+
+def _scan(file_path: str, selection: TopRiskSelection, wanted: np.ndarray, output_path: str | None):
+    """One pass over the file: write the filtered output and collect the wanted rows."""
+    wanted = np.sort(wanted)
+    try:
+        _scan_lines(file_path, selection, wanted, output_path)
+    except _LineMismatch:
+        _scan_frames(file_path, selection, wanted, output_path)
+
+
+def top_risk_rows(file_path: str, filename: str, percentile: float = 0.9, rows: int = 200,
+                  offset: int = 0, write_file: bool = True) -> dict:
+    """
+    Top percentile risk rows for an analysis file.
+
+    Parameters:
+    - file_path: path of the ANALYSIS file
+    - filename: its name (used to name the filtered output)
+    - percentile: threshold percentile (e.g., 0.9 for top 10%)
+    - rows / offset: preview page, ordered by risk descending
+    - write_file: whether to write the filtered rows (risk descending) to uploads
+
+    Returns:
+    - dict with count, threshold, csv_preview, output_file and offset
+    """
+    if 'risk_percentage' not in column_names(file_path):
+        raise LookupError("risk_percentage column not found. Run analysis first.")
+
+    selection = _get_selection(file_path, percentile)
+    with selection.lock:
+        page = selection.ordered(offset + rows)[offset:]
+
+        output_filename = None
+        output_path = None
+        if write_file:
+            output_filename = f"ANALYSIS_TOP{int((1-percentile)*100)}_{filename}"
+            if not selection.output_written or not os.path.exists(os.path.join("uploads", output_filename)):
+                output_path = os.path.join("uploads", output_filename)
+
+        missing = [int(p) for p in page if int(p) not in selection.rows]
+        if missing or output_path:
+            # Fetch a little past the requested page so the next pages are served from memory
+            wanted = selection.ordered(offset + rows + PREFETCH_ROWS)[offset:]
+            wanted = np.array([p for p in wanted if int(p) not in selection.rows], dtype=np.int64)
+            _scan(file_path, selection, wanted, output_path)
+            if output_path:
+                selection.output_written = True
+
+        if len(page):
+            preview = pd.concat([selection.rows[int(p)] for p in page])
+        else:
+            preview = pd.DataFrame(columns=column_names(file_path))
+
+    return {
+        "count": selection.count,
+        "threshold": selection.threshold if pd.notna(selection.threshold) else None,
+        "csv_preview": preview.to_csv(index=False),
+        "output_file": output_filename,
+        "offset": offset
+    }
@@ -1,147 +1,381 @@
 import os
 import pickle
+import hashlib
+import time
 import pandas as pd
 import numpy as np
-import zipcodes
-import httpx
-import asyncio
-import json
+from weather_store import DEFAULT_WEATHER_PATH, get_weather_store
+from live_aqi import fetch_aqi_for_zips
+from telemetry import gauge
 
-# Global variable to store the loaded model
+# The active model version (swapped in by model_registry)
 model_data = None
+MODEL_LOAD_SECONDS = gauge("model_load_seconds", "Time taken by the last model load (unpickle, fast scorer, risk table)")
 
+# (path, size, mtime_ns) -> sha256 hex digest
+_file_digests = {}
 
-import asyncio
-import httpx
-import json
-import pandas as pd
-import zipcodes
 
 def get_unique_zips(df):
-    return df['zip'].unique()
+    column = 'zip' if 'zip' in df.columns else 'zipcode'
+    return df[column].unique()
+
+async def fetch_multiple_zips(df, save=False):
+    """Live AQI for the unique ZIPs in df (a 'zip' or 'zipcode' column); see live_aqi."""
+    result_df = await fetch_aqi_for_zips(get_unique_zips(df))
+    result_df = result_df[["zip", "aqi"]]  # Only keep zip and aqi columns
+
+    if save:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        result_df.to_json(os.path.join(current_dir, "data", "tempaqi.json"), orient="records", indent=2)
+
+    return result_df
+
+# Feature order expected by the pickled scaler/model
+FEATURE_NAMES = ['AGE', 'AQI', 'Diabetes', 'Hypertension', 'Heart_Disease']
+# The matching roster columns used by predict_risk_batch
+BATCH_FEATURE_COLUMNS = ['Age', 'AQI', 'diabetes', 'hypertension', 'heart_disease']
+# Largest age x AQI x flags box deduplicated by direct indexing (beyond it, by hashing)
+DEDUP_MAX_DOMAIN = 1 << 22
+
+# Max allowed |fast - sklearn| probability difference on the parity grid
+PARITY_TOLERANCE = 1e-9
+
+# Optional precomputed risk table over the discrete input domain
+USE_RISK_TABLE = os.environ.get('RISK_LOOKUP_TABLE', '0').lower() in ('1', 'true', 'yes')
+TABLE_MAX_AGE = 120
+TABLE_MAX_AQI = 500
+
+
+class LinearRiskScorer:
+    """
+    Closed-form scorer for StandardScaler + binary logistic regression.
+
+    The scaler is folded into the coefficients so scoring is one dot product
+    and a sigmoid on raw (unscaled) feature arrays:
+        z = sum(coef_i * (x_i - mean_i) / scale_i) + intercept
+          = x @ weights + bias
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float):
+        self.weights = weights
+        self.bias = bias
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """Probability of the positive class for an (n, 5) array of raw features."""
+        z = features @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-z))
+
+
+def build_fast_scorer(data):
+    """
+    Extract a LinearRiskScorer from a loaded model pickle.
+
+    Returns None (callers fall back to sklearn) when the model is not a binary
+    logistic regression behind a StandardScaler, or when the folded scorer does
+    not match sklearn's predict_proba on the parity grid.
+    """
+    model = data['model']
+    scaler = data['scaler']
+    if type(model).__name__ not in ('LogisticRegression', 'LogisticRegressionCV'):
+        print(f"ℹ️ Fast scorer disabled: {type(model).__name__} is not a linear model")
+        return None
+    if type(scaler).__name__ != 'StandardScaler' or len(getattr(model, 'classes_', [])) != 2:
+        print("ℹ️ Fast scorer disabled: expected a StandardScaler and a binary classifier")
+        return None
+
+    n_features = len(FEATURE_NAMES)
+    coef = np.asarray(model.coef_, dtype=np.float64).reshape(-1)
+    mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+    weights = coef / scale
+    bias = float(model.intercept_[0] - np.sum(coef * mean / scale))
+    scorer = LinearRiskScorer(weights, bias)
+
+    # Parity check against sklearn over a grid spanning the input domain
+    ages, aqis, flags = np.meshgrid(np.arange(0, 121, 10), np.arange(0, 501, 50), np.arange(8), indexing='ij')
+    grid = np.column_stack([
+        ages.ravel(), aqis.ravel(),
+        (flags.ravel() >> 2) & 1, (flags.ravel() >> 1) & 1, flags.ravel() & 1
+    ]).astype(np.float64)
+    expected = model.predict_proba(scaler.transform(pd.DataFrame(grid, columns=FEATURE_NAMES)))[:, 1]
+    max_diff = float(np.max(np.abs(scorer.predict_proba(grid) - expected)))
+    if max_diff > PARITY_TOLERANCE:
+        print(f"⚠️ Fast scorer disabled: parity check failed (max diff {max_diff:.2e})")
+        return None
+
+    print(f"⚡ Fast scorer enabled (parity max diff {max_diff:.2e})")
+    return scorer
+
+
+def build_risk_table(data, model_path: str):
+    """
+    Precompute rounded risk for every (age, AQI, flags) combination.
 
-async def fetch_zip_data(zip_code, client):
-    info = zipcodes.matching(zip_code)
-    if not info:
-        return { "zip": zip_code, "aqi": None, "error": "Invalid ZIP code" }
+    The table has shape (TABLE_MAX_AGE + 1, TABLE_MAX_AQI + 1, 8) and stores
+    risk percentage * 100 as uint16, indexed by
+    [age, aqi, diabetes << 2 | hypertension << 1 | heart_disease].
+    It is persisted next to the model pickle, keyed by the model hash, and
+    reused on later startups. The persisted table is memory-mapped read-only,
+    so the server, its forked web workers and the job workers all share one
+    copy through the page cache.
+    """
+    table_path = f"{os.path.splitext(model_path)[0]}.{data['model_hash'][:16]}.risk_table.npy"
+    start = time.perf_counter()
+
+    if os.path.exists(table_path):
+        table = np.load(table_path, mmap_mode='r')
+        print(f"📦 Risk table mapped from {os.path.basename(table_path)} in {time.perf_counter() - start:.3f}s ({table.nbytes / 1e6:.1f} MB)")
+        return table
 
-    lat = info[0]["lat"]
-    lon = info[0]["long"]
+    ages, aqis, flags = np.meshgrid(
+        np.arange(TABLE_MAX_AGE + 1), np.arange(TABLE_MAX_AQI + 1), np.arange(8), indexing='ij'
+    )
+    flags = flags.ravel()
+    grid = np.column_stack([ages.ravel(), aqis.ravel(), (flags >> 2) & 1, (flags >> 1) & 1, flags & 1]).astype(np.float64)
+    probabilities = _score_features(grid, data)
+    table = np.rint(probabilities * 100 * 100).astype(np.uint16).reshape(ages.shape)
+    print(f"🧮 Risk table built in {time.perf_counter() - start:.3f}s ({table.nbytes / 1e6:.1f} MB)")
 
     try:
-        aqi_url = f"https://air-quality-api.open-meteo.com/v1/air-quality?latitude={lat}&longitude={lon}&daily=us_aqi&timezone=auto"
-        resp = await client.get(aqi_url)
-        data = resp.json()
+        tmp_path = f"{table_path}.tmp.npy"
+        np.save(tmp_path, table)
+        os.replace(tmp_path, table_path)
+        table = np.load(table_path, mmap_mode='r')
+    except OSError as e:
+        print(f"⚠️ Could not persist risk table: {e}")
+    return table
 
-        # Extract the first AQI value
-        aqi = data["daily"]["us_aqi"][0] if "daily" in data and "us_aqi" in data["hourly"] else None
 
-        return { "zip": zip_code, "aqi": aqi }
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, memoized until its size or mtime changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_digests.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        _file_digests[key] = digest
+    return digest
 
-    except Exception as e:
-        return { "zip": zip_code, "aqi": None, "error": str(e) }
 
-async def fetch_multiple_zips(df, save=False):
-    uzips = get_unique_zips(df)
+def remember_digest(path: str, digest: str):
+    """Record a file's SHA-256 computed elsewhere (e.g. while it was uploaded) so file_digest skips the read."""
+    stat = os.stat(path)
+    _file_digests[(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)] = digest
 
-    async with httpx.AsyncClient(timeout=10) as client:
-        tasks = [fetch_zip_data(z, client) for z in uzips]
-        results = await asyncio.gather(*tasks)
 
-        # Convert to DataFrame
-        result_df = pd.DataFrame(results)[["zip", "aqi"]]  # Only keep zip and aqi columns
+def load_model_file(model_path: str) -> dict:
+    """
+    Unpickle one model version and pre-warm it: hash, fast scorer (with its
+    parity check) and, with RISK_LOOKUP_TABLE, the risk table.
 
-        if save:
-            result_df.to_json("data/tempaqi.json", orient="records", indent=2)
+    Returns:
+    - model dict ready to score with (raises if the pickle cannot be loaded)
+    """
+    start = time.perf_counter()
+    print(f"🔍 Loading model from: {model_path}")
+    with open(model_path, 'rb') as f:
+        payload = f.read()
+    data = pickle.loads(payload)
+    data['model_hash'] = hashlib.sha256(payload).hexdigest()
+    data['fast_scorer'] = build_fast_scorer(data)
+    data['risk_table'] = build_risk_table(data, model_path) if USE_RISK_TABLE else None
+    MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+    return data
 
-        return result_df
 
 def load_model():
-    """Load the pickled model once at startup"""
-    global model_data
+    """Load every model version in the model registry and activate the current one (see model_registry)"""
+    import model_registry  # imports utils itself
+
     try:
-        # Get the absolute path to the model file
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(current_dir, '..', 'data-exploration', 'climate_health_model.pkl')
-        model_path = os.path.abspath(model_path)
-        
-        print(f"🔍 Looking for model at: {model_path}")
-        print(f"📁 Model file exists: {os.path.exists(model_path)}")
-        
-        with open(model_path, 'rb') as f:
-            model_data = pickle.load(f)
-        print("✅ Climate health model loaded successfully!")
-        print(f"📊 Model type: {type(model_data)}")
-        return True
+        data = model_registry.get_registry().refresh()
     except Exception as e:
         print(f"❌ Error loading model: {e}")
-        model_data = None
         return False
+    if data is None:
+        print(f"❌ No loadable model in {model_registry.MODEL_DIR}")
+        return False
+    print(f"✅ Climate health model loaded successfully! (version {data['version']})")
+    return True
+
+def _score_features(features: np.ndarray, data=None) -> np.ndarray:
+    """Positive-class probabilities for an (n, 5) raw feature array."""
+    data = data if data is not None else model_data
+    scorer = data.get('fast_scorer')
+    if scorer is not None:
+        return scorer.predict_proba(features)
+
+    # Create DataFrame with proper feature names to avoid sklearn warnings
+    input_df = pd.DataFrame(features, columns=FEATURE_NAMES)
+    input_scaled = data['scaler'].transform(input_df)
+    return data['model'].predict_proba(input_scaled)[:, 1]
 
-def predict_risk_percentage(age, aqi, diabetes, hypertension, heart_disease):
+def _risk_percentages(features: np.ndarray, model=None) -> np.ndarray:
+    """Risk percentages (rounded to 2 decimals) for an (n, 5) raw feature array.
+
+    Rows inside the risk table domain are answered by indexing; anything else
+    (out-of-range ages/AQI, non-binary flags, no table) uses the live model.
+    model defaults to the active model.
+    """
+    model = model if model is not None else model_data
+    table = model.get('risk_table')
+    if table is None:
+        return (_score_features(features, model) * 100).round(2)
+
+    ints = features.astype(np.int64, copy=False)
+    age, aqi = ints[:, 0], ints[:, 1]
+    flags = (ints[:, 2] << 2) | (ints[:, 3] << 1) | ints[:, 4]
+    # Unsigned views turn negative values into huge ones, so one comparison bounds each side
+    in_table = (
+        (age.view(np.uint64) <= TABLE_MAX_AGE)
+        & (aqi.view(np.uint64) <= TABLE_MAX_AQI)
+        & ((ints[:, 2] | ints[:, 3] | ints[:, 4]).view(np.uint64) <= 1)
+    )
+    if features.dtype.kind == 'f':
+        in_table &= (ints == features).all(axis=1)
+
+    flat_index = (age * (TABLE_MAX_AQI + 1) + aqi) * 8 + flags
+    if in_table.all():
+        return table.reshape(-1)[flat_index] / 100
+
+    risk = np.empty(len(features), dtype=np.float64)
+    risk[in_table] = table.reshape(-1)[flat_index[in_table]] / 100
+    risk[~in_table] = (_score_features(features[~in_table], model) * 100).round(2)
+    return risk
+
+def predict_risk_percentage(age, aqi, diabetes, hypertension, heart_disease, model=None):
     """
     Predict risk percentage using the trained climate health model
+    (model: a model registry version; defaults to the active one)
     
     Returns:
     - risk_percentage: predicted risk as percentage (0-100%)
     """
-    if model_data is None:
+    features = np.array([[age, aqi, diabetes, hypertension, heart_disease]], dtype=np.float64)
+    return float(predict_risk_percentages(features, model)[0])
+
+def predict_risk_percentages(features: np.ndarray, model=None) -> np.ndarray:
+    """
+    Risk percentages for many single-patient calls at once.
+
+    Parameters:
+    - features: (n, 5) array of raw (age, aqi, diabetes, hypertension,
+      heart_disease) rows, as predict_risk_percentage takes them
+    - model: model registry version to score with (defaults to the active one)
+
+    Returns:
+    - float64 array of risk percentages, equal to predict_risk_percentage row by row
+    """
+    model = model if model is not None else model_data
+    if model is None:
         raise Exception("Model not loaded")
-    
-    # Create DataFrame with proper feature names to avoid sklearn warnings
-    feature_names = ['AGE', 'AQI', 'Diabetes', 'Hypertension', 'Heart_Disease']
-    input_df = pd.DataFrame([[age, aqi, diabetes, hypertension, heart_disease]], 
-                           columns=feature_names)
-    
-    # Scale the input
-    input_scaled = model_data['scaler'].transform(input_df)
-    
-    # Predict probability and convert to percentage
-    risk_probability = model_data['model'].predict_proba(input_scaled)[0, 1]
-    risk_percentage = risk_probability * 100
-    
-    return round(risk_percentage, 2)
+    return _risk_percentages(features, model)
+
+def feature_columns(data_df) -> list:
+    """The five batch feature columns as int64 arrays, in model order (raises on missing values)."""
+    return [data_df[c].astype(np.int64).to_numpy() for c in BATCH_FEATURE_COLUMNS]
 
-def predict_risk_batch(data_df):
+def feature_matrix(columns: list) -> np.ndarray:
+    """
+    Contiguous (n, 5) integer feature matrix from feature_columns().
+
+    int16 covers every realistic age/AQI/flag value; int64 is used only when
+    some value does not fit.
+    """
+    fits = all(len(col) == 0 or (col.min() >= -32768 and col.max() <= 32767) for col in columns)
+    features = np.empty((len(columns[0]), len(columns)), dtype=np.int16 if fits else np.int64)
+    for i, col in enumerate(columns):
+        features[:, i] = col
+    return features
+
+def unique_feature_rows(columns: list):
+    """
+    Map rows onto their unique (age, AQI, flags) tuples.
+
+    Tuples are coded directly into the batch's age x AQI x flags box (no
+    hashing), which stays small for real rosters; wider spreads fall back to
+    pd.factorize on the same packed code.
+
+    Returns:
+    - (inverse, unique_rows) where unique_rows is an int16 feature matrix and
+      row i has the features of unique_rows[inverse[i]]; None when the flags
+      are not all 0/1 or age/AQI do not fit in int16
+    """
+    age, aqi, diabetes, hypertension, heart_disease = columns
+    if len(age) == 0 or ((diabetes | hypertension | heart_disease) & ~1).any():
+        return None
+    age_min, age_max = int(age.min()), int(age.max())
+    aqi_min, aqi_max = int(aqi.min()), int(aqi.max())
+    if min(age_min, aqi_min) < -32768 or max(age_max, aqi_max) > 32767:
+        return None
+
+    aqi_span = aqi_max - aqi_min + 1
+    domain = (age_max - age_min + 1) * aqi_span * 8
+    codes = age - age_min
+    codes *= aqi_span
+    codes += aqi - aqi_min
+    codes <<= 3
+    codes |= (diabetes << 2) | (hypertension << 1) | heart_disease
+
+    if domain <= max(DEDUP_MAX_DOMAIN, len(codes)):
+        present = np.zeros(domain, dtype=bool)
+        present[codes] = True
+        unique_codes = np.flatnonzero(present)
+        slot = np.cumsum(present, dtype=np.int32) - 1
+        inverse = slot[codes]
+    else:
+        inverse, unique_codes = pd.factorize(codes)
+
+    cell, flag_bits = np.divmod(unique_codes, 8)
+    age_offset, aqi_offset = np.divmod(cell, aqi_span)
+    unique_rows = np.column_stack([
+        age_offset + age_min, aqi_offset + aqi_min, (flag_bits >> 2) & 1, (flag_bits >> 1) & 1, flag_bits & 1
+    ]).astype(np.int16)
+    return inverse, unique_rows
+
+def predict_risk_batch(data_df, model=None):
     """
     Predict risk percentage for multiple patients at once (MUCH FASTER)
-    
+
+    Rows are mapped to unique (Age, AQI, flags) tuples; only the uniques are
+    scored and the results are scattered back to every row. With the risk
+    table loaded every row is already a single lookup, so there is nothing
+    to deduplicate.
+
     Parameters:
     - data_df: DataFrame with columns ['Age', 'AQI', 'diabetes', 'hypertension', 'heart_disease']
+    - model: model registry version to score with (defaults to the active one)
     
     Returns:
-    - list of risk percentages
+    - numpy array of risk percentages
     """
-    if model_data is None:
+    model = model if model is not None else model_data
+    if model is None:
         raise Exception("Model not loaded")
     
-    # Prepare feature names
-    feature_names = ['AGE', 'AQI', 'Diabetes', 'Hypertension', 'Heart_Disease']
-    
-    # Create input DataFrame with proper feature names
-    input_df = pd.DataFrame({
-        'AGE': data_df['Age'].astype(int),
-        'AQI': data_df['AQI'].astype(int), 
-        'Diabetes': data_df['diabetes'].astype(int),
-        'Hypertension': data_df['hypertension'].astype(int),
-        'Heart_Disease': data_df['heart_disease'].astype(int)
-    })
-    
-    # Handle any NaN values
-    input_df = input_df.fillna(0)
-    
-    # Scale all data at once (VECTORIZED - much faster)
-    input_scaled = model_data['scaler'].transform(input_df)
-    
-    # Predict all probabilities at once (BATCH PREDICTION - much faster)
-    risk_probabilities = model_data['model'].predict_proba(input_scaled)[:, 1]
-    risk_percentages = (risk_probabilities * 100).round(2)
-    
-    return risk_percentages.tolist()
+    columns = feature_columns(data_df)
+    if model.get('risk_table') is not None:
+        # Table lookups index with int64 directly
+        return _risk_percentages(np.column_stack(columns), model)
+
+    unique = unique_feature_rows(columns)
+    if unique is None:
+        return _risk_percentages(feature_matrix(columns), model)
+
+    inverse, unique_rows = unique
+    return _risk_percentages(unique_rows, model)[inverse]
 
 def get_weather(date: str, weather_path: str | None = None) -> pd.DataFrame:
     """
-    Load weather data and return filtered rows for a given YYYYMMDD date.
+    Return weather rows for a given YYYYMMDD date.
+
+    Served from the shared in-memory WeatherStore, which parses the CSV once,
+    indexes it by date and reloads when the file changes.
 
     Parameters:
     - date: string like '20170101'
@@ -150,55 +384,100 @@ def get_weather(date: str, weather_path: str | None = None) -> pd.DataFrame:
     Returns:
     - pandas DataFrame with columns ['zipcode', 'AQI', 'aqi_category'] for the given date
     """
-    # Resolve default path relative to this file
-    if weather_path is None:
+    store = get_weather_store(weather_path)
+    return store.rows(date, columns=['zipcode', 'AQI', 'aqi_category'])
+
+def get_weather_zip_index(date: str, weather_path: str | None = None):
+    """
+    Dense ZIP-indexed AQI/category arrays for one date (see weather_store.ZipIndex).
+
+    Returns:
+    - ZipIndex, or None when the date's rows cannot be indexed densely
+    """
+    return get_weather_store(weather_path).zip_index(date)
+
+def get_weather_range(start_date: str, end_date: str, weather_path: str | None = None) -> pd.DataFrame:
+    """
+    Return weather rows for every date in [start_date, end_date] (YYYYMMDD, inclusive).
+
+    Returns:
+    - pandas DataFrame with columns ['date', 'zipcode', 'AQI', 'aqi_category'], sorted by date
+    """
+    store = get_weather_store(weather_path)
+    return store.range_rows(start_date, end_date, columns=['date', 'zipcode', 'AQI', 'aqi_category'])
+
+_lift_table = None
+
+def load_lift_table(lift_path: str | None = None) -> dict:
+    """
+    Load data/aqi_lift_ip_pnpm.csv as a dense lookup array, cached until the file changes.
+
+    Returns:
+    - dict with 'lobs' and 'categories' (pandas Index of the axis labels) and
+      'lifts', a float array of shape (len(lobs) + 1, len(categories) + 1)
+      holding lift_vs_baseline. Cells without an entry are NaN, including the
+      extra last row/column, which categorical code -1 (unknown label) lands on.
+    """
+    global _lift_table
+    if lift_path is None:
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        weather_path = os.path.abspath(os.path.join(current_dir, 'data', 'weather_data.csv'))
+        lift_path = os.path.abspath(os.path.join(current_dir, 'data', 'aqi_lift_ip_pnpm.csv'))
+        if not os.path.exists(lift_path):
+            lift_path = os.path.abspath(os.path.join('data', 'aqi_lift_ip_pnpm.csv'))
 
-    if not os.path.exists(weather_path):
-        raise FileNotFoundError(f"Weather data not found at {weather_path}")
+    stat = os.stat(lift_path)
+    signature = (lift_path, stat.st_mtime_ns, stat.st_size)
+    if _lift_table is not None and _lift_table['signature'] == signature:
+        return _lift_table
 
-    # Read only necessary columns for speed
-    df = pd.read_csv(weather_path, usecols=['date', 'zipcode', 'AQI', 'aqi_category'])
-    filtered = df[df['date'].astype(str) == str(date)][['zipcode', 'AQI', 'aqi_category']]
-    return filtered.reset_index(drop=True)
+    lift_df = pd.read_csv(lift_path, usecols=['LOB', 'aqi_category', 'lift_vs_baseline'])
+    lobs = pd.Index(lift_df['LOB'].unique())
+    categories = pd.Index(lift_df['aqi_category'].unique())
+    lifts = np.full((len(lobs) + 1, len(categories) + 1), np.nan)
+    lifts[lobs.get_indexer(lift_df['LOB']), categories.get_indexer(lift_df['aqi_category'])] = lift_df['lift_vs_baseline']
+
+    _lift_table = {'signature': signature, 'path': lift_path, 'lobs': lobs, 'categories': categories, 'lifts': lifts}
+    return _lift_table
+
+def _label_codes(values, labels: pd.Index) -> np.ndarray:
+    """Map values onto positions in labels (-1 when absent) via factorize + a small gather."""
+    codes, uniques = pd.factorize(values)
+    # factorize marks missing values with -1, which picks the appended -1 here
+    positions = np.append(labels.get_indexer(uniques), -1)
+    return positions[codes]
 
 def calc_inpatient_dollars_increase(df: pd.DataFrame) -> pd.DataFrame:
-    """Augment dataframe with baseline_multiplier and inpatient_cost_increase using AQI lifts.
+    """Augment dataframe with lift_vs_baseline and inpatient_cost_increase using AQI lifts.
 
-    - Load lift table from data/aqi_lift_ip_pnpm.csv
-    - Ensure 'LOB' exists (fallback to 'Payer')
-    - Merge on ['LOB', 'aqi_category'] to get 'lift_vs_baseline'
-    - baseline_multiplier = lift_vs_baseline
-    - inpatient_cost_increase = zip_base_pred_IP_PMPM * (baseline_multiplier - 1)
-    """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    lift_path = os.path.abspath(os.path.join(current_dir, 'data', 'aqi_lift_ip_pnpm.csv'))
-    if not os.path.exists(lift_path):
-        lift_path = os.path.abspath(os.path.join('data', 'aqi_lift_ip_pnpm.csv'))
+    - Lift table comes from data/aqi_lift_ip_pnpm.csv (cached, reloaded on change)
+    - Line of business is read from 'LOB' (fallback to 'Payer')
+    - ('LOB', 'aqi_category') are mapped to integer codes and gathered from
+      the lift array to get 'lift_vs_baseline' (NaN when there is no entry)
+    - inpatient_cost_increase = zip_base_pred_IP_PMPM * (lift_vs_baseline - 1)
 
-    lift_df = pd.read_csv(lift_path)
+    Columns are added to df in place (no copy) and df is returned.
+    """
+    lift_table = load_lift_table()
 
-    working_df = df.copy()
+    lob_col = 'LOB' if 'LOB' in df.columns else 'Payer' if 'Payer' in df.columns else None
+    if lob_col is not None:
+        lob_codes = _label_codes(df[lob_col], lift_table['lobs'])
+    else:
+        lob_codes = np.full(len(df), -1)
+    category_codes = _label_codes(df['aqi_category'], lift_table['categories'])
 
-    # Merge multiplier
-    working_df = working_df.merge(
-        lift_df[['LOB', 'aqi_category', 'lift_vs_baseline']],
-        on=['LOB', 'aqi_category'],
-        how='left'
-    )
+    lift_values = lift_table['lifts'][lob_codes, category_codes]
+    df['lift_vs_baseline'] = lift_values
 
     base_col = 'zip_base_pred_IP_PMPM'
-    if base_col in working_df.columns:
-        working_df['inpatient_cost_increase'] = working_df[base_col] * (working_df['lift_vs_baseline'].fillna(1) - 1)
+    if base_col in df.columns:
+        df['inpatient_cost_increase'] = df[base_col] * (np.nan_to_num(lift_values, nan=1.0) - 1)
     else:
-        working_df['inpatient_cost_increase'] = np.nan
+        df['inpatient_cost_increase'] = np.nan
 
-    return working_df
+    return df
 
-def get_weather_current():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    weather_path = os.path.abspath(os.path.join(current_dir, 'data', 'weather_data.csv'))
-    df = pd.read_csv(weather_path, usecols=[ 'zipcode'])
-    df.to_csv('/data/zipaqi.csv',index=False)
-    return fetch_multiple_zips(df)
+async def get_weather_current():
+    """Live AQI for every ZIP in the weather data"""
+    df = pd.read_csv(DEFAULT_WEATHER_PATH, usecols=['zipcode'])
+    return await fetch_multiple_zips(df)
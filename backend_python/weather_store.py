@@ -0,0 +1,292 @@
+"""
+Memory-resident, date-indexed weather store.
+
+weather_data.csv is parsed once, sorted by date and indexed so that a single
+date lookup only touches the rows for that date, and a date range is one
+contiguous slice. For the patient join a date is also exposed as a dense
+ZIP-indexed array of AQI and category codes, so joining is a single gather.
+The file signature (mtime and size) is checked on every lookup and the store
+reloads itself when the source file changes.
+"""
+import bisect
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from telemetry import cache_lookup, gauge
+
+WEATHER_COLUMNS = ['date', 'zipcode', 'AQI', 'aqi_category']
+
+# WEATHER_DATA_PATH points the server at another weather file (e.g. a synthetic one for benchmarks)
+DEFAULT_WEATHER_PATH = os.path.abspath(
+    os.environ.get("WEATHER_DATA_PATH")
+    or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'weather_data.csv')
+)
+
+# ZIP codes are 5 digits, so a per-date ZIP index is a dense array of this length
+ZIP_INDEX_SIZE = 100_000
+MAX_CACHED_ZIP_INDEXES = 64
+
+WEATHER_LOAD_SECONDS = gauge("weather_load_seconds", "Time taken by the last weather_data.csv load")
+
+
+class ZipIndex:
+    """
+    Dense ZIP-indexed AQI and aqi_category codes for one date.
+
+    aqi is a uint32 array of length ZIP_INDEX_SIZE, category_codes an int16
+    array into categories (-1 for a missing category) and valid marks the
+    ZIPs that have a weather row with an AQI.
+    """
+
+    def __init__(self, aqi: np.ndarray, valid: np.ndarray, category_codes: np.ndarray,
+                 categories: pd.Index, aqi_dtype):
+        self.aqi = aqi
+        self.valid = valid
+        self.category_codes = category_codes
+        self.categories = categories
+        self.aqi_dtype = aqi_dtype
+
+    @classmethod
+    def build(cls, rows: pd.DataFrame):
+        """Index one date's rows; None when they cannot be represented densely
+        (duplicate, non-integral or out-of-range ZIPs, or non-integral AQI)."""
+        zips = pd.to_numeric(rows['zipcode'], errors='coerce')
+        aqi = rows['AQI']
+        usable = zips.notna() & aqi.notna()
+        zips, aqi, labels = zips[usable].to_numpy(), aqi[usable].to_numpy(), rows['aqi_category'][usable]
+        if len(zips) and (
+            (zips % 1 != 0).any() or zips.min() < 0 or zips.max() >= ZIP_INDEX_SIZE
+            or (aqi % 1 != 0).any() or aqi.min() < 0 or aqi.max() > np.iinfo(np.uint32).max
+        ):
+            return None
+        zips = zips.astype(np.int64)
+        if len(np.unique(zips)) != len(zips):
+            return None
+
+        codes, categories = pd.factorize(labels)
+        index = cls(
+            aqi=np.zeros(ZIP_INDEX_SIZE, dtype=np.uint32),
+            valid=np.zeros(ZIP_INDEX_SIZE, dtype=bool),
+            category_codes=np.full(ZIP_INDEX_SIZE, -1, dtype=np.int16),
+            categories=pd.Index(categories),
+            aqi_dtype=rows['AQI'].dtype,
+        )
+        index.aqi[zips] = aqi
+        index.valid[zips] = True
+        index.category_codes[zips] = codes
+        return index
+
+    def lookup(self, zips: np.ndarray):
+        """
+        Gather AQI and aqi_category for an array of numeric ZIPs.
+
+        Returns:
+        - (mask, aqi, aqi_category): mask marks the input rows with a match;
+          aqi (in the weather file's dtype) and aqi_category (a Categorical)
+          hold the values for those rows only
+        """
+        if zips.dtype.kind in 'iu':
+            positions = zips.astype(np.int64, copy=False)
+            # Negative ZIPs wrap to huge unsigned values, so one comparison bounds both sides
+            in_range = positions.view(np.uint64) < ZIP_INDEX_SIZE
+        else:
+            in_range = (zips >= 0) & (zips < ZIP_INDEX_SIZE) & (zips % 1 == 0)
+            positions = zips
+        positions = np.where(in_range, positions, 0).astype(np.int64, copy=False)
+        mask = in_range & self.valid[positions]
+        if not mask.all():
+            positions = positions[mask]
+
+        aqi = self.aqi[positions].astype(self.aqi_dtype, copy=False)
+        categories = pd.Categorical.from_codes(self.category_codes[positions], categories=self.categories)
+        return mask, aqi, categories
+
+
+class WeatherStore:
+    """Loads weather_data.csv once and serves per-date row ranges."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        # (frame, {date: (start, stop)}) swapped as one reference on reload
+        self._data = (None, {})
+        self._digests = {}
+        self._zip_indexes = {}
+
+        # Reporting
+        self.loads = 0
+        self.load_seconds = None
+        self.lookups = 0
+        self.lookup_seconds_total = 0.0
+        self.last_lookup_seconds = None
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _ensure_loaded(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Weather data not found at {self.path}")
+
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature != self._signature:
+                self._load(signature)
+
+    def _load(self, signature):
+        start = time.perf_counter()
+        df = pd.read_csv(self.path, usecols=WEATHER_COLUMNS)
+
+        # Sort once by the string form of the date so each date is a contiguous block
+        keys = df['date'].astype(str).to_numpy()
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        df = df.iloc[order].reset_index(drop=True)
+
+        unique_dates, starts = np.unique(keys, return_index=True)
+        stops = np.append(starts[1:], len(keys))
+        index = {d: (int(a), int(b)) for d, a, b in zip(unique_dates, starts, stops)}
+
+        self._data = (df, index)
+        self._digests = {}
+        self._zip_indexes = {}
+        self._signature = signature
+        self.loads += 1
+        self.load_seconds = time.perf_counter() - start
+        WEATHER_LOAD_SECONDS.set(self.load_seconds)
+        print(f"✅ Weather data loaded: {len(df)} rows, {len(index)} dates in {self.load_seconds:.3f}s")
+
+    def rows(self, date, columns=None) -> pd.DataFrame:
+        """
+        Return the rows for a single date.
+
+        Parameters:
+        - date: YYYYMMDD date (string or int)
+        - columns: optional list of columns to return (defaults to all loaded columns)
+
+        Returns:
+        - pandas DataFrame (a copy, safe to modify) with a fresh RangeIndex
+        """
+        self._ensure_loaded()
+        start = time.perf_counter()
+
+        frame, index = self._data
+        bounds = index.get(str(date))
+        if bounds is None:
+            result = frame.iloc[0:0]
+        else:
+            result = frame.iloc[bounds[0]:bounds[1]]
+        if columns is not None:
+            result = result[columns]
+        result = result.reset_index(drop=True)
+
+        elapsed = time.perf_counter() - start
+        self.lookups += 1
+        self.lookup_seconds_total += elapsed
+        self.last_lookup_seconds = elapsed
+        return result
+
+    def range_rows(self, start_date, end_date, columns=None) -> pd.DataFrame:
+        """
+        Return the rows for every date in [start_date, end_date].
+
+        Dates are YYYYMMDD, so string order is date order and the range is one
+        contiguous slice of the sorted frame.
+
+        Returns:
+        - pandas DataFrame (a copy, safe to modify) with a fresh RangeIndex
+        """
+        self._ensure_loaded()
+        start = time.perf_counter()
+
+        frame, index = self._data
+        dates = list(index)
+        lo = bisect.bisect_left(dates, str(start_date))
+        hi = bisect.bisect_right(dates, str(end_date))
+        if lo >= hi:
+            result = frame.iloc[0:0]
+        else:
+            result = frame.iloc[index[dates[lo]][0]:index[dates[hi - 1]][1]]
+        if columns is not None:
+            result = result[columns]
+        result = result.reset_index(drop=True)
+
+        elapsed = time.perf_counter() - start
+        self.lookups += 1
+        self.lookup_seconds_total += elapsed
+        self.last_lookup_seconds = elapsed
+        return result
+
+    def digest(self, date, end_date=None) -> str:
+        """Content hash of the rows for one date, or a date range (memoized until the file changes)."""
+        self._ensure_loaded()
+        key = str(date) if end_date is None else f"{date}-{end_date}"
+        digest = self._digests.get(key)
+        if digest is None:
+            rows = self.rows(date) if end_date is None else self.range_rows(date, end_date)
+            hashed = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+            digest = hashlib.sha256(hashed.tobytes()).hexdigest()
+            self._digests[key] = digest
+        return digest
+
+    def zip_index(self, date):
+        """
+        Dense ZipIndex for one date (memoized until the file changes).
+
+        Returns None when the date has no rows or its rows cannot be indexed
+        densely; callers then fall back to a merge on zipcode.
+        """
+        self._ensure_loaded()
+        key = str(date)
+        cache_lookup("zip_index", key in self._zip_indexes)
+        if key not in self._zip_indexes:
+            rows = self.rows(date, columns=['zipcode', 'AQI', 'aqi_category'])
+            index = ZipIndex.build(rows) if len(rows) else None
+            while len(self._zip_indexes) >= MAX_CACHED_ZIP_INDEXES:
+                self._zip_indexes.pop(next(iter(self._zip_indexes)))
+            self._zip_indexes[key] = index
+        return self._zip_indexes[key]
+
+    def dates(self):
+        """Return the sorted list of dates available in the store."""
+        self._ensure_loaded()
+        return list(self._data[1].keys())
+
+    def stats(self) -> dict:
+        """Cold-start parse time and lookup latency for reporting."""
+        frame, index = self._data
+        avg_lookup = self.lookup_seconds_total / self.lookups if self.lookups else None
+        return {
+            "path": self.path,
+            "loaded": frame is not None,
+            "rows": len(frame) if frame is not None else 0,
+            "dates": len(index),
+            "loads": self.loads,
+            "load_seconds": round(self.load_seconds, 4) if self.load_seconds is not None else None,
+            "lookups": self.lookups,
+            "avg_lookup_ms": round(avg_lookup * 1000, 3) if avg_lookup is not None else None,
+            "last_lookup_ms": round(self.last_lookup_seconds * 1000, 3) if self.last_lookup_seconds is not None else None,
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_weather_store(weather_path: str | None = None) -> WeatherStore:
+    """Return the shared WeatherStore for a path (defaults to data/weather_data.csv)."""
+    path = os.path.abspath(weather_path or DEFAULT_WEATHER_PATH)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = WeatherStore(path)
+            _stores[path] = store
+        return store